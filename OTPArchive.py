@@ -0,0 +1,547 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Archive
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPArchive.py pack <archive> <directory|glob|file|->...   Append text dumps to an archive
+      ./OTPArchive.py unpack <archive> [index...]                   Print dumps as 'vcgencmd otp_dump' text
+      ./OTPArchive.py find <archive> [--serial S] [--board-type T]  List matching records
+      ./OTPArchive.py index <archive>                               Create or update <archive>.idx
+      ./OTPArchive.py lookup <archive> [--serial S] [--mac M] ...   List records through the index
+
+ File layout, all little-endian:
+   header  16 bytes  magic 'RPiOTP\\r\\n', version (uint16), record size (uint16), reserved (uint32)
+   records 324 bytes timestamp (int64, seconds since the epoch, 0 if unknown),
+                     present (uint64, bit n set if region n + 8 was dumped),
+                     source (40 bytes, UTF-8, NUL padded),
+                     words (67 x uint32, indexed by region number)
+ A single snapshot is simply an archive holding one record.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+import OTPParser
+import OTPFleet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'RPiOTP\r\n'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+RECORD = struct.Struct('<qQ40s' + str(OTPParser.NUM_REGIONS) + 'I')
+SOURCE_LENGTH = 40
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([('timestamp', '<i8'),
+                                ('present', '<u8'),
+                                ('source', 'S' + str(SOURCE_LENGTH)),
+                                ('words', '<u4', (OTPParser.NUM_REGIONS,))])
+
+
+class InvalidArchiveError(Exception):
+    """Raised when a file is not an OTP archive."""
+    pass
+
+
+def pack_record(dump, timestamp=None):
+    """Pack an OTPDump (with an optional timestamp) into a binary record."""
+    source = (dump.source or '').encode('utf-8')[-SOURCE_LENGTH:]
+    return RECORD.pack(int(timestamp or 0), dump.present >> OTPParser.FIRST_REGION, source, *dump.words)
+
+
+def unpack_record(buffer, offset=0):
+    """Unpack a binary record, Return (OTPDump, timestamp or None)."""
+    fields = RECORD.unpack_from(buffer, offset)
+    dump = OTPParser.OTPDump(fields[2].rstrip(b'\0').decode('utf-8', 'ignore') or None)
+    dump.words[:] = OTPParser.array(OTPParser.WORD_TYPECODE, fields[3:])
+    dump.present = fields[1] << OTPParser.FIRST_REGION
+    return dump, fields[0] or None
+
+
+class ArchiveWriter(object):
+    """Append records to an archive, creating it if needed."""
+
+    def __init__(self, filename):
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+        else:
+            check_header(filename)
+        self.count = 0
+
+    def write(self, dump, timestamp=None):
+        """Append one dump."""
+        self.write_record(pack_record(dump, timestamp))
+
+    def write_record(self, record):
+        """Append one binary record, as packed by pack_record()."""
+        self.file.write(record)
+        self.count += 1
+
+    def close(self):
+        """Close the archive."""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_header(filename):
+    """Check the header of an archive file, Raise InvalidArchiveError if it is not one."""
+    with open(filename, 'rb') as archive_file:
+        header = archive_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise InvalidArchiveError(filename + ' is not an OTP archive (too short)')
+    magic, version, record_size, _ = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise InvalidArchiveError(filename + ' is not an OTP archive')
+    if version != VERSION or record_size != RECORD.size:
+        raise InvalidArchiveError(filename + ' is an unsupported OTP archive version (' + str(version) + ')')
+
+
+def is_archive(filename):
+    """Return whether a file is an OTP archive rather than a text dump, by its magic."""
+    try:
+        with open(filename, 'rb') as archive_file:
+            return archive_file.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+class OTPArchive(object):
+    """A memory-mapped archive of OTP records.
+    Records are decoded on access, records() and words() give zero-copy NumPy views of the whole file.
+    """
+
+    def __init__(self, filename):
+        check_header(filename)
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = (size - HEADER.size) // RECORD.size
+        if self.count:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = b''
+
+    def close(self):
+        """Unmap and close the archive."""
+        if isinstance(self.map, mmap.mmap):
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # NumPy views are still alive, the map is released along with them
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, index):
+        """Return the byte offset of a record."""
+        if not -self.count <= index < self.count:
+            raise IndexError('record index out of range')
+        return HEADER.size + (index % self.count) * RECORD.size
+
+    def view(self, index):
+        """Return a zero-copy memoryview of one binary record."""
+        start = self.offset(index)
+        return memoryview(self.map)[start: start + RECORD.size]
+
+    def __getitem__(self, index):
+        """Return record index as an OTPDump."""
+        return unpack_record(self.map, self.offset(index))[0]
+
+    def timestamp(self, index):
+        """Return the timestamp of a record, or None."""
+        return unpack_record(self.map, self.offset(index))[1]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def records(self):
+        """Return a zero-copy NumPy structured array of every record."""
+        if numpy is None:
+            sys.exit('OTPArchive requires numpy for array views!')
+        if not self.count:  # frombuffer refuses an offset at the end of the buffer
+            return numpy.zeros(0, dtype=RECORD_DTYPE)
+        return numpy.frombuffer(self.map, dtype=RECORD_DTYPE, count=self.count, offset=HEADER.size)
+
+    def words(self):
+        """Return a zero-copy (N x 67) NumPy view of the words of every record."""
+        return self.records()['words']
+
+    def matrix(self):
+        """Return the archive as an OTPMatrix without copying the words."""
+        import OTPMatrix
+        records = self.records()
+        return OTPMatrix.OTPMatrix(records['words'], records['present'])
+
+    def find(self, loc, value):
+        """Return the indices of the records whose named region equals value."""
+        region = OTPParser.REGIONS[loc]
+        if numpy is not None:
+            return [int(index) for index in numpy.flatnonzero(self.words()[:, region] == value)]
+        word_offset = HEADER.size + RECORD.size - 4 * (OTPParser.NUM_REGIONS - region)
+        return [index for index in range(self.count)
+                if struct.unpack_from('<I', self.map, word_offset + index * RECORD.size)[0] == value]
+
+
+INDEX_MAGIC = b'RPiOTPIX'
+INDEX_HEADER = struct.Struct('<8sHHIQQ')
+INDEX_KINDS = ('serial', 'mac', 'revision', 'batch')
+
+
+def parse_mac(text):
+    """Parse a MAC address (or prefix) like 'dc:a6:32', Return (value, number of hex digits)."""
+    digits = ''.join(character for character in text if character not in ':-.')
+    if len(digits) > 12 or not digits or not OTPParser.is_hex(digits):
+        raise ValueError("Invalid MAC address '" + text + "'")
+    return int(digits, 16), len(digits)
+
+
+def hex_argument(text):
+    """argparse type of a number in hex, with or without 0x."""
+    try:
+        return int(text, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid hex number '" + text + "'")
+
+
+def mac_argument(text):
+    """argparse type of a MAC address or prefix, checked with parse_mac()."""
+    try:
+        parse_mac(text)
+    except ValueError as exception:
+        raise argparse.ArgumentTypeError(str(exception))
+    return text
+
+
+def index_keys(dump):
+    """Return the {kind: key} of a dump for the index, MAC only if it has one."""
+    words = dump.words
+    keys = {
+        'serial': words[OTPParser.REGIONS['serial_number']],
+        'revision': words[OTPParser.REGIONS['revision_number']],
+        'batch': words[OTPParser.REGIONS['batch_number']],
+    }
+    mac_one = words[OTPParser.REGIONS['mac_address_one']]
+    if mac_one:
+        keys['mac'] = mac_one << 16 | words[OTPParser.REGIONS['mac_address_two']] >> 16
+    return keys
+
+
+def records_checksum(archive, start, stop, checksum=0):
+    """Return the CRC-32 of records start to stop of an archive, continuing checksum."""
+    if start >= stop:
+        return checksum
+    view = memoryview(archive.map)
+    try:
+        data = view[HEADER.size + start * RECORD.size: HEADER.size + stop * RECORD.size]
+        return zlib.crc32(data, checksum) & 0xffffffff
+    finally:
+        view.release()
+
+
+class ArchiveIndex(object):
+    """Sorted on-disk index of an archive, mapping serial, MAC, revision and batch number to record indices.
+    The index file is memory-mapped and searched with bisect, so lookups don't load it into memory.
+    File layout: header (magic, version, reserved, CRC-32 of the indexed records, records indexed, reserved),
+    then for every kind in INDEX_KINDS a uint64 count, count sorted uint64 keys and count uint64 record indices.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.indexed = 0
+        self.checksum = 0
+        self.keys = dict((kind, ()) for kind in INDEX_KINDS)
+        self.records = dict((kind, ()) for kind in INDEX_KINDS)
+        self.map = None
+        if os.path.exists(filename) and os.path.getsize(filename):
+            self._load()
+
+    def _load(self):
+        """Map the index file and point the key and record views into it."""
+        with open(self.filename, 'rb') as index_file:
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.checksum, self.indexed, _ = INDEX_HEADER.unpack_from(self.map)
+        if magic != INDEX_MAGIC or version != VERSION:
+            raise InvalidArchiveError(self.filename + ' is not an OTP archive index')
+        view = memoryview(self.map)
+        offset = INDEX_HEADER.size
+        for kind in INDEX_KINDS:
+            count = struct.unpack_from('<Q', self.map, offset)[0]
+            offset += 8
+            self.keys[kind] = view[offset: offset + 8 * count].cast('Q')
+            offset += 8 * count
+            self.records[kind] = view[offset: offset + 8 * count].cast('Q')
+            offset += 8 * count
+
+    def close(self):
+        """Release the index file."""
+        for kind in INDEX_KINDS:
+            self.keys[kind] = self.records[kind] = ()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def update(self, archive):
+        """Index the records added to archive since the last update, Return how many were added.
+        If the records indexed before don't match their checksum any more the archive was replaced,
+        and it is indexed again from the start.
+        """
+        checksum = records_checksum(archive, 0, min(self.indexed, len(archive)))
+        if self.indexed > len(archive) or checksum != self.checksum:
+            self.close()
+            self.indexed = 0
+            checksum = 0
+        added = len(archive) - self.indexed
+        checksum = records_checksum(archive, self.indexed, len(archive), checksum)
+        if numpy is not None:
+            merged = self._merge_numpy(archive)
+        else:
+            merged = self._merge(archive)
+        self.close()
+
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, VERSION, 0, checksum, len(archive), 0))
+            for kind in INDEX_KINDS:
+                keys, records = merged[kind]
+                index_file.write(struct.pack('<Q', len(keys)))
+                index_file.write(keys.tobytes())
+                index_file.write(records.tobytes())
+        os.replace(temporary, self.filename)
+        self._load()
+        return added
+
+    def _merge(self, archive):
+        """Merge the keys of the new records into the index, Return {kind: (keys, records)} arrays."""
+        new = dict((kind, []) for kind in INDEX_KINDS)
+        for index in range(self.indexed, len(archive)):
+            for kind, key in index_keys(archive[index]).items():
+                new[kind].append((key, index))
+        merged = {}
+        for kind in INDEX_KINDS:
+            pairs = heapq.merge(zip(self.keys[kind], self.records[kind]), sorted(new[kind]))
+            keys, records = OTPParser.array('Q'), OTPParser.array('Q')
+            for key, record in pairs:
+                keys.append(key)
+                records.append(record)
+            merged[kind] = (keys, records)
+        return merged
+
+    def _merge_numpy(self, archive):
+        """Same as _merge, with the keys taken straight from the archive's words."""
+        words = archive.words()[self.indexed:].astype(numpy.uint64)
+        records = numpy.arange(self.indexed, len(archive), dtype=numpy.uint64)
+        mac_one = words[:, OTPParser.REGIONS['mac_address_one']]
+        mac = mac_one << numpy.uint64(16) | words[:, OTPParser.REGIONS['mac_address_two']] >> numpy.uint64(16)
+        new = {
+            'serial': (words[:, OTPParser.REGIONS['serial_number']], records),
+            'revision': (words[:, OTPParser.REGIONS['revision_number']], records),
+            'batch': (words[:, OTPParser.REGIONS['batch_number']], records),
+            'mac': (mac[mac_one != 0], records[mac_one != 0]),
+        }
+        merged = {}
+        for kind in INDEX_KINDS:
+            keys = numpy.concatenate([numpy.asarray(self.keys[kind], dtype=numpy.uint64), new[kind][0]])
+            indices = numpy.concatenate([numpy.asarray(self.records[kind], dtype=numpy.uint64), new[kind][1]])
+            order = numpy.argsort(keys, kind='stable')
+            merged[kind] = (keys[order], indices[order])
+        return merged
+
+    def is_current(self, archive):
+        """Return True if the index covers every record of archive, and they are still the ones it indexed."""
+        return self.indexed == len(archive) and records_checksum(archive, 0, self.indexed) == self.checksum
+
+    def range(self, kind, low, high):
+        """Return the record indices whose key of kind is between low and high (inclusive)."""
+        keys = self.keys[kind]
+        start = bisect.bisect_left(keys, low)
+        end = bisect.bisect_right(keys, high)
+        return list(self.records[kind][start:end])
+
+    def lookup(self, kind, key):
+        """Return the record indices whose key of kind equals key."""
+        return self.range(kind, key, key)
+
+    def mac_prefix(self, prefix):
+        """Return the record indices whose MAC address starts with prefix, for example 'dc:a6:32'."""
+        value, digits = parse_mac(prefix)
+        shift = 4 * (12 - digits)
+        return self.range('mac', value << shift, ((value + 1) << shift) - 1)
+
+
+def iter_text_dumps(name):
+    """Yield (dump, timestamp) for the text dumps in a file, or '-' for stdin."""
+    if name == '-':
+        stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        for dump in OTPParser.iter_dumps(stream, 'stdin'):
+            yield dump, time.time()
+    else:
+        yield OTPParser.OTPDump.from_file(name), os.path.getmtime(name)
+
+
+def update_index(filename):
+    """Bring the index of an archive up to date."""
+    archive_index = ArchiveIndex(filename + '.idx')
+    with OTPArchive(filename) as archive:
+        added = archive_index.update(archive)
+    archive_index.close()
+    sys.stderr.write('Indexed ' + str(added) + ' new records.\n')
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Convert OTP dumps to and from the binary archive format.')
+    commands = parser.add_subparsers(dest='command')
+    pack = commands.add_parser('pack', help='append text dumps to an archive')
+    pack.add_argument('archive')
+    pack.add_argument('paths', nargs='+', help="dump files, directories, glob patterns or '-' for stdin")
+    pack.add_argument('--no-timestamp', action='store_true', help="don't record file modification times")
+    unpack = commands.add_parser('unpack', help="print records as 'vcgencmd otp_dump' text")
+    unpack.add_argument('archive')
+    unpack.add_argument('indices', nargs='*', type=int, help='records to print (default: all)')
+    find = commands.add_parser('find', help='list the records matching a query')
+    find.add_argument('archive')
+    find.add_argument('--serial', type=hex_argument, help='serial number, in hex')
+    find.add_argument('--board-type', help="board type name, for example '4B'")
+    index = commands.add_parser('index', help='create or update the index of an archive')
+    index.add_argument('archive')
+    lookup = commands.add_parser('lookup', help='list the records matching a key through the index')
+    lookup.add_argument('archive')
+    lookup.add_argument('--serial', type=hex_argument, help='serial number, in hex')
+    lookup.add_argument('--revision', type=hex_argument, help='revision number, in hex')
+    lookup.add_argument('--batch', type=hex_argument, help='batch number, in hex')
+    lookup.add_argument('--mac', type=mac_argument, help='MAC address, or a prefix of one')
+    lookup.add_argument('--mac-range', nargs=2, type=mac_argument, metavar=('FIRST', 'LAST'),
+                        help='MAC addresses from FIRST to LAST')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'pack':
+            bad = 0
+            names = []
+            for name in args.paths:
+                names.extend([name] if name == '-' else OTPFleet.expand_paths([name]))
+            with ArchiveWriter(args.archive) as writer:
+                for name in names:
+                    try:
+                        for dump, timestamp in iter_text_dumps(name):
+                            writer.write(dump, None if args.no_timestamp else timestamp)
+                    except (OTPParser.InvalidDumpError, IOError, OSError) as exception:
+                        sys.stderr.write(name + ': ' + str(exception) + '\n')
+                        bad += 1
+            sys.stderr.write('Packed ' + str(writer.count) + ' dumps.\n')
+            if os.path.exists(args.archive + '.idx'):
+                update_index(args.archive)
+            return 1 if bad else 0
+
+        if args.command == 'index':
+            update_index(args.archive)
+            return 0
+
+        if args.command == 'lookup':
+            if not os.path.exists(args.archive + '.idx'):
+                sys.exit("No index of " + args.archive + ", run 'OTPArchive.py index " + args.archive + "' first.")
+            archive_index = ArchiveIndex(args.archive + '.idx')
+            with OTPArchive(args.archive) as archive:
+                current = archive_index.is_current(archive)
+            if not current:
+                archive_index.close()
+                sys.exit("The index of " + args.archive + " is out of date, run 'OTPArchive.py index " +
+                         args.archive + "' again.")
+            matches = None
+            queries = []
+            if args.serial is not None:
+                queries.append(archive_index.lookup('serial', args.serial))
+            if args.revision is not None:
+                queries.append(archive_index.lookup('revision', args.revision))
+            if args.batch is not None:
+                queries.append(archive_index.lookup('batch', args.batch))
+            if args.mac:
+                queries.append(archive_index.mac_prefix(args.mac))
+            if args.mac_range:
+                queries.append(archive_index.range('mac', parse_mac(args.mac_range[0])[0], parse_mac(args.mac_range[1])[0]))
+            for query in queries:
+                matches = set(query) if matches is None else matches & set(query)
+            with OTPArchive(args.archive) as archive:
+                for record in sorted(matches or ()):
+                    dump = archive[record]
+                    print(record, dump.get('serial_number', 'hex'), dump.format_mac(), dump.source)
+            archive_index.close()
+            return 0
+
+        if args.command == 'unpack':
+            with OTPArchive(args.archive) as archive:
+                for index in args.indices or range(len(archive)):
+                    sys.stdout.write(archive[index].to_text())
+            return 0
+
+        if args.command == 'find':
+            with OTPArchive(args.archive) as archive:
+                matches = set(range(len(archive)))
+                if args.serial is not None:
+                    matches &= set(archive.find('serial_number', args.serial))
+                if args.board_type and numpy is None:
+                    matches &= set(index for index, dump in enumerate(archive) if dump.has('revision_number') and
+                                   dump.revision_info().board_type == args.board_type)
+                elif args.board_type:
+                    matrix = archive.matrix()
+                    codes = matrix.board_codes()['board_type']
+                    import OTPMatrix
+                    matches &= set(int(index) for index in
+                                   numpy.flatnonzero(OTPMatrix.names('board_type', codes) == args.board_type))
+                for index in sorted(matches):
+                    dump = archive[index]
+                    print(index, dump.get('serial_number', 'hex'), dump.get('revision_number', 'hex'), dump.source)
+            return 0
+    except InvalidArchiveError as exception:
+        sys.exit(str(exception))
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Parser Benchmarks
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPBenchmark.py [-n iterations] [-c copies] [-s startup_runs] [--only name,...]
+                        [--save results.json] [--compare results.json [--tolerance 0.2]]
+ Latency, throughput and memory benchmarks run on synthetic dumps from OTPGenerator.
+ Results saved with --save can be compared with a later run with --compare, which exits
+ with status 1 if any result got worse than the tolerance.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import OTPParser
+import OTPGenerator
+
+# A Raspberry Pi 4B (4GB, Sony UK) dump, with the serial and MAC made up.
+SAMPLE_DUMP = """08:00000000
+09:00000000
+10:00000000
+11:00000000
+12:00000000
+13:00000000
+14:00000000
+15:00000000
+16:00280000
+17:1020000a
+18:1020000a
+19:ffffffff
+20:ffffffff
+21:ffffffff
+22:ffffffff
+23:ffffffff
+24:ffffffff
+25:ffffffff
+26:ffffffff
+27:0000ae4d
+28:9b2c5d7e
+29:64d3a281
+30:00c03111
+31:2f1a4c00
+32:00000001
+33:00000000
+34:00000000
+35:00000000
+36:00000000
+37:00000000
+38:00000000
+39:00000000
+40:00000000
+41:00000000
+42:00000000
+43:00000000
+44:00000000
+45:00000000
+46:00000000
+47:00000000
+48:00000000
+49:00000000
+50:00000000
+51:00000000
+52:00000000
+53:00000000
+54:00000000
+55:00000000
+56:00000000
+57:00000000
+58:00000000
+59:00000000
+60:00000000
+61:00000000
+62:00000000
+63:00000000
+64:7e9c0000
+65:dca6325d
+66:0200c086
+"""
+
+
+def legacy_decoder(dump):
+    """Decode every field the way the handlers used to.
+    Each access re-parses the hex word, formats it as a '032b' string and slices it,
+    with the handler's (start, end) indices dict rebuilt on every call.
+    """
+    raw = dict((region, format(word, '08x')) for region, word in enumerate(dump.words))
+    tables = {}
+    for field in OTPParser.COMPILED_FIELDS.values():
+        tables.setdefault(field.loc, {})[field.name] = (32 - field.shift - field.width, 32 - field.shift)
+
+    def handler(loc, name):
+        indices = dict(tables[loc])[name]
+        return format(int(raw[OTPParser.REGIONS[loc]], 16), '032b')[indices[0]: indices[1]]
+
+    keys = [key.split('.', 1) for key in OTPParser.COMPILED_FIELDS]
+    return lambda: [handler(loc, name) for loc, name in keys]
+
+
+# Results of this run as {name: (value, unit)}, rates are better higher, times and sizes lower.
+RESULTS = {}
+
+
+def record(name, value, unit):
+    """Print and keep one benchmark result."""
+    RESULTS[name] = (value, unit)
+    print('%-32s : %12.1f %s' % (name, value, unit))
+
+
+def report(name, count, seconds, unit='fields'):
+    """Print and keep one throughput result."""
+    record(name, count / seconds, unit + '/s')
+
+
+def bench_fields(iterations):
+    """Compare decoded fields per second for the old and new decoders."""
+    dump = OTPParser.OTPDump.parse(SAMPLE_DUMP.splitlines())
+    count = len(OTPParser.COMPILED_FIELDS)
+    keys = [key.split('.', 1) for key in OTPParser.COMPILED_FIELDS]
+    handlers = {
+        'control': dump.control,
+        'bootmode': dump.bootmode,
+        'boot_signing_parity': dump.boot_signing_parity,
+        'revision_number': dump.revision,
+        'overclock': dump.overclock,
+        'advanced_boot': dump.advanced_boot,
+    }
+
+    report('legacy string slicing', count * iterations,
+           timeit.timeit(legacy_decoder(dump), number=iterations))
+    report('handlers (compatibility layer)', count * iterations,
+           timeit.timeit(lambda: [handlers[loc](name) for loc, name in keys], number=iterations))
+    report('OTPDump.decode() single pass', count * iterations,
+           timeit.timeit(dump.decode, number=iterations))
+
+
+def bench_revisions(iterations):
+    """Compare decoding a revision word with and without the revision cache."""
+    words = [0x00c03111, 0x00a02082, 0x00900092, 0x0000000e, 0x00d04170]
+    uncached = OTPParser.decode_revision.__wrapped__
+    report('revision decode (uncached)', len(words) * iterations,
+           timeit.timeit(lambda: [uncached(word) for word in words], number=iterations), 'words')
+    report('revision decode (cached)', len(words) * iterations,
+           timeit.timeit(lambda: [OTPParser.decode_revision(word) for word in words], number=iterations), 'words')
+    print(OTPParser.revision_cache_info())
+
+
+def check_stream_errors(data):
+    """Check that OTPStreamParser skips the rest of a dump with a bad line and carries on with the next one."""
+    corrupt = data.replace(b'17:1020000a', b'17:zz20000a')
+    assert corrupt != data
+    parser = OTPParser.OTPStreamParser()
+    dumps = parser.feed(corrupt + data)
+    try:
+        next(dumps)
+    except OTPParser.InvalidDumpError:
+        pass
+    else:
+        raise AssertionError('the bad line was not reported')
+    expected = OTPParser.OTPDump.from_bytes(data)
+    assert [dump.words for dump in list(dumps) + list(parser.close())] == [expected.words]
+
+
+def bench_reader(iterations, copies):
+    """Compare the line by line readers with the whole buffer bytes readers."""
+    text = SAMPLE_DUMP.splitlines(True)
+    data = SAMPLE_DUMP.encode('ascii')
+    report('OTPDump.parse() lines', iterations,
+           timeit.timeit(lambda: OTPParser.OTPDump.parse(text), number=iterations), 'dumps')
+    report('OTPDump.from_bytes() buffer', iterations,
+           timeit.timeit(lambda: OTPParser.OTPDump.from_bytes(data), number=iterations), 'dumps')
+
+    concatenated = data * copies
+    streamed = list(OTPParser.iter_dumps(io.BytesIO(concatenated)))
+    buffered = OTPParser.parse_buffer(concatenated)
+    assert [dump.words for dump in streamed] == [dump.words for dump in buffered]
+    check_stream_errors(data)
+    report('iter_dumps() ' + str(copies) + ' dumps', copies,
+           timeit.timeit(lambda: list(OTPParser.iter_dumps(io.BytesIO(concatenated))), number=1), 'dumps')
+    report('parse_buffer() ' + str(copies) + ' dumps', copies,
+           timeit.timeit(lambda: OTPParser.parse_buffer(concatenated), number=1), 'dumps')
+
+
+def bench_startup(runs):
+    """Measure the cold start plus decode of one dump by the command line, as run on every boot."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'OTPParser.py')
+    handle, filename = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(handle, 'w') as dump_file:
+        dump_file.write(SAMPLE_DUMP)
+    commands = [
+        ('python (no OTPParser)', [sys.executable, '-c', 'pass']),
+        ('OTPParser.py', [sys.executable, script, filename]),
+        ('OTPParser.py --fields', [sys.executable, script, filename,
+                                   '--fields', 'serial_number,revision_number,mac_address']),
+        ('-m OTPParser --fields', [sys.executable, '-m', 'OTPParser', filename,
+                                   '--fields', 'serial_number,revision_number,mac_address']),
+        ('OTPParser.py -f json', [sys.executable, script, filename, '-f', 'json']),
+    ]
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for name, command in commands:
+                times = []
+                for _ in range(runs):
+                    start = timeit.default_timer()
+                    subprocess.check_call(command, stdout=devnull, cwd=os.path.dirname(script))
+                    times.append(timeit.default_timer() - start)
+                times.sort()
+                record('startup ' + name, times[len(times) // 2] * 1000, 'ms')
+    finally:
+        os.remove(filename)
+
+
+def percentile(values, fraction):
+    """Return the value below which fraction of the sorted list values lie."""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def bench_latency(samples):
+    """Measure the latency of parsing, decoding and checking one dump, over every kind of board."""
+    dumps = [text.encode('ascii') for text, _ in OTPGenerator.DumpGenerator(1).generate(samples)]
+    timer = timeit.default_timer
+    times = []
+    for data in dumps:
+        start = timer()
+        dump = OTPParser.OTPDump.from_bytes(data)
+        dump.decode()
+        dump.findings()
+        times.append(timer() - start)
+    times.sort()
+    record('latency p50', percentile(times, 0.5) * 1e6, 'us')
+    record('latency p99', percentile(times, 0.99) * 1e6, 'us')
+
+
+def bench_throughput(count):
+    """Measure dumps per second through the batch readers, clean and with 5% corrupted dumps."""
+    clean = [text.encode('ascii') for text, _ in OTPGenerator.DumpGenerator(2).generate(count)]
+    mixed = [text.encode('ascii') for text, _ in OTPGenerator.DumpGenerator(3).generate(count, 0.05)]
+    concatenated = b''.join(clean)
+
+    def parse_files(files):
+        for data in files:
+            try:
+                OTPParser.OTPDump.from_bytes(data).findings()
+            except OTPParser.InvalidDumpError:
+                pass
+
+    report('throughput files', count, timeit.timeit(lambda: parse_files(clean), number=1), 'dumps')
+    report('throughput files, 5% corrupt', count, timeit.timeit(lambda: parse_files(mixed), number=1), 'dumps')
+    report('throughput parse_buffer()', count,
+           timeit.timeit(lambda: OTPParser.parse_buffer(concatenated), number=1), 'dumps')
+
+
+def bench_memory(count):
+    """Measure the peak memory of parsing a fleet of dumps in one buffer."""
+    concatenated = b''.join(text.encode('ascii') for text, _ in OTPGenerator.DumpGenerator(4).generate(count))
+    tracemalloc.start()
+    try:
+        dumps = OTPParser.parse_buffer(concatenated)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del dumps
+    record('peak memory parse_buffer()', peak / 1048576.0, 'MiB')
+    record('peak memory per dump', peak / count, 'bytes')
+
+
+def bench_encoder(count):
+    """Measure images per second stamped out by the encoder, as text and as archive records."""
+    for binary, name in ((False, 'encoder text'), (True, 'encoder archive records')):
+        generator = OTPGenerator.DumpGenerator(5)
+        report(name, count, timeit.timeit(lambda: sum(1 for _ in generator.images(count, binary)), number=1), 'images')
+
+
+def compare(baseline, tolerance):
+    """Compare RESULTS with a saved run, Return the names of the results that got worse than tolerance."""
+    regressions = []
+    for name, (value, unit) in sorted(RESULTS.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name][0]
+        better_higher = unit.endswith('/s')
+        change = (value - old) / old if old else 0.0
+        if (-change if better_higher else change) > tolerance:
+            regressions.append(name)
+            print('REGRESSION %-32s : %12.1f -> %.1f %s (%+.0f%%)' % (name, old, value, unit, change * 100))
+    return regressions
+
+
+BENCHMARKS = ('fields', 'revisions', 'reader', 'latency', 'throughput', 'memory', 'encoder', 'startup')
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Benchmark the OTP parser.')
+    parser.add_argument('-n', '--iterations', type=int, default=20000, help='dumps to decode per benchmark')
+    parser.add_argument('-c', '--copies', type=int, default=50000, help='concatenated dumps for the reader benchmark')
+    parser.add_argument('-s', '--startup-runs', type=int, default=20, help='command line runs per startup benchmark')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='benchmarks to run: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown for --compare (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    selected = args.only.split(',')
+    for name in selected:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark ' + repr(name) + ', choose from ' + ', '.join(BENCHMARKS))
+    if 'fields' in selected:
+        bench_fields(args.iterations)
+    if 'revisions' in selected:
+        bench_revisions(args.iterations)
+    if 'reader' in selected:
+        bench_reader(args.iterations, args.copies)
+    if 'latency' in selected:
+        bench_latency(args.iterations)
+    if 'throughput' in selected:
+        bench_throughput(args.copies)
+    if 'memory' in selected:
+        bench_memory(args.copies)
+    if 'encoder' in selected:
+        bench_encoder(args.copies * 10)
+    if 'startup' in selected:
+        bench_startup(args.startup_runs)
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(RESULTS, results_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as results_file:
+            if compare(json.load(results_file), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Decode Cache
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPFleet.py <paths>... --cache [FILE]      or   ./OTPService.py --cache [FILE]
+      ./OTPCache.py [FILE] [--clear]
+ Boards send the same dump on every boot, so decoded records are kept in an SQLite file
+ keyed by a hash of the dump image: the present mask and the 67 words, whatever the
+ whitespace, line endings or source of the text. A dump seen before costs one hash and
+ one lookup instead of the full decode.
+ Records are also keyed by a fingerprint of the decoder tables (REPORT, RULES, FIELDS, the
+ name tables) and CACHE_VERSION, so a changed decoder misses instead of serving stale records.
+ The file holds at most --cache-size records, the least recently used ones are dropped.
+ Several processes can share it. Lookups don't lock, new records, use times and hit
+ counters are written in batches in one transaction. OTPCache.py prints the hit rate.
+ The default file is $XDG_CACHE_HOME/rpi-otp/decoded.sqlite (~/.cache by default).
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import hashlib
+import json
+import marshal
+import os
+import sqlite3
+import struct
+import sys
+import time
+from collections import OrderedDict
+
+import OTPParser
+
+CACHE_VERSION = 1  # Bump when decoding changes in a way the tables of decoder_fingerprint() don't show
+DEFAULT_SIZE = 100000  # Records kept
+FLUSH_EVERY = 256  # New records and hits held before writing them
+
+# Present mask (67 bits) then the 67 words, little endian.
+IMAGE = struct.Struct('<QB%dI' % OTPParser.NUM_REGIONS)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS decoded (
+    key BLOB NOT NULL,
+    variant TEXT NOT NULL,
+    output BLOB NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (key, variant)
+);
+CREATE INDEX IF NOT EXISTS decoded_used ON decoded (used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0), ('evictions', 0);
+'''
+
+try:
+    hashlib.blake2b
+except AttributeError:  # Python 2 and 3.5 have no BLAKE2
+    def digest(data):
+        """Return the 16 byte cache key of an image."""
+        return hashlib.sha1(data).digest()[:16]
+else:
+    def digest(data):
+        """Return the 16 byte cache key of an image."""
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def default_path():
+    """Return the default cache file."""
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                        'rpi-otp', 'decoded.sqlite')
+
+
+def image_key(dump):
+    """Return the cache key of a dump, a hash of its present mask and words."""
+    present = dump.present
+    return digest(IMAGE.pack(present & 0xffffffffffffffff, present >> 64, *dump.words))
+
+
+def decoder_fingerprint():
+    """Return a short hash of CACHE_VERSION and the tables records are decoded with,
+    so records cached before the decoder changed are not served again.
+    """
+    tables = [CACHE_VERSION, marshal.version]
+    for table in (OTPParser.MEMORY_SIZES, OTPParser.MANUFACTURERS, OTPParser.PROCESSORS, OTPParser.BOARD_TYPES,
+                  OTPParser.BOARD_REVISIONS, OTPParser.REGIONS):
+        tables.append(sorted(table.items()))
+    tables.append(sorted((code, sorted(board.items())) for code, board in OTPParser.LEGACY_REVISIONS.items()))
+    tables.append([field[:4] + (field[4] and field[4].__name__,) for field in OTPParser.FIELDS])
+    tables.extend((OTPParser.RULES, OTPParser.REPORT))
+    return hashlib.sha1(repr(tables).encode('utf-8')).hexdigest()[:16]
+
+
+FINGERPRINT = decoder_fingerprint()
+
+
+def record_variant(rows=OTPParser.REPORT):
+    """Return the variant name of the records of the given report rows."""
+    if rows is OTPParser.REPORT:
+        return 'record-' + FINGERPRINT
+    return 'record-' + FINGERPRINT + ':' + ','.join(key for _, key, _, _ in rows)
+
+
+class DecodeCache(object):
+    """Persistent, size bounded cache of decoded outputs, keyed by (image key, variant).
+    Lookups read the file straight away, new outputs and use times are written by flush(),
+    which also drops the least recently used outputs over max_entries.
+    """
+
+    def __init__(self, filename=None, max_entries=DEFAULT_SIZE, timeout=30.0):
+        self.filename = filename or default_path()
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(self.filename, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.pending = {}  # (key, variant): output, not yet written
+        self.touched = {}  # (key, variant): time of the last hit, not yet written
+        self.hits = 0
+        self.misses = 0
+        self.unsaved = [0, 0]  # Hits and misses not yet added to the counters
+
+    def get(self, key, variant):
+        """Return the cached output of an image key, or None."""
+        output = self.pending.get((key, variant))
+        if output is None:
+            row = self.connection.execute('SELECT output FROM decoded WHERE key = ? AND variant = ?',
+                                          (key, variant)).fetchone()
+            output = row and row[0]
+        if output is None:
+            self.misses += 1
+            self.unsaved[1] += 1
+            return None
+        self.hits += 1
+        self.unsaved[0] += 1
+        self.touched[(key, variant)] = time.time()
+        if len(self.touched) >= FLUSH_EVERY:
+            self.flush()
+        return output
+
+    def put(self, key, variant, output):
+        """Store the output of an image key, written with the next flush()."""
+        self.pending[(key, variant)] = output
+        if len(self.pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def record(self, dump, rows=OTPParser.REPORT):
+        """Return OTPParser.dump_record(dump, rows), from the cache if the same image was decoded before.
+        The values of the record are stored with marshal, which loads several times faster than JSON.
+        """
+        key = image_key(dump)
+        variant = record_variant(rows)
+        output = self.get(key, variant)
+        if output is None:
+            record = OTPParser.dump_record(dump, rows)
+            self.put(key, variant, marshal.dumps([value for name, value in record.items() if name != 'source']))
+            return record
+        record = OrderedDict() if dump.source is None else OrderedDict([('source', dump.source)])
+        keys = OTPParser.RECORD_KEYS[1:-1] if rows is OTPParser.REPORT else [key for _, key, _, _ in rows] + ['warnings']
+        record.update(zip(keys, marshal.loads(output)))
+        return record
+
+    def flush(self):
+        """Write the new outputs, use times and counters in one transaction, then evict."""
+        if not self.pending and not self.touched and not any(self.unsaved):
+            return
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO decoded VALUES (?, ?, ?, ?)',
+                                   [(key, variant, output, now) for (key, variant), output in self.pending.items()])
+            connection.executemany('UPDATE decoded SET used = ? WHERE key = ? AND variant = ?',
+                                   [(used, key, variant) for (key, variant), used in self.touched.items()])
+            excess = connection.execute('SELECT COUNT(*) FROM decoded').fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute('DELETE FROM decoded WHERE rowid IN '
+                                   '(SELECT rowid FROM decoded ORDER BY used LIMIT ?)', (excess,))
+            for name, value in (('hits', self.unsaved[0]), ('misses', self.unsaved[1]), ('evictions', max(excess, 0))):
+                connection.execute('UPDATE counters SET value = value + ? WHERE name = ?', (value, name))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self.pending = {}
+        self.touched = {}
+        self.unsaved = [0, 0]
+
+    def totals(self):
+        """Return the stored counters of every process using the file, as {name: value}, with the entries."""
+        totals = dict(self.connection.execute('SELECT name, value FROM counters'))
+        totals['entries'] = self.connection.execute('SELECT COUNT(*) FROM decoded').fetchone()[0]
+        return totals
+
+    def stats(self):
+        """Return the hit statistics of this process and of the file as a JSON-able dict.
+        Entries only count the records written so far.
+        """
+        totals = self.totals()
+        totals['hits'] += self.unsaved[0]
+        totals['misses'] += self.unsaved[1]
+        lookups = totals['hits'] + totals['misses']
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / (self.hits + self.misses), 4) if self.hits + self.misses else 0.0,
+            'total_hits': totals['hits'],
+            'total_misses': totals['misses'],
+            'total_hit_rate': round(totals['hits'] / lookups, 4) if lookups else 0.0,
+            'evictions': totals['evictions'],
+            'entries': totals['entries'],
+            'max_entries': self.max_entries,
+        }
+
+    def clear(self):
+        """Drop every cached output and reset the counters."""
+        self.pending = {}
+        self.touched = {}
+        self.unsaved = [0, 0]
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.execute('DELETE FROM decoded')
+        self.connection.execute('UPDATE counters SET value = 0')
+        self.connection.execute('COMMIT')
+
+    def close(self):
+        """Flush and close the file."""
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def hit_rate_text(before, after):
+    """Return a one line report of the lookups between two totals() of a cache."""
+    hits = after['hits'] - before['hits']
+    lookups = hits + after['misses'] - before['misses']
+    return ('Decode cache: %d hits of %d lookups (%.1f%%), %d entries, %d evicted.\n' %
+            (hits, lookups, 100.0 * hits / lookups if lookups else 0.0, after['entries'],
+             after['evictions'] - before['evictions']))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Show or clear the OTP decode cache.')
+    parser.add_argument('file', nargs='?', default=None, help='cache file (default: ' + default_path() + ')')
+    parser.add_argument('--clear', action='store_true', help='drop every cached record')
+    args = parser.parse_args(argv)
+
+    with DecodeCache(args.file) as cache:
+        if args.clear:
+            cache.clear()
+        totals = cache.totals()
+    lookups = totals['hits'] + totals['misses']
+    totals['hit_rate'] = round(totals['hits'] / lookups, 4) if lookups else 0.0
+    print(json.dumps(totals, indent=1, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
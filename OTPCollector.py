@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Collector
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPCollector.py <host>... [-f hosts_file] [-c command] [-n concurrency] [-t timeout] [--format format]
+ The command is run once per host, with {host} replaced, and its output parsed as it arrives.
+ The default command is 'ssh {host} vcgencmd otp_dump', any other command printing an otp_dump
+ works too, for example './OTPCollector.py -c "cat {host}" dumps/*.txt' to try it out locally.
+"""
+
+import argparse
+import asyncio
+import shlex
+import sys
+
+import OTPParser
+import OTPFleet
+
+if sys.version_info < (3, 7):
+    sys.exit('OTPCollector requires Python 3.7 and newer.')
+
+DEFAULT_COMMAND = 'ssh -o BatchMode=yes {host} vcgencmd otp_dump'
+
+
+def build_command(template, host):
+    """Split the command template into arguments and fill in the host."""
+    return [argument.replace('{host}', host) for argument in shlex.split(template)]
+
+
+async def collect_host(host, template, timeout, chunk_size=4096):
+    """Run the command for one host, Return its list of records."""
+    process = await asyncio.create_subprocess_exec(*build_command(template, host),
+                                                   stdin=asyncio.subprocess.DEVNULL,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    parser = OTPParser.OTPStreamParser(host)
+
+    async def read_dumps():
+        dumps = []
+        chunk = await process.stdout.read(chunk_size)
+        while chunk:
+            dumps.extend(parser.feed(chunk))
+            chunk = await process.stdout.read(chunk_size)
+        dumps.extend(parser.close())
+        return dumps
+
+    async def communicate():
+        # stderr is drained alongside stdout, so a chatty command can't block on a full pipe
+        dumps, stderr = await asyncio.gather(read_dumps(), process.stderr.read())
+        await process.wait()
+        return dumps, stderr
+
+    async def stop():
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:  # Exited but not reaped yet
+                pass
+        await process.wait()
+
+    try:
+        dumps, stderr = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        await stop()
+        return [{'source': host, 'error': 'Timed out after ' + str(timeout) + ' seconds'}]
+    except OTPParser.InvalidDumpError as exception:
+        await stop()
+        return [OTPParser.error_record(exception, host)]
+
+    if not dumps:
+        message = stderr.decode('utf-8', 'replace').strip().splitlines()
+        return [{'source': host, 'error': 'No OTP dump received (exit status ' + str(process.returncode) + ')' +
+                 (': ' + message[-1] if message else '')}]
+    records = []
+    for dump in dumps:
+        try:
+            record = OTPParser.dump_record(dump)
+        except KeyError as exception:
+            record = OTPParser.error_record(exception, host)
+        records.append(record)
+    return records
+
+
+async def collect(hosts, template=DEFAULT_COMMAND, concurrency=32, timeout=30.0):
+    """Collect from every host, at most concurrency at a time, Yield records as hosts finish."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(host):
+        async with semaphore:
+            try:
+                return await collect_host(host, template, timeout)
+            except OSError as exception:
+                return [OTPParser.error_record(exception, host)]
+
+    for finished in asyncio.as_completed([bounded(host) for host in hosts]):
+        for record in await finished:
+            yield record
+
+
+async def run(hosts, sink, template, concurrency, timeout):
+    """Write every record to sink, Return (collected, failed) counts."""
+    collected = failed = 0
+    async for record in collect(hosts, template, concurrency, timeout):
+        if 'error' in record:
+            failed += 1
+        else:
+            collected += 1
+        sink.write(record)
+    sink.close()
+    return collected, failed
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Collect and parse OTP dumps from many boards at once.')
+    parser.add_argument('hosts', nargs='*', help='hosts to collect from')
+    parser.add_argument('-f', '--hosts-file', help="file listing one host per line ('-' for stdin)")
+    parser.add_argument('-c', '--command', default=DEFAULT_COMMAND, help='command template, {host} is replaced')
+    parser.add_argument('-n', '--concurrency', type=int, default=32, help='hosts collected at once')
+    parser.add_argument('-t', '--timeout', type=float, default=30.0, help='seconds allowed per host')
+    parser.add_argument('--format', choices=sorted(set(OTPParser.WRITERS) - set(['text'])), default='jsonl',
+                        help='output format')
+    args = parser.parse_args(argv)
+
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        hosts.extend(OTPFleet.read_manifest(args.hosts_file))
+    if not hosts:
+        parser.error('no hosts to collect from')
+
+    collected, failed = asyncio.run(run(hosts, OTPParser.WRITERS[args.format](sys.stdout), args.command,
+                                        args.concurrency, args.timeout))
+    sys.stderr.write('Collected ' + str(collected) + ' dumps, ' + str(failed) + ' failed.\n')
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
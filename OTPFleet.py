@@ -0,0 +1,518 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Fleet Parser
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPFleet.py <directory|glob|file|bundle>... [-m manifest] [-j jobs] [-o output] [-f format]
+      ./OTPFleet.py <directory|glob|file|bundle>... --summary [--merge summary.json...]
+ Every dump is parsed in a worker pool and written as it finishes, one JSON object per line by default.
+ Dumps that fail to parse are reported per file instead of stopping the run.
+ Bundles (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, .zip, or a single .gz/.bz2/.xz dump) are read
+ without extracting them: members are decompressed one at a time while the workers parse the
+ ones before, with a bounded number in flight so memory stays flat whatever the bundle size.
+ --profile writes per-stage timings and error counts, see OTPProfile.py.
+ --cache reuses the records of dumps decoded before, see OTPCache.py.
+ With --summary the fleet is summarized in one pass instead, in constant memory, and the JSON
+ summaries of other runs given with --merge are folded in, so machines can ship partial results.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import binascii
+import bz2
+import glob
+import gzip
+import json
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import tarfile
+import threading
+import zipfile
+from collections import Counter
+
+import OTPCache
+import OTPParser
+import OTPProfile
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+GLOB_CHARACTERS = set('*?[')
+CACHE = None  # DecodeCache of a worker, see init_cache()
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz')
+BUNDLE_SUFFIXES = TAR_SUFFIXES + COMPRESSED_SUFFIXES + ('.zip',)
+PARSE_ERRORS = (OTPParser.InvalidDumpError, IOError, OSError, KeyError, ValueError)
+BUNDLE_ERRORS = (tarfile.TarError, zipfile.BadZipfile, EOFError, IOError, OSError) + ((lzma.LZMAError,) if lzma else ())
+
+
+def expand_paths(paths):
+    """Expand directories, globs and plain files into a list of dump files."""
+    files = []
+    for name in paths:
+        if os.path.isdir(name):
+            for root, dirs, filenames in os.walk(name):
+                dirs.sort()
+                files.extend(os.path.join(root, filename) for filename in sorted(filenames))
+        elif GLOB_CHARACTERS.intersection(name):
+            files.extend(sorted(glob.glob(name)))
+        else:
+            files.append(name)
+    return files
+
+
+def read_manifest(manifest):
+    """Read a manifest of dump paths, one per line, '-' meaning stdin."""
+    if manifest == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(manifest, 'r') as manifest_file:
+            lines = manifest_file.readlines()
+    return [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+
+
+def is_bundle(filename):
+    """Return whether a file name is one of a bundle of dumps."""
+    return filename.lower().endswith(BUNDLE_SUFFIXES)
+
+
+def open_compressed(filename):
+    """Open a .gz, .bz2 or .xz file for reading its decompressed bytes."""
+    if filename.lower().endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.lower().endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    if lzma is None:
+        raise IOError('Reading .xz bundles requires the lzma module')
+    return lzma.open(filename, 'rb')
+
+
+def iter_bundle(filename):
+    """Yield (source, data, error) for every file of a bundle, one member at a time.
+    The source is 'bundle:member', a bundle that can't be read ends with one item holding the error.
+    """
+    try:
+        lower = filename.lower()
+        if lower.endswith('.zip'):
+            with zipfile.ZipFile(filename) as bundle:
+                for info in bundle.infolist():
+                    if not info.filename.endswith('/'):
+                        yield filename + ':' + info.filename, bundle.read(info), None
+        elif lower.endswith(TAR_SUFFIXES) or tarfile.is_tarfile(filename):
+            with tarfile.open(filename, 'r|*') as bundle:  # Stream mode, members are read in order
+                for member in bundle:
+                    if member.isfile():
+                        yield filename + ':' + member.name, bundle.extractfile(member).read(), None
+                    bundle.members = []  # TarFile keeps every member it has read otherwise
+        else:
+            with open_compressed(filename) as stream:
+                yield filename, stream.read(), None
+    except BUNDLE_ERRORS as exception:
+        yield filename, None, OTPParser.error_message(exception)
+
+
+def iter_items(files, profiler=None):
+    """Yield the work items of a list of files: file names, and (source, data, error) for bundle members.
+    With an OTPProfile.Profiler, reading the bundle members is timed as the unpack stage.
+    """
+    for filename in files:
+        if is_bundle(filename):
+            members = iter_bundle(filename)
+            for member in members if profiler is None else profiler.iterate(members, 'unpack'):
+                yield member
+        else:
+            yield filename
+
+
+def read_item(item):
+    """Return the (data, source) of a work item of iter_items()."""
+    if not isinstance(item, tuple):
+        with open(item, 'rb') as dump_file:
+            return dump_file.read(), item
+    source, data, error = item
+    if error is not None:
+        raise IOError(error)
+    return data, source
+
+
+def load_item(item):
+    """Parse a work item of iter_items(), Return its OTPDump."""
+    data, source = read_item(item)
+    return OTPParser.OTPDump.from_bytes(data, source)
+
+
+def error_record(item, exception):
+    """Return the result record of a work item that failed, reported as by OTPParser.error_record()."""
+    return OTPParser.error_record(exception, item[0] if isinstance(item, tuple) else item)
+
+
+def init_cache(filename, max_entries):
+    """Worker initializer: open the decode cache, flushed when the worker exits."""
+    global CACHE
+    CACHE = OTPCache.DecodeCache(filename, max_entries)
+    multiprocessing.util.Finalize(CACHE, CACHE.close, exitpriority=10)
+
+
+def decode_dump(dump):
+    """Return the record of a dump, from the worker's decode cache if it has one."""
+    if CACHE is None:
+        return OTPParser.dump_record(dump)
+    return CACHE.record(dump)
+
+
+def parse_dump(item):
+    """Worker: parse one dump file or bundle member into a result record."""
+    try:
+        return decode_dump(load_item(item))
+    except PARSE_ERRORS as exception:
+        return error_record(item, exception)
+
+
+def profile_dump(item):
+    """Worker: parse_dump() timing its read, tokenize, validate and decode stages, Return (record, Profiler)."""
+    profiler = OTPProfile.Profiler()
+    try:
+        started = OTPProfile.timer()
+        data, source = read_item(item)
+        started = profiler.lap('read', started)
+        tokens = OTPParser.split_tokens(data)
+        started = profiler.lap('tokenize', started)
+        dump = OTPParser.OTPDump.from_tokens(*OTPParser.check_tokens(data, tokens), source=source)
+        started = profiler.lap('validate', started)
+        record = decode_dump(dump)
+        profiler.lap('decode', started)
+        profiler.dumps += 1
+    except PARSE_ERRORS as exception:
+        profiler.error(exception)
+        record = error_record(item, exception)
+    return record, profiler
+
+
+class BoundedFeeder(object):
+    """Hands out the items of an iterable with at most limit of them not yet released.
+    A pool's task thread pulls items (decompressing bundles) while the workers parse the ones before,
+    and is held back once limit items are in flight, so the queue never holds a whole bundle.
+    """
+
+    def __init__(self, items, limit):
+        self.items = items
+        self.slots = threading.Semaphore(limit)
+
+    def __iter__(self):
+        for item in self.items:
+            self.slots.acquire()
+            yield item
+
+    def release(self):
+        """Release the slot of one finished item."""
+        self.slots.release()
+
+
+def chunked(items, size):
+    """Yield lists of size items from an iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def mix64(value):
+    """Hash an integer to 64 well mixed bits (the splitmix64 finalizer), the same on every machine."""
+    value = (value + 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return value ^ (value >> 31)
+
+
+class HyperLogLog(object):
+    """HyperLogLog sketch counting distinct integers in 2 ** precision bytes, however many are added.
+    The standard error is about 1.04 / sqrt(2 ** precision), 1.6% for the default of 12.
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size) if registers is None else bytearray(registers)
+
+    def add(self, value):
+        """Add an integer."""
+        hashed = mix64(value)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError('Can not merge HyperLogLog sketches of different precision')
+        self.registers = bytearray(max(pair) for pair in zip(self.registers, other.registers))
+
+    def count(self):
+        """Return the estimated number of distinct integers added."""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)  # Linear counting for small sets
+        return int(round(estimate))
+
+    def to_dict(self):
+        """Return the sketch as a JSON friendly dict."""
+        return {'precision': self.precision, 'registers': binascii.hexlify(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a sketch from to_dict()."""
+        return cls(data['precision'], binascii.unhexlify(data['registers']))
+
+
+class FleetSummary(object):
+    """Mergeable summary of a fleet, built in one pass with memory that does not grow with the fleet.
+    Boards are counted by decoded attribute, every bit of the BIT_REGIONS registers is counted
+    and distinct serials and MAC addresses are estimated with HyperLogLog sketches.
+    Summaries of separate workers or machines merge into the summary of the whole fleet.
+    """
+    ATTRIBUTES = ('board_type', 'manufacturer', 'memory_size', 'processor')
+    BIT_REGIONS = ('control', 'bootmode', 'advanced_boot')
+    SKETCHES = ('serial_number', 'mac_address')
+
+    def __init__(self, precision=12):
+        self.dumps = 0
+        self.failed = 0
+        self.checks = Counter()
+        self.counts = dict((attribute, Counter()) for attribute in self.ATTRIBUTES)
+        self.bits = dict((loc, [0] * 32) for loc in self.BIT_REGIONS)
+        self.sketches = dict((name, HyperLogLog(precision)) for name in self.SKETCHES)
+
+    def add(self, dump):
+        """Add one OTPDump."""
+        self.dumps += 1
+        for warning in dump.warnings():
+            self.checks[warning] += 1
+        if dump.has('revision_number'):
+            info = dump.revision_info()
+            for attribute in self.ATTRIBUTES:
+                self.counts[attribute][getattr(info, attribute)] += 1
+        for loc in self.BIT_REGIONS:
+            if dump.has(loc):
+                counts = self.bits[loc]
+                word = dump.word(loc)
+                while word:
+                    low = word & -word
+                    counts[low.bit_length() - 1] += 1
+                    word ^= low
+        if dump.has('serial_number'):
+            self.sketches['serial_number'].add(dump.word('serial_number'))
+        if dump.has('mac_address_one') and dump.has('mac_address_two') and dump.word('mac_address_one'):
+            self.sketches['mac_address'].add(dump.word('mac_address_one') << 16 | dump.word('mac_address_two') >> 16)
+
+    def add_error(self):
+        """Count a dump that failed to parse."""
+        self.failed += 1
+
+    def merge(self, other):
+        """Fold another summary into this one."""
+        self.dumps += other.dumps
+        self.failed += other.failed
+        self.checks.update(other.checks)
+        for attribute in self.ATTRIBUTES:
+            self.counts[attribute].update(other.counts[attribute])
+        for loc in self.BIT_REGIONS:
+            self.bits[loc] = [mine + theirs for mine, theirs in zip(self.bits[loc], other.bits[loc])]
+        for name in self.SKETCHES:
+            self.sketches[name].merge(other.sketches[name])
+        return self
+
+    def to_dict(self):
+        """Return the summary as a JSON friendly dict, which also serves as a partial result to merge."""
+        return {
+            'dumps': self.dumps,
+            'failed': self.failed,
+            'checks': dict(self.checks),
+            'counts': dict((attribute, dict(counts)) for attribute, counts in self.counts.items()),
+            'bits': self.bits,
+            'distinct': dict((name, sketch.count()) for name, sketch in self.sketches.items()),
+            'sketches': dict((name, sketch.to_dict()) for name, sketch in self.sketches.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a summary from to_dict()."""
+        summary = cls()
+        summary.dumps = data['dumps']
+        summary.failed = data['failed']
+        summary.checks.update(data['checks'])
+        for attribute in cls.ATTRIBUTES:
+            summary.counts[attribute].update(data['counts'].get(attribute, {}))
+        for loc in cls.BIT_REGIONS:
+            summary.bits[loc] = list(data['bits'][loc])
+        for name in cls.SKETCHES:
+            summary.sketches[name] = HyperLogLog.from_dict(data['sketches'][name])
+        return summary
+
+
+def summarize_files(files):
+    """Worker: parse a list of dump files or bundle members, Return their FleetSummary."""
+    summary = FleetSummary()
+    for item in files:
+        try:
+            summary.add(load_item(item))
+        except PARSE_ERRORS:
+            summary.add_error()
+    return summary
+
+
+def summarize(files, jobs=None, chunksize=256):
+    """Summarize files and bundles with a pool of jobs workers, each summarizing chunksize dumps at a time."""
+    summary = FleetSummary()
+    chunks = BoundedFeeder(chunked(iter_items(files), chunksize), 4 * (jobs or multiprocessing.cpu_count()))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for partial in pool.imap_unordered(summarize_files, chunks):
+            chunks.release()
+            summary.merge(partial)
+    finally:
+        pool.close()
+        pool.join()
+    return summary
+
+
+def run_batch(files, sink, jobs=None, chunksize=64, profiler=None, cache=None):
+    """Parse files and bundles with a pool of jobs workers, Return (parsed, failed) counts.
+    With an OTPProfile.Profiler every stage is timed, otherwise nothing is.
+    cache is (file name, max entries) of an OTPCache.DecodeCache shared by the workers, or None.
+    """
+    parsed = failed = 0
+    unpacking = None if profiler is None else OTPProfile.Profiler()  # Filled by the pool's task thread
+    items = BoundedFeeder(iter_items(files, unpacking), 4 * chunksize * (jobs or multiprocessing.cpu_count()))
+    pool = multiprocessing.Pool(jobs, *((init_cache, cache) if cache else ()))
+    try:
+        for record in pool.imap_unordered(parse_dump if profiler is None else profile_dump, items, chunksize):
+            items.release()
+            if profiler is not None:
+                record, partial = record
+                profiler.merge(partial)
+            if 'error' in record:
+                failed += 1
+            else:
+                parsed += 1
+            if profiler is None:
+                sink.write(record)
+            else:
+                profiler.write_record(sink, record)
+    finally:
+        pool.close()
+        pool.join()
+    if profiler is not None:
+        profiler.merge(unpacking)
+    sink.close()
+    return parsed, failed
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Parse many OTP dumps in one process.')
+    parser.add_argument('paths', nargs='*', help='dump files, bundles, directories or glob patterns')
+    parser.add_argument('-m', '--manifest', help="file listing one dump path per line ('-' for stdin)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('-o', '--output', help='write records here instead of stdout')
+    parser.add_argument('--chunksize', type=int, default=64, help='dumps handed to a worker at a time')
+    parser.add_argument('-f', '--format', choices=sorted(set(OTPParser.WRITERS) - set(['text'])), default='jsonl',
+                        help='output format')
+    parser.add_argument('-s', '--summary', action='store_true', help='write a fleet summary instead of records')
+    parser.add_argument('--merge', nargs='+', default=[], metavar='SUMMARY',
+                        help='summary files (from other workers or machines) to merge into the summary')
+    parser.add_argument('--cache', nargs='?', const=OTPCache.default_path(), metavar='FILE',
+                        help='reuse the records of dumps decoded before, from this file (default: %(const)s)')
+    parser.add_argument('--cache-size', type=int, default=OTPCache.DEFAULT_SIZE, help='most records kept in the cache')
+    parser.add_argument('--profile', metavar='FILE', help="time every stage and write the profile here ('-' for stderr)")
+    parser.add_argument('--profile-format', choices=('json', 'prometheus'), default='json', help='profile format')
+    args = parser.parse_args(argv)
+    if args.profile and (args.summary or args.merge):
+        parser.error('--profile only applies to record output')
+
+    paths = list(args.paths)
+    if args.manifest:
+        paths.extend(read_manifest(args.manifest))
+    files = expand_paths(paths)
+    if not files and not args.merge:
+        parser.error('no dumps to parse')
+
+    if args.summary or args.merge:
+        summary = summarize(files, args.jobs) if files else FleetSummary()
+        for name in args.merge:
+            with open(name, 'r') as summary_file:
+                summary.merge(FleetSummary.from_dict(json.load(summary_file)))
+        stream = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            json.dump(summary.to_dict(), stream, indent=1, sort_keys=True)
+            stream.write('\n')
+        finally:
+            if args.output:
+                stream.close()
+        sys.stderr.write('Summarized ' + str(summary.dumps) + ' dumps, ' + str(summary.failed) + ' failed.\n')
+        return 1 if summary.failed else 0
+
+    if args.output:
+        stream = open(args.output, 'wb' if args.format == 'msgpack' else 'w')
+    else:
+        stream = sys.stdout
+    profiler = OTPProfile.Profiler() if args.profile else None
+    cache = OTPCache.DecodeCache(args.cache, args.cache_size) if args.cache else None
+    try:
+        before = cache and cache.totals()
+        sink = stream
+        if profiler is not None:
+            sink = profiler.stream(getattr(stream, 'buffer', stream) if args.format == 'msgpack' else stream)
+        parsed, failed = run_batch(files, OTPParser.WRITERS[args.format](sink), args.jobs, args.chunksize, profiler,
+                                   cache and (args.cache, args.cache_size))
+        if cache is not None:
+            sys.stderr.write(OTPCache.hit_rate_text(before, cache.totals()))
+    finally:
+        if args.output:
+            stream.close()
+        if cache is not None:
+            cache.close()
+    if profiler is not None:
+        profiler.stop()
+        if args.profile == '-':
+            OTPProfile.save(profiler, sys.stderr, args.profile_format)
+        else:
+            with open(args.profile, 'w') as profile_file:
+                OTPProfile.save(profiler, profile_file, args.profile_format)
+    sys.stderr.write('Parsed ' + str(parsed) + ' dumps, ' + str(failed) + ' failed.\n')
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
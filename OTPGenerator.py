@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Dump Generator
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPGenerator.py [-n count] [--seed S] [--corrupt RATE] [--kinds kind,...] [--set key=value]...
+                        [-o directory | --archive file]
+ Writes synthetic 'vcgencmd otp_dump' text, to stdout as one concatenated stream, or to
+ directory as one file per dump, or binary records to an OTPArchive. The output only depends
+ on the seed. --set sets a bitfield of FIELDS, like bootmode.bit_21=1, on every dump.
+ Boards cycle through every revision of LEGACY_REVISIONS and new style revisions covering
+ every entry of BOARD_TYPES, MANUFACTURERS, PROCESSORS, MEMORY_SIZES and BOARD_REVISIONS.
+ With --corrupt, that fraction of the dumps gets one of the CORRUPTIONS.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import os
+import random
+import sys
+
+import OTPParser
+import OTPArchive
+
+# First three bytes of the MAC addresses, Boards before the BCM2711 have no MAC in OTP.
+OUIS = {
+    'BCM2711': (0xdca632, 0xe45f01),
+    'BCM2712': (0xd83add, 0x2ccf67),
+}
+
+# Kinds of corruption, and what parsing the dump should give: an exception class or the rule that fails.
+CORRUPTIONS = {
+    'non_hex': OTPParser.InvalidDataError,
+    'bad_region': OTPParser.InvalidRegionError,
+    'typo': OTPParser.TypoError,
+    'serial_checksum': 'serial_inverse',
+    'bootmode_copy': 'bootmode_copy',
+}
+
+
+def known(table):
+    """Return the names of a table whose bits are a real binary value, in bits order."""
+    return [name for name, bits in sorted(table.items(), key=lambda item: item[1])
+            if bits and set(bits) <= set('01')]
+
+
+def board_revisions():
+    """Return the revision_number words of every board to generate: each LEGACY_REVISIONS code,
+    then new style revisions covering every entry of the name tables.
+    """
+    words = [int(code, 2) for code in sorted(OTPParser.LEGACY_REVISIONS) if code != 'default']
+    tables = [known(OTPParser.MEMORY_SIZES), known(OTPParser.MANUFACTURERS), known(OTPParser.PROCESSORS),
+              known(OTPParser.BOARD_TYPES), known(OTPParser.BOARD_REVISIONS)]
+    for index in range(max(len(table) for table in tables)):
+        words.append(OTPParser.encode_revision(*[table[index % len(table)] for table in tables]))
+    return words
+
+
+class ImageEncoder(object):
+    """Stamps out copies of a template dump that only differ in serial number, batch number and MAC.
+    The text and the archive record of the template are prepared once, so an image is a single
+    string format or struct pack.
+    """
+    VARIABLE = ('serial_number', 'serial_number_inverted', 'batch_number', 'mac_address_two', 'mac_address_one')
+
+    def __init__(self, dump):
+        regions = [OTPParser.REGIONS[loc] for loc in self.VARIABLE]
+        for region in regions:
+            dump.present |= 1 << region
+        lines = []
+        for region in range(OTPParser.NUM_REGIONS):
+            if dump.present >> region & 1:
+                lines.append('%02d:' % region + ('%08x' if region in regions else format(dump.words[region], '08x')))
+        self.template = '\n'.join(lines) + '\n'
+        self.order = sorted(range(len(regions)), key=lambda index: regions[index])
+        source = (dump.source or '').encode('utf-8')[-OTPArchive.SOURCE_LENGTH:]
+        self.record = [0, dump.present >> OTPParser.FIRST_REGION, source] + list(dump.words)
+        self.offsets = [3 + region for region in regions]
+
+    @staticmethod
+    def variable_words(serial, batch, mac):
+        """Return the words of the VARIABLE regions."""
+        return serial, serial ^ 0xffffffff, batch, (mac & 0xffff) << 16, mac >> 16
+
+    def text(self, serial, batch, mac=0):
+        """Return one image as 'vcgencmd otp_dump' text."""
+        values = self.variable_words(serial, batch, mac)
+        return self.template % tuple(values[index] for index in self.order)
+
+    def binary(self, serial, batch, mac=0, timestamp=0):
+        """Return one image as an OTPArchive record."""
+        record = self.record[:]
+        record[0] = timestamp
+        for offset, value in zip(self.offsets, self.variable_words(serial, batch, mac)):
+            record[offset] = value
+        return OTPArchive.RECORD.pack(*record)
+
+
+class DumpGenerator(object):
+    """Deterministic source of synthetic OTP dumps, seeded like random.Random.
+    fields is a {key: value} of FIELDS to set on every dump, for example {'bootmode.bit_21': 1}.
+    """
+
+    def __init__(self, seed=0, fields=None):
+        self.random = random.Random(seed)
+        self.revisions = board_revisions()
+        self.fields = fields or {}
+        self.encoders = {}
+        self.index = 0
+
+    def template(self, word):
+        """Return the OTPDump of a board with revision word, before its serial, batch and MAC are set."""
+        dump = OTPParser.OTPDump('synthetic')
+        for region in range(OTPParser.FIRST_REGION, OTPParser.NUM_REGIONS):
+            dump.set_word(region, 0)
+        dump.set('control', 0x00280000)
+        dump.set('bootmode', 0x1020000a)
+        for name in ('boot_sign_key_1', 'boot_sign_key_2', 'boot_sign_key_3', 'boot_sign_key_4'):
+            dump.set(name, 0xffffffff)
+            dump.set(name + '_copy', 0xffffffff)
+        dump.set('boot_signing_parity', 0x0000ae4d)
+        dump.set('revision_number', word)
+        dump.set('overclock', 0x00000001)
+        if OTPParser.decode_revision(word).processor in OUIS:
+            dump.set('advanced_boot', 0x0200c086)
+        for key, value in sorted(self.fields.items()):
+            dump.set_field(key, value)
+        dump.set('bootmode_copy', dump.word('bootmode'))
+        return dump
+
+    def encoder(self, word):
+        """Return the (cached) ImageEncoder of a board."""
+        if word not in self.encoders:
+            self.encoders[word] = ImageEncoder(self.template(word))
+        return self.encoders[word]
+
+    def next_board(self):
+        """Return (revision word, serial, batch, MAC) of the next board, the MAC is 0 if it has none."""
+        word = self.revisions[self.index % len(self.revisions)]
+        self.index += 1
+        serial = self.random.getrandbits(32)
+        batch = self.random.getrandbits(32)
+        processor = OTPParser.decode_revision(word).processor
+        mac = self.random.choice(OUIS[processor]) << 24 | self.random.getrandbits(24) if processor in OUIS else 0
+        return word, serial, batch, mac
+
+    def dump(self):
+        """Return a valid OTPDump of the next board."""
+        word, serial, batch, mac = self.next_board()
+        dump = self.template(word)
+        for loc, value in zip(ImageEncoder.VARIABLE, ImageEncoder.variable_words(serial, batch, mac)):
+            dump.set(loc, value)
+        return dump
+
+    def images(self, count, binary=False):
+        """Yield count valid dumps as text, or as OTPArchive records if binary is set."""
+        for _ in range(count):
+            word, serial, batch, mac = self.next_board()
+            if binary:
+                yield self.encoder(word).binary(serial, batch, mac)
+            else:
+                yield self.encoder(word).text(serial, batch, mac)
+
+    def corrupt(self, text, kind):
+        """Return the text of a dump with one corruption of CORRUPTIONS applied."""
+        lines = text.splitlines(True)
+        if kind == 'non_hex':
+            index = self.random.randrange(len(lines))
+            lines[index] = lines[index][:3] + 'zz' + lines[index][5:]
+        elif kind == 'bad_region':
+            index = self.random.randrange(len(lines))
+            lines[index] = self.random.choice(('x', '1a', '-', '')) + lines[index][2:]
+        elif kind == 'typo':
+            lines = ['Command not registered\n']
+        elif kind in ('serial_checksum', 'bootmode_copy'):
+            loc = 'serial_number_inverted' if kind == 'serial_checksum' else 'bootmode_copy'
+            prefix = '%02d:' % OTPParser.REGIONS[loc]
+            index = [line[:3] for line in lines].index(prefix)
+            lines[index] = prefix + '%08x\n' % (int(lines[index][3:11], 16) ^ 1 << self.random.randrange(32))
+        else:
+            raise ValueError('Unknown corruption ' + repr(kind))
+        return ''.join(lines)
+
+    def generate(self, count, corrupt=0.0, kinds=None):
+        """Yield (text, kind) for count dumps, kind being None or the corruption applied."""
+        kinds = sorted(kinds or CORRUPTIONS)
+        for text in self.images(count):
+            if corrupt and self.random.random() < corrupt:
+                kind = self.random.choice(kinds)
+                yield self.corrupt(text, kind), kind
+            else:
+                yield text, None
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Generate synthetic OTP dumps.')
+    parser.add_argument('-n', '--count', type=int, default=None, help='dumps to generate (default: one per board)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='fraction of the dumps to corrupt')
+    parser.add_argument('--kinds', default=','.join(sorted(CORRUPTIONS)), help='corruptions to apply')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="set a field on every dump, for example --set bootmode.bit_21=1 (repeatable)")
+    parser.add_argument('-o', '--output', help='write one file per dump to this directory')
+    parser.add_argument('--archive', help='append the dumps to this OTPArchive instead (no corruption)')
+    args = parser.parse_args(argv)
+
+    kinds = args.kinds.split(',')
+    for kind in kinds:
+        if kind not in CORRUPTIONS:
+            parser.error('unknown corruption ' + repr(kind) + ', choose from ' + ', '.join(sorted(CORRUPTIONS)))
+    fields = {}
+    for assignment in args.set:
+        key, _, value = assignment.partition('=')
+        if key not in OTPParser.COMPILED_FIELDS:
+            parser.error('unknown field ' + repr(key))
+        try:
+            fields[key] = int(value, 0)
+        except ValueError:
+            parser.error('bad value in ' + repr(assignment))
+    generator = DumpGenerator(args.seed, fields)
+    try:
+        generator.template(generator.revisions[0])
+    except ValueError as exception:
+        parser.error(str(exception))
+    count = len(generator.revisions) if args.count is None else args.count
+    if args.archive:
+        with OTPArchive.ArchiveWriter(args.archive) as writer:
+            for record in generator.images(count, binary=True):
+                writer.write_record(record)
+        return 0
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    width = len(str(count))
+    for index, (text, kind) in enumerate(generator.generate(count, args.corrupt, kinds)):
+        if args.output:
+            name = 'dump' + str(index).zfill(width) + ('-' + kind if kind else '') + '.txt'
+            with open(os.path.join(args.output, name), 'w') as dump_file:
+                dump_file.write(text)
+        else:
+            sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Fleet Matrix
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPMatrix.py <directory|glob|file>... [--by board_type,manufacturer]
+ Loads every dump into one (N x 67) uint32 matrix and decodes the fleet with column operations.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import multiprocessing
+import sys
+
+import OTPParser
+import OTPFleet
+
+try:
+    import numpy
+except ImportError:
+    if __name__ != "__main__":
+        raise ImportError('OTPMatrix requires numpy!')
+    numpy = None  # main() exits with the same message
+
+# Decoded board attributes, with the table of names for each and the revision field holding it,
+# and how decode_revision() names values missing from the table, None where it has no name for them.
+ATTRIBUTES = (
+    ('memory_size',    OTPParser.MEMORY_SIZES_AS_STRING,    'revision_number.memory_size',    None),
+    ('manufacturer',   OTPParser.MANUFACTURERS_AS_STRING,   'revision_number.manufacturer',   None),
+    ('processor',      OTPParser.PROCESSORS_AS_STRING,      'revision_number.processor',      None),
+    ('board_type',     OTPParser.BOARD_TYPES_AS_STRING,     'revision_number.board_type',     OTPParser.board_type_name),
+    ('board_revision', OTPParser.BOARD_REVISIONS_AS_STRING, 'revision_number.board_revision', None),
+)
+
+HEX_CHARACTERS = numpy.frombuffer(b'0123456789abcdef', dtype=numpy.uint8) if numpy is not None else None
+
+
+def build_categories():
+    """Build the names and code lookup tables of every decoded attribute.
+    Return {attribute: (names, new style lookup, legacy lookup)}, where the lookups map a field
+    value of the revision word to an index into names.
+    """
+    legacy_field = OTPParser.COMPILED_FIELDS['revision_number.legacy_board_revision']
+    legacy = [OTPParser.legacy_board_bits(format(value, '05b')) for value in range(legacy_field.mask + 1)]
+    categories = {}
+    for position, (attribute, as_string, key, name) in enumerate(ATTRIBUTES):
+        field = OTPParser.COMPILED_FIELDS[key]
+        values = [format(value, field.binary_format) for value in range(field.mask + 1)]
+        new_names = [name(bits) if name else as_string.get(bits, 'unknown') for bits in values]
+        names = sorted(set(as_string.values()) | set(new_names))
+        new_style = [names.index(new_name) for new_name in new_names]
+        old_style = [names.index(as_string[bits[position]]) for bits in legacy]
+        categories[attribute] = (names, numpy.array(new_style, dtype=numpy.uint16),
+                                 numpy.array(old_style, dtype=numpy.uint16))
+    return categories
+
+
+CATEGORIES = build_categories() if numpy is not None else {}
+
+
+class OTPMatrix(object):
+    """A fleet of OTP dumps as an (N x 67) uint32 matrix, indexed by REGIONS number.
+    present holds a uint64 per dump, with bit (region - FIRST_REGION) set for every dumped region.
+    """
+
+    def __init__(self, words, present=None, sources=None):
+        self.words = numpy.asarray(words, dtype=numpy.uint32).reshape(-1, OTPParser.NUM_REGIONS)
+        if present is None:
+            present = numpy.full(len(self.words), (1 << (OTPParser.NUM_REGIONS - OTPParser.FIRST_REGION)) - 1,
+                                 dtype=numpy.uint64)
+        self.present = numpy.asarray(present, dtype=numpy.uint64)
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def from_dumps(cls, dumps):
+        """Build a matrix from OTPDump objects."""
+        dumps = list(dumps)
+        words = numpy.frombuffer(b''.join(dump.words.tobytes() for dump in dumps),
+                                 dtype=numpy.dtype(OTPParser.WORD_TYPECODE))
+        present = numpy.array([dump.present >> OTPParser.FIRST_REGION for dump in dumps], dtype=numpy.uint64)
+        return cls(words, present, [dump.source for dump in dumps])
+
+    def column(self, loc):
+        """Return the words of the named region for every dump."""
+        return self.words[:, OTPParser.REGIONS[loc]]
+
+    def has(self, loc):
+        """Return a boolean column of whether the named region was dumped."""
+        return (self.present >> numpy.uint64(OTPParser.REGIONS[loc] - OTPParser.FIRST_REGION)) & numpy.uint64(1) == 1
+
+    def field(self, key):
+        """Return a bitfield (for example 'bootmode.bit_29') for every dump."""
+        field = OTPParser.COMPILED_FIELDS[key]
+        return (self.words[:, field.region] >> numpy.uint32(field.shift)) & numpy.uint32(field.mask)
+
+    def serial_ok(self):
+        """Vectorized process_serial: Check every serial against its inverse, True where either was not dumped."""
+        checked = self.has('serial_number') & self.has('serial_number_inverted')
+        return ~checked | (self.column('serial_number') ^ self.column('serial_number_inverted') == 0xffffffff)
+
+    def bootmode_ok(self):
+        """Vectorized process_bootmode: Check every bootmode against its backup, True where either was not dumped."""
+        checked = self.has('bootmode') & self.has('bootmode_copy')
+        return ~checked | (self.column('bootmode') == self.column('bootmode_copy'))
+
+    def board_codes(self):
+        """Vectorized process_revision: Return {attribute: codes into the attribute's names}."""
+        new_flag = self.field('revision_number.new_flag') == 1
+        legacy = self.field('revision_number.legacy_board_revision')
+        codes = {}
+        for attribute, _, key, _ in ATTRIBUTES:
+            names, new_style, old_style = CATEGORIES[attribute]
+            codes[attribute] = numpy.where(new_flag, new_style[self.field(key)], old_style[legacy])
+        return codes
+
+    def mac_numbers(self):
+        """Return the MAC address of every dump as a 48-bit integer, 0 if there is none."""
+        mac_one = self.column('mac_address_one').astype(numpy.uint64)
+        mac_two = self.column('mac_address_two').astype(numpy.uint64)
+        return numpy.where(mac_one == 0, numpy.uint64(0), (mac_one << numpy.uint64(16)) | (mac_two >> numpy.uint64(16)))
+
+    def mac_strings(self):
+        """Vectorized format_mac: Return every MAC address as 'xx:xx:xx:xx:xx:xx' bytes, or b'None'."""
+        mac = self.mac_numbers()
+        octets = ((mac[:, None] >> numpy.arange(40, -1, -8, dtype=numpy.uint64)) & numpy.uint64(0xff)).astype(numpy.uint8)
+        text = numpy.full((len(mac), 17), ord(':'), dtype=numpy.uint8)
+        text[:, 0::3] = HEX_CHARACTERS[octets >> 4]
+        text[:, 1::3] = HEX_CHARACTERS[octets & 15]
+        strings = text.view('S17').reshape(-1)
+        return numpy.where(self.column('mac_address_one') == 0, b'None', strings)
+
+    def records(self):
+        """Decode the whole fleet, Return a numpy record array with one row per dump.
+        Board attributes are codes, see names() to turn them back into strings.
+        """
+        codes = self.board_codes()
+        columns = [
+            ('serial_number', self.column('serial_number')),
+            ('serial_ok', self.serial_ok()),
+            ('bootmode_ok', self.bootmode_ok()),
+            ('revision_number', self.column('revision_number')),
+            ('new_flag', self.field('revision_number.new_flag').astype(numpy.uint8)),
+        ]
+        columns.extend((attribute, codes[attribute]) for attribute, _, _, _ in ATTRIBUTES)
+        columns.extend([
+            ('batch_number', self.column('batch_number')),
+            ('mac_address', self.mac_numbers()),
+        ])
+        return numpy.rec.fromarrays([column for _, column in columns], names=[name for name, _ in columns])
+
+    def counts(self, by=('board_type', 'manufacturer')):
+        """Count dumps by a combination of board attributes, Return {(name, ...): count}."""
+        codes = self.board_codes()
+        combined = numpy.zeros(len(self), dtype=numpy.int64)
+        sizes = [len(CATEGORIES[attribute][0]) for attribute in by]
+        for attribute, size in zip(by, sizes):
+            combined = combined * size + codes[attribute]
+        total = 1
+        for size in sizes:
+            total *= size
+        counts = numpy.bincount(combined, minlength=total)
+        result = {}
+        for index in numpy.flatnonzero(counts):
+            key = []
+            remainder = int(index)
+            for attribute, size in reversed(list(zip(by, sizes))):
+                remainder, code = divmod(remainder, size)
+                key.append(CATEGORIES[attribute][0][code])
+            result[tuple(reversed(key))] = int(counts[index])
+        return result
+
+
+def names(attribute, codes):
+    """Turn codes of a board attribute back into an array of names."""
+    return numpy.array(CATEGORIES[attribute][0])[codes]
+
+
+def parse_words(filename):
+    """Worker: parse one dump file, Return (words bytes, present mask) or None if it is bad."""
+    try:
+        dump = OTPParser.OTPDump.from_file(filename)
+    except (OTPParser.InvalidDumpError, IOError, OSError):
+        return None
+    return dump.words.tobytes(), dump.present >> OTPParser.FIRST_REGION
+
+
+def load_files(files, jobs=None, chunksize=256):
+    """Parse dump files with a worker pool into an OTPMatrix, Return (matrix, bad file count).
+    Worker results are copied into the preallocated matrix as they arrive, so they are not all held at once.
+    """
+    words = numpy.empty((len(files), OTPParser.NUM_REGIONS), dtype=numpy.uint32)
+    present = numpy.empty(len(files), dtype=numpy.uint64)
+    sources = []
+    word_type = numpy.dtype(OTPParser.WORD_TYPECODE)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for filename, result in zip(files, pool.imap(parse_words, files, chunksize)):
+            if result is not None:
+                words[len(sources)] = numpy.frombuffer(result[0], dtype=word_type)
+                present[len(sources)] = result[1]
+                sources.append(filename)
+    finally:
+        pool.close()
+        pool.join()
+    good = len(sources)
+    return OTPMatrix(words[:good], present[:good], sources), len(files) - good
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Decode a fleet of OTP dumps with NumPy.')
+    parser.add_argument('paths', nargs='+', help='dump files, directories or glob patterns')
+    parser.add_argument('--by', default='board_type,manufacturer',
+                        help='comma separated attributes to count by (' +
+                        ', '.join(attribute for attribute, _, _, _ in ATTRIBUTES) + ')')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+    if numpy is None:
+        sys.exit('OTPMatrix requires numpy!')
+
+    by = tuple(args.by.split(','))
+    for attribute in by:
+        if attribute not in CATEGORIES:
+            parser.error("unknown attribute '" + attribute + "'")
+
+    matrix, bad = load_files(OTPFleet.expand_paths(args.paths), args.jobs)
+    for key, count in sorted(matrix.counts(by).items(), key=lambda item: -item[1]):
+        print('%10d : %s' % (count, ' / '.join(key)))
+    print('%10d : dumps, %d failed serial checksum, %d bootmode mismatches, %d unreadable' %
+          (len(matrix), int((~matrix.serial_ok()).sum()), int((~matrix.bootmode_ok()).sum()), bad))
+
+
+if __name__ == "__main__":
+    main()
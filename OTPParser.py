@@ -22,16 +22,32 @@
 
  Usage
  call either ./OTPParser.py <filename> or vgcencmd otp_dump | OTPParser
+ add --format json, jsonl, csv or msgpack for machine readable output, keyed by region and field names.
+ add --fields serial_number,revision_number,mac_address to only read, check and print those.
+ When run on every boot, prefer 'python3 -m OTPParser', which starts from the cached bytecode.
 """
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import sys
-from string import hexdigits
+from array import array
+from binascii import unhexlify
+from collections import OrderedDict, namedtuple
 from os import path
 
-if (sys.version_info < (2, 6) or (sys.version_info >= (3, 0) and sys.version_info < (3, 3))):
-    sys.exit('OTPParser requires Python 2.6 or 3.3 and newer.')
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2 has no lru_cache, decode every time there
+    def lru_cache(maxsize=128):
+        """Stand-in for functools.lru_cache that does not cache."""
+        def decorator(function):
+            function.cache_info = lambda: None
+            function.cache_clear = lambda: None
+            return function
+        return decorator
+
+if (sys.version_info < (2, 7) or (sys.version_info >= (3, 0) and sys.version_info < (3, 3))):
+    sys.exit('OTPParser requires Python 2.7 or 3.3 and newer.')
 
 if sys.version_info < (3, 3): # only applying future imports to Python2
     try:
@@ -46,8 +62,28 @@ if sys.version_info < (3, 3): # only applying future imports to Python2
         sys.exit("OTPParser requires future! (Cant import 'builtins'")
 
 
-class TypoError(Exception):
-    """TypoError exception."""
+class InvalidDumpError(Exception):
+    """Raised when an OTP dump can not be parsed."""
+    pass
+
+
+class TypoError(InvalidDumpError):
+    """TypoError exception, Raised when the dump holds 'Command not registered' instead of OTP values."""
+    pass
+
+
+class InvalidRegionError(InvalidDumpError):
+    """Raised when a line of the dump does not start with a region number."""
+    pass
+
+
+class InvalidDataError(InvalidDumpError):
+    """Raised when the data of a region is not hexadecimal."""
+    pass
+
+
+class EmptyDumpError(InvalidDumpError):
+    """Raised when a dump holds no regions at all."""
     pass
 
 
@@ -219,9 +255,9 @@ REGIONS = {
     'boot_sign_key_3':        21,  # OTP_BOOT_SIGNING_KEY Always ffffffff unless on baremetal read
     'boot_sign_key_4':        22,  # OTP_BOOT_SIGNING_KEY Always ffffffff unless on baremetal read
     'boot_sign_key_1_copy':   23,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
-    'boot_sign_key_1_copy':   24,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
-    'boot_sign_key_1_copy':   25,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
-    'boot_sign_key_1_copy':   26,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
+    'boot_sign_key_2_copy':   24,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
+    'boot_sign_key_3_copy':   25,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
+    'boot_sign_key_4_copy':   26,  # OTP_BOOT_SIGNING_KEY_REDUNDANT Always ffffffff unless on baremetal read
     'boot_signing_parity':    27,  # Boot Signing Parity
     'serial_number':          28,  # Serial Number
     'serial_number_inverted': 29,  # Serial Number (Bitflipped)
@@ -274,189 +310,800 @@ BOARD = {
 
 DATA = {}
 
+NUM_REGIONS = 67  # Regions 0-66
+FIRST_REGION = 8  # vcgencmd only dumps 8 and up
+WORD_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+hexdigits = '0123456789abcdefABCDEF'  # string.hexdigits, without importing string (and re) at startup
+HEX_DIGITS = frozenset(hexdigits)
+HEX_DIGIT_BYTES = hexdigits.encode('ascii')
+
 
 def is_hex(string):
     """Check if the string is hexidecimal.
     Credit to eumiro, stackoverflow:
     https://stackoverflow.com/questions/11592261/check-if-a-string-is-hexadecimal
     """
-    hex_digits = set(hexdigits)
-    # if string is long, then it is faster to check against a set
-    return all(c in hex_digits for c in string)
+    return all(c in HEX_DIGITS for c in string)
+
+
+def process_hub_timeout(bit):
+    """Return the HUB timeout."""
+    if int(bit) == 1:
+        return '5 Seconds'
+    return '2 Seconds'
+
+
+def process_eth_clk_frequency(bit):
+    """Return the ETH_CLK frequency."""
+    if int(bit) == 1:
+        return '24MHz'
+    return '25MHz'
+
+
+# Bitfields of the registers, as (region, bit offset, width, name, decoder).
+# Offsets count from the least significant bit, the decoder (if any) turns the field value into something readable.
+FIELDS = (
+    ('control',              0,  6, 'bits_0-5',              None),  # Unknown/Unused
+    ('control',              6,  1, 'bit_6',                 None),  # OTP_ARM_DISABLE_REDUNDANT_BITXXX
+    ('control',              7,  1, 'bit_7',                 None),  # OTP_ARM_DISABLE_BITXXX
+    ('control',              8,  1, 'bit_8',                 None),  # Unknown/Unused
+    ('control',              9,  1, 'bit_9',                 None),  # OTP_DECRYPTION_ENABLE_FOR_DEBUGXXX
+    ('control',             10,  1, 'bit_10',                None),  # Unknown/Unused
+    ('control',             11,  1, 'bit_11',                None),  # OTP_MACROVISION_REDUNDANT_START_BITXXX
+    ('control',             12,  1, 'bit_12',                None),  # Unknown/Unused
+    ('control',             13,  1, 'bit_13',                None),  # OTP_MACROVISION_START_BITXXX
+    ('control',             14,  1, 'bit_14',                None),  # OTP_JTAG_DISABLE_REDUNDANT_BITXXX
+    ('control',             15,  1, 'bit_15',                None),  # OTP_JTAG_DISABLE_BITXXX
+    ('control',             16,  8, 'bits_16-23',            None),  # OTP_VPU_CACHE_KEY_PARITY_START_BIT (Seen: 0x28)
+    ('control',             24,  8, 'bits_24-31',            None),  # OTP_JTAG_DEBUG_KEY_PARITY_START_BIT (Seen: 0x24 & 0x64)
+    ('bootmode',             0,  1, 'bit_0',                 None),  # Unknown (Gordon hinted the Pi wouldn't boot with this set)
+    ('bootmode',             1,  1, 'bit_1',                 None),  # Sets the oscillator frequency to 19.2MHz
+    ('bootmode',             2,  1, 'bit_2',                 None),  # Unknown (Gordon hinted the Pi wouldn't boot with this set)
+    ('bootmode',             3,  1, 'bit_3',                 None),  # Enables pull ups on the SDIO pins
+    ('bootmode',             4,  1, 'bit_4',                 None),  # Set on PI4B
+    ('bootmode',             5,  1, 'bit_5',                 None),  # Set on Pi4B
+    ('bootmode',             6,  1, 'bit_6',                 None),  # Unknown/Unused
+    ('bootmode',             7,  1, 'bit_7',                 None),  # Set on PI4B
+    ('bootmode',             8, 11, 'bits_8-18',             None),  # Unknown/Unused
+    ('bootmode',            19,  1, 'bit_19',                None),  # Enables GPIO bootmode
+    ('bootmode',            20,  1, 'bit_20',                None),  # Sets the bank to check for GPIO bootmode
+    ('bootmode',            21,  1, 'bit_21',                None),  # Enables booting from SD card
+    ('bootmode',            22,  1, 'bit_22',                None),  # Sets the bank to boot from (That's what Gordon said, Unclear)
+    ('bootmode',            23,  2, 'bits_23-24',            None),  # Unknown/Unused
+    ('bootmode',            25,  1, 'bit_25',                None),  # Unknown (Is set on the Compute Module 3)
+    ('bootmode',            26,  2, 'bits_26-27',            None),  # Unknown/Unused
+    ('bootmode',            28,  1, 'bit_28',                None),  # Enables USB device booting
+    ('bootmode',            29,  1, 'bit_29',                None),  # Enables USB host booting (Ethernet and Mass Storage)
+    ('bootmode',            30,  2, 'bits_31-30',            None),  # Unknown/Unused
+    ('boot_signing_parity',  0, 16, 'bits_0-15',             None),  # Data seen here
+    ('boot_signing_parity', 16, 16, 'bits_16-31',            None),
+    ('revision_number',      0,  4, 'board_revision',        None),  # Revision of the board
+    ('revision_number',      0,  5, 'legacy_board_revision', None),  # Region used to store the legacy revision
+    ('revision_number',      4,  8, 'board_type',            None),  # Model of the board
+    ('revision_number',     12,  4, 'processor',             None),  # Installed Processor
+    ('revision_number',     16,  4, 'manufacturer',          None),  # Manufacturer of the board
+    ('revision_number',     20,  3, 'memory_size',           None),  # Amount of RAM the board has
+    ('revision_number',     23,  1, 'new_flag',              None),  # If set, this board uses the new versioning scheme
+    ('revision_number',     24,  1, 'bit_24',                None),  # Unused
+    ('revision_number',     25,  1, 'warranty',              None),  # Warranty Bit
+    ('revision_number',     26,  3, 'bits_26-28',            None),  # Unused
+    ('revision_number',     29,  1, 'otp_read',              None),  # OTP Read Bit
+    ('revision_number',     30,  1, 'otp_program',           None),  # OTP Program Bit
+    ('revision_number',     31,  1, 'overvoltage',           None),  # Overvoltage Bit
+    ('overclock',            0,  1, 'overvolt_protection',   None),  # Overvolt protection bit
+    ('overclock',            1, 31, 'bits_1-31',             None),  # Unknown/Unused
+    ('advanced_boot',        0,  7, 'bits_0-6',              None),  # GPIO for ETH_CLK output pin
+    ('advanced_boot',        7,  1, 'bit_7',                 None),  # Enable ETH_CLK output pin
+    ('advanced_boot',        8,  7, 'bits_8-14',             None),  # GPIO for LAN_RUN output pin
+    ('advanced_boot',       15,  1, 'bit_15',                None),  # Enable LAN_RUN output pin
+    ('advanced_boot',       16,  8, 'bits_16-23',            None),  # Unknown/Unused
+    ('advanced_boot',       24,  1, 'bit_24',                process_hub_timeout),        # Extend USB HUB timeout parameter
+    ('advanced_boot',       25,  1, 'bit_25',                process_eth_clk_frequency),  # ETH_CLK Frequency
+    ('advanced_boot',       26,  6, 'bits_26-31',            None),  # Unknown/Unused
+)
+
+
+class Field(object):
+    """A bitfield of FIELDS compiled to a shift and mask on its region's word."""
+    __slots__ = ('key', 'loc', 'name', 'region', 'shift', 'mask', 'width', 'decoder', 'binary_format')
+
+    def __init__(self, loc, offset, width, name, decoder):
+        self.key = loc + '.' + name
+        self.loc = loc
+        self.name = name
+        self.region = REGIONS[loc]
+        self.shift = offset
+        self.mask = (1 << width) - 1
+        self.width = width
+        self.decoder = decoder
+        self.binary_format = '0' + str(width) + 'b'
+
+
+def compile_fields(fields):
+    """Compile a table of bitfields, Return {key: Field} with keys like 'control.bit_15'."""
+    compiled = {}
+    for field in fields:
+        compiled_field = Field(*field)
+        compiled[compiled_field.key] = compiled_field
+    return compiled
+
+
+COMPILED_FIELDS = compile_fields(FIELDS)
+# The same fields as {region name: {field name: Field}}, for the handlers.
+HANDLER_FIELDS = {}
+for field in COMPILED_FIELDS.values():
+    HANDLER_FIELDS.setdefault(field.loc, {})[field.name] = field
+# Fields grouped as (region, ((key, shift, mask, decoder), ...)) so a whole dump can be decoded in one pass.
+DECODE_PLAN = tuple(
+    (region, tuple((field.key, field.shift, field.mask, field.decoder)
+                   for field in COMPILED_FIELDS.values() if field.region == region))
+    for region in sorted(set(field.region for field in COMPILED_FIELDS.values())))
+
+
+# Consistency rules as (name, check, operand, other operand, message), operands are REGIONS names or FIELDS keys.
+# 'equal' rules compare a value with its redundant copy, 'inverse' rules compare a value with its bitwise inverse.
+RULES = (
+    ('bootmode_copy',          'equal',   'bootmode',        'bootmode_copy',
+     'Bootmode fields are not the same, this is a bad thing!'),
+    ('serial_inverse',         'inverse', 'serial_number',   'serial_number_inverted',
+     'Serial failed checksum!'),
+    ('arm_disable_redundant',  'equal',   'control.bit_7',   'control.bit_6',
+     'ARM disable bit and its redundant copy differ!'),
+    ('macrovision_redundant',  'equal',   'control.bit_13',  'control.bit_11',
+     'Macrovision start bit and its redundant copy differ!'),
+    ('jtag_disable_redundant', 'equal',   'control.bit_15',  'control.bit_14',
+     'JTAG disable bit and its redundant copy differ!'),
+    ('boot_sign_key_1_copy',   'equal',   'boot_sign_key_1', 'boot_sign_key_1_copy',
+     'Boot signing key 1 and its redundant copy differ!'),
+    ('boot_sign_key_2_copy',   'equal',   'boot_sign_key_2', 'boot_sign_key_2_copy',
+     'Boot signing key 2 and its redundant copy differ!'),
+    ('boot_sign_key_3_copy',   'equal',   'boot_sign_key_3', 'boot_sign_key_3_copy',
+     'Boot signing key 3 and its redundant copy differ!'),
+    ('boot_sign_key_4_copy',   'equal',   'boot_sign_key_4', 'boot_sign_key_4_copy',
+     'Boot signing key 4 and its redundant copy differ!'),
+)
+
+
+class Rule(object):
+    """A rule of RULES compiled to (region, shift, mask) operands."""
+    __slots__ = ('name', 'check', 'operands', 'required', 'message')
+
+    def __init__(self, name, check, operand, other, message):
+        self.name = name
+        self.check = check
+        self.operands = tuple(operand_location(key) for key in (operand, other))
+        self.required = (1 << self.operands[0][0]) | (1 << self.operands[1][0])
+        self.message = message
+
+    def failed(self, words, present):
+        """Return whether the rule fails on a dump's words, False if one of its regions was not dumped."""
+        if present & self.required != self.required:
+            return False
+        (region, shift, mask), (other_region, other_shift, other_mask) = self.operands
+        value = words[region] >> shift & mask
+        other = words[other_region] >> other_shift & other_mask
+        if self.check == 'inverse':
+            return value ^ other != mask
+        return value != other
+
+
+def operand_location(key):
+    """Return (region, shift, mask) of a REGIONS name or FIELDS key."""
+    if key in COMPILED_FIELDS:
+        field = COMPILED_FIELDS[key]
+        return field.region, field.shift, field.mask
+    return REGIONS[key], 0, 0xffffffff
+
+
+COMPILED_RULES = tuple(Rule(*rule) for rule in RULES)
+
+
+def parse_line(line):
+    """Parse one 'NN:xxxxxxxx' line of a dump, Return (region, value).
+    Raises an InvalidDumpError (or one of its subclasses) if the line is bad.
+    """
+    if "Command not registered" in line:
+        raise TypoError("Invalid OTP Dump. Please run 'vcgencmd otp_dump' to create file.")
+    parts = line.split(':', 1)
+    try:
+        region = int(parts[0])
+    except ValueError:
+        raise InvalidRegionError("Invalid OTP Dump (invalid region number '" + parts[0] + "')")
+    if len(parts) < 2:
+        raise InvalidDumpError('Invalid OTP Dump')
+    data = parts[1][:8].rstrip('\r\n')
+    if not data or not is_hex(data):
+        raise InvalidDataError("Invalid OTP Dump (Reading region " + str(region) +
+                               ", string '" + data + "' is not hexadecimal.)")
+    return region, int(data, 16)
+
+
+def text_lines(data):
+    """Split a bytes buffer into lines the way iterating over a text file does."""
+    lines = data.decode('utf-8', 'replace').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+
+
+def tokenize(data, skip_blank=False):
+    """Tokenize a whole buffer of 'NN:xxxxxxxx' lines at the bytes level, Return (region numbers, words).
+    Region numbers and hex data are checked in bulk and every word is converted to an int once.
+    Raises the same InvalidDumpError as parse_line() for the first bad line.
+    """
+    return check_tokens(data, split_tokens(data, skip_blank), skip_blank)
+
+
+def split_tokens(data, skip_blank=False):
+    """Split a buffer into the (region numbers, separators, hex words) of its lines, unchecked."""
+    lines = data.splitlines()
+    if skip_blank:
+        lines = [line for line in lines if line.strip()]
+    if not lines:
+        return (), (), ()
+    numbers, separators, rests = zip(*[line.partition(b':') for line in lines])
+    return numbers, separators, [rest[:8] for rest in rests]
+
+
+def check_tokens(data, tokens, skip_blank=False):
+    """Check and convert the split_tokens() of a buffer, Return (region numbers, words) like tokenize()."""
+    numbers, separators, words = tokens
+    if not numbers:
+        return [], []
+    hex_data = b''.join(words)
+    if (b'Command not registered' in data or not all(separators) or not all(numbers) or not all(words) or
+            not b''.join(numbers).isdigit() or hex_data.translate(None, HEX_DIGIT_BYTES)):
+        # Something is off, let parse_line() find the line and raise its error
+        lines = [line for line in text_lines(data) if not skip_blank or line.strip()]
+        pairs = [parse_line(line) for line in lines]
+        return [region for region, _ in pairs], [value for _, value in pairs]
+    if len(hex_data) == 8 * len(words):
+        values = array(WORD_TYPECODE)
+        if hasattr(values, 'frombytes'):
+            values.frombytes(unhexlify(hex_data))
+        else:  # Python 2
+            values.fromstring(unhexlify(hex_data))
+        if sys.byteorder == 'little':
+            values.byteswap()
+    else:
+        values = [int(word, 16) for word in words]
+    return [int(number) for number in numbers], values
+
+
+def parse_buffer(data, source=None):
+    """Parse a whole buffer of any number of concatenated dumps in one pass, Return a list of OTPDump.
+    Dumps are split the same way as by OTPStreamParser, blank lines are skipped.
+    """
+    numbers, values = tokenize(data, skip_blank=True)
+    dumps = []
+    dump = None
+    last_region = -1
+    for region, value in zip(numbers, values):
+        if not 0 <= region < NUM_REGIONS:
+            continue
+        if dump is not None and region <= last_region:
+            dumps.append(dump)
+            dump = None
+        if dump is None:
+            dump = OTPDump(source)
+        dump.words[region] = value
+        dump.present |= 1 << region
+        last_region = region
+        if region == NUM_REGIONS - 1:
+            dumps.append(dump)
+            dump = None
+            last_region = -1
+    if dump is not None:
+        dumps.append(dump)
+    return dumps
+
+
+def legacy_board_bits(bits):
+    """Return (memory, manufacturer, processor, type, revision) bits for a legacy board revision."""
+    input_dict = LEGACY_REVISIONS.get(bits, LEGACY_REVISIONS['default'])
+    return (MEMORY_SIZES[input_dict['memory_size']],
+            MANUFACTURERS[input_dict['manufacturer']],
+            PROCESSORS[input_dict['processor']],
+            BOARD_TYPES[input_dict['board_type']],
+            BOARD_REVISIONS[input_dict['board_revision']])
+
+
+def board_type_name(bits):
+    """Return the name of a board type, or its value marked unknown if it has none."""
+    return BOARD_TYPES_AS_STRING.get(bits, "{} (unknown)".format(bin(int(bits or '0', 2))))
+
+
+RevisionInfo = namedtuple('RevisionInfo', [
+    'memory_size', 'manufacturer', 'processor', 'board_type', 'board_revision',  # Names, as printed
+    'new_flag', 'warranty', 'overvoltage', 'otp_program', 'otp_read',            # Flag bits, as ints
+    'bits'])  # (memory, manufacturer, processor, type, revision) bits, as stored in BOARD
+
+REVISION_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=REVISION_CACHE_SIZE)
+def decode_revision(word):
+    """Decode a 32-bit revision_number word, Return an immutable RevisionInfo.
+    Results are cached, a fleet only holds a few hundred distinct revision words.
+    """
+    fields = HANDLER_FIELDS['revision_number']
+
+    def bits(name):
+        field = fields[name]
+        return format(word >> field.shift & field.mask, field.binary_format)
+
+    if bits('new_flag') == '0':
+        board = legacy_board_bits(bits('legacy_board_revision'))
+    else:
+        board = (bits('memory_size'), bits('manufacturer'), bits('processor'), bits('board_type'), bits('board_revision'))
+    return RevisionInfo(MEMORY_SIZES_AS_STRING[board[0]],
+                        MANUFACTURERS_AS_STRING[board[1]],
+                        PROCESSORS_AS_STRING[board[2]],
+                        board_type_name(board[3]),
+                        BOARD_REVISIONS_AS_STRING[board[4]],
+                        int(bits('new_flag'), 2),
+                        int(bits('warranty'), 2),
+                        int(bits('overvoltage'), 2),
+                        int(bits('otp_program'), 2),
+                        int(bits('otp_read'), 2),
+                        board)
+
+
+def revision_cache_info():
+    """Return the (hits, misses, maxsize, currsize) statistics of the revision cache."""
+    return decode_revision.cache_info()
+
+
+def encode_revision(memory_size, manufacturer, processor, board_type, board_revision,
+                    new_flag=1, warranty=0, overvoltage=0, otp_program=0, otp_read=0):
+    """Pack board names into a 32-bit revision_number word, the reverse of decode_revision().
+    With new_flag=0 the word holds the first LEGACY_REVISIONS code of the board instead.
+    Raise ValueError for names that have no bits to store.
+    """
+    fields = HANDLER_FIELDS['revision_number']
+    names = (memory_size, manufacturer, processor, board_type, board_revision)
+    word = 0
+    if new_flag:
+        parts = (('memory_size', MEMORY_SIZES), ('manufacturer', MANUFACTURERS), ('processor', PROCESSORS),
+                 ('board_type', BOARD_TYPES), ('board_revision', BOARD_REVISIONS))
+        for name, (key, table) in zip(names, parts):
+            bits = table.get(name, '')
+            if not bits or set(bits) - set('01'):
+                raise ValueError('Can not encode ' + key + ' ' + repr(name))
+            word |= int(bits, 2) << fields[key].shift
+    else:
+        keys = ('memory_size', 'manufacturer', 'processor', 'board_type', 'board_revision')
+        codes = [code for code, board in sorted(LEGACY_REVISIONS.items())
+                 if code != 'default' and tuple(board[key] for key in keys) == names]
+        if not codes:
+            raise ValueError('No legacy revision for ' + repr(names))
+        word = int(codes[0], 2) << fields['legacy_board_revision'].shift
+    for name, value in (('new_flag', new_flag), ('warranty', warranty), ('overvoltage', overvoltage),
+                        ('otp_program', otp_program), ('otp_read', otp_read)):
+        word |= (1 if value else 0) << fields[name].shift
+    return word
+
+
+class OTPDump(object):
+    """A single OTP dump.
+    The 32-bit words are kept in a compact array indexed by REGIONS number, with a bitmask
+    of the regions that were present, so any number of dumps can be parsed and decoded at
+    once without sharing state.
+    """
+    __slots__ = ('words', 'present', 'source')
+
+    def __init__(self, source=None):
+        self.words = array(WORD_TYPECODE, [0]) * NUM_REGIONS
+        self.present = 0
+        self.source = source
+
+    @classmethod
+    def parse(cls, lines, source=None, regions=None):
+        """Parse the lines of a 'vcgencmd otp_dump', Raise InvalidDumpError if it is bad.
+        If regions is a set of region numbers, lines of any other region are skipped without validating their data.
+        """
+        dump = cls(source)
+        empty = True
+        for line in lines:
+            empty = False
+            if regions is not None:
+                number = line.split(':', 1)[0]
+                if number.isdigit() and int(number) not in regions:
+                    continue
+            region, value = parse_line(line)
+            if 0 <= region < NUM_REGIONS:
+                dump.set_word(region, value)
+        if empty or regions is None and not dump.present:
+            raise EmptyDumpError("Invalid OTP Dump (empty file). Please run 'vcgencmd otp_dump' to create file.")
+        return dump
+
+    @classmethod
+    def from_bytes(cls, data, source=None, regions=None):
+        """Parse a whole dump held in a bytes buffer, Checking and converting it in bulk.
+        Gives the same dump, and raises the same errors, as parse().
+        """
+        if regions is not None:
+            return cls.parse(text_lines(data), source, regions)
+        numbers, values = tokenize(data)
+        return cls.from_tokens(numbers, values, source)
+
+    @classmethod
+    def from_tokens(cls, numbers, values, source=None):
+        """Build a dump from the (region numbers, words) of tokenize()."""
+        dump = cls(source)
+        for region, value in zip(numbers, values):
+            if 0 <= region < NUM_REGIONS:
+                dump.words[region] = value
+                dump.present |= 1 << region
+        if not dump.present:
+            raise EmptyDumpError("Invalid OTP Dump (empty file). Please run 'vcgencmd otp_dump' to create file.")
+        return dump
+
+    @classmethod
+    def from_file(cls, filename, regions=None):
+        """Parse the OTP dump stored in filename."""
+        with open(filename, 'rb') as otp_file:
+            return cls.from_bytes(otp_file.read(), filename, regions)
+
+    def set_word(self, region, value):
+        """Store the 32-bit value of a region by number."""
+        self.words[region] = value
+        self.present |= 1 << region
+
+    def set(self, loc, value):
+        """Store the 32-bit value of a named region."""
+        self.set_word(REGIONS[loc], value)
+
+    def set_field(self, key, value):
+        """Set a bitfield by key, for example set_field('bootmode.bit_21', 1), the reverse of field().
+        A region that was not dumped is added as zero first, Raise ValueError if value does not fit.
+        """
+        field = COMPILED_FIELDS[key]
+        if not 0 <= value <= field.mask:
+            raise ValueError('Value ' + str(value) + ' does not fit in ' + key)
+        word = self.words[field.region] if self.present >> field.region & 1 else 0
+        self.set_word(field.region, word & ~(field.mask << field.shift) | value << field.shift)
+
+    def has(self, loc):
+        """Return whether the named region was present in the dump."""
+        return bool(self.present >> REGIONS[loc] & 1)
+
+    def word(self, loc):
+        """Return the named region as an int, Raise KeyError if it was not dumped."""
+        region = REGIONS[loc]
+        if not self.present >> region & 1:
+            raise KeyError(region)
+        return self.words[region]
+
+    def regions(self):
+        """Return the dumped regions as {region number: raw hex string}."""
+        return dict((region, format(self.words[region], '08x'))
+                    for region in range(NUM_REGIONS) if self.present >> region & 1)
+
+    def to_text(self):
+        """Return the dump in the format printed by 'vcgencmd otp_dump'."""
+        return ''.join('%02d:%08x\n' % (region, self.words[region])
+                       for region in range(NUM_REGIONS) if self.present >> region & 1)
+
+    def get(self, loc, specifier='raw'):
+        """Get data from specified OTP region.
+        Specifier determines whether it is returned 'raw', in 'binary', in 'octal', or in 'hex'idecimal.
+        """
+        value = self.word(loc)
+        if specifier == 'raw':
+            return format(value, '08x')
+        elif specifier == 'binary':
+            return format(value, '032b')
+        elif specifier == 'hex':
+            return format(value, '#010x')
+        elif specifier == 'octal':
+            # TODO: Ask jas for more details on what she wants the octal output to look like.
+            return format(value, '#018o')
+        else:
+            raise ValueError('Invalid Flag.')
+
+    def field(self, key):
+        """Return the value of a bitfield by key, for example field('control.bit_15')."""
+        return self.field_value(COMPILED_FIELDS[key])
+
+    def field_value(self, field):
+        """Return the value of a compiled Field, Raise KeyError if its region was not dumped."""
+        if not self.present >> field.region & 1:
+            raise KeyError(field.region)
+        return self.words[field.region] >> field.shift & field.mask
+
+    def decode(self, readable=False):
+        """Decode every bitfield of the dumped regions in one pass, Return {key: int}.
+        If readable is set, fields with a decoder are returned decoded instead.
+        """
+        words = self.words
+        present = self.present
+        decoded = {}
+        for region, fields in DECODE_PLAN:
+            if present >> region & 1:
+                word = words[region]
+                for key, shift, mask, decoder in fields:
+                    if readable and decoder is not None:
+                        decoded[key] = decoder(word >> shift & mask)
+                    else:
+                        decoded[key] = word >> shift & mask
+        return decoded
+
+    def _binary(self, loc, name):
+        """Return a bitfield as a binary string, as the handlers have always returned them."""
+        field = HANDLER_FIELDS[loc][name]
+        if not self.present >> field.region & 1:
+            raise KeyError(field.region)
+        return format(self.words[field.region] >> field.shift & field.mask, field.binary_format)
+
+    def control(self, name):
+        """Handler for region 16."""
+        return self._binary('control', name)
+
+    def bootmode(self, name):
+        """Handler for region 17."""
+        return self._binary('bootmode', name)
+
+    def boot_signing_parity(self, name):
+        """Handler for region 27."""
+        return self._binary('boot_signing_parity', name)
+
+    def revision(self, name):
+        """Handler for region 30."""
+        return self._binary('revision_number', name)
+
+    def overclock(self, name):
+        """Handler for region 32."""
+        return self._binary('overclock', name)
+
+    def advanced_boot(self, name):
+        """Handler for region 66."""
+        return self._binary('advanced_boot', name)
+
+    def check_bootmode(self):
+        """Check bootmode against the backup, Return a warning or None."""
+        if self.word('bootmode') != self.word('bootmode_copy'):
+            return 'Bootmode fields are not the same, this is a bad thing!'
+        return None
+
+    def check_serial(self):
+        """Check Serial against Inverse Serial, Return a warning or None."""
+        if self.word('serial_number') ^ self.word('serial_number_inverted') != 0xffffffff:
+            return 'Serial failed checksum!'
+        return None
+
+    def findings(self):
+        """Run every rule of RULES whose regions were dumped, Return a finding dict per failed rule."""
+        findings = []
+        words, present = self.words, self.present
+        for rule in COMPILED_RULES:
+            if rule.failed(words, present):
+                findings.append({
+                    'rule': rule.name,
+                    'message': rule.message,
+                    'values': [words[region] >> shift & mask for region, shift, mask in rule.operands],
+                })
+        return findings
+
+    def warnings(self):
+        """Return the warnings of every consistency rule whose regions were dumped."""
+        return [finding['message'] for finding in self.findings()]
+
+    def revision_info(self):
+        """Return the decoded revision_number as a RevisionInfo."""
+        return decode_revision(self.word('revision_number'))
+
+    def board_bits(self):
+        """Return (memory, manufacturer, processor, type, revision) bits, Handling old and new style."""
+        return self.revision_info().bits
+
+    def board(self):
+        """Return the board information in the same layout as BOARD."""
+        return dict(zip(('memory', 'manufacturer', 'processor', 'type', 'revision'), self.board_bits()))
+
+    def format_mac(self):
+        """Format MAC Address in a human readable fashion."""
+        mac_part_1 = self.get('mac_address_one', 'raw')
+        mac_part_2 = self.get('mac_address_two', 'raw')
+        if not mac_part_1 == '00000000':
+            mac = mac_part_1 + mac_part_2
+            return ':'.join(mac[i:i+2] for i in range(0, 12, 2))
+        return 'None'
+
+
+
+class OTPStreamParser(object):
+    """Incremental parser for any number of concatenated dumps, for pipes and sockets.
+    Feed it chunks of bytes of any size, dumps are split where the region numbers start again
+    and each one is handed out as soon as region 66 or the start of the next dump arrives.
+    Only the current line and the dump being built are held in memory.
+    """
+    LAST_REGION = NUM_REGIONS - 1
+    MAX_LINE_LENGTH = 1024
+    LONG_LINE = b'\0'  # Left in the buffer in place of a line that was too long
+
+    def __init__(self, source=None):
+        self.source = source
+        self.count = 0  # Dumps completed so far
+        self._buffer = b''
+        self._position = 0  # Start of the first unparsed line in the buffer
+        self._dump = None
+        self._last_region = -1
+        self._skipping = False  # Skipping the rest of a bad dump
+        self._long_line = False  # Dropping the rest of a line that was too long, see feed()
+
+    def feed(self, chunk):
+        """Add a chunk of data, Return an iterator of the dumps it completed.
+        If a line is bad its InvalidDumpError is raised from the iterator, the dump being built is
+        dropped and the rest of it skipped up to where the region numbers start again. The iterator
+        can be used again after the error and carries on with the next line.
+        A line longer than MAX_LINE_LENGTH is cut here, even if the iterator is never used, and its
+        error is raised when the iterator gets to it.
+        """
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('ascii', 'replace')
+        if self._long_line:
+            end = chunk.find(b'\n')
+            chunk = chunk[end:] if end >= 0 else b''
+            self._long_line = end < 0
+        self._buffer += chunk
+        line_start = max(self._buffer.rfind(b'\n') + 1, self._position)
+        if len(self._buffer) - line_start > self.MAX_LINE_LENGTH:
+            self._buffer = self._buffer[:line_start] + self.LONG_LINE
+            self._long_line = True
+        return iter(self._next_dump, None)
+
+    def close(self):
+        """Signal the end of the stream, Return an iterator of the dumps it completed."""
+        self._long_line = False
+        self._buffer += b'\n'
+        for dump in iter(self._next_dump, None):
+            yield dump
+        if self._dump is not None:
+            yield self._finish()
+
+    def _next_dump(self):
+        """Parse complete lines of the buffer up to the end of a dump, Return it, or None when they run out."""
+        while True:
+            start = self._position
+            end = self._buffer.find(b'\n', start)
+            if end < 0:
+                self._buffer = self._buffer[start:]
+                self._position = 0
+                return None
+            line = self._buffer[start:end].decode('ascii', 'replace')
+            self._position = end + 1
+            if not line.strip():
+                continue
+            try:
+                if line == '\0':  # LONG_LINE
+                    raise InvalidDumpError('Invalid OTP Dump (line too long)')
+                region, value = parse_line(line)
+            except InvalidDumpError:
+                number = line.split(':', 1)[0].strip()
+                skipping = self._skipping
+                self._drop(int(number) if number.isdigit() else None)
+                if skipping:
+                    continue
+                raise
+            if not 0 <= region < NUM_REGIONS:
+                continue
+            if self._skipping:
+                if region > self._last_region:  # Still the bad dump
+                    self._last_region = region
+                    continue
+                self._skipping = False
+                self._last_region = -1
+            if self._dump is not None and region <= self._last_region:
+                self._position = start  # The first line of the next dump, parsed again
+                return self._finish()
+            if self._dump is None:
+                self._dump = OTPDump(self.source)
+            self._dump.set_word(region, value)
+            self._last_region = region
+            if region == self.LAST_REGION:
+                return self._finish()
+
+    def _drop(self, region=None):
+        """Drop the dump being built and skip the rest of it, region is that of the bad line if known.
+        A bad line without a region number between dumps is not part of one, so nothing is skipped.
+        """
+        if region is None and self._dump is None and not self._skipping:
+            return
+        self._dump = None
+        self._skipping = True
+        if region is not None:
+            self._last_region = region
+
+    def _finish(self):
+        """Hand out the dump being built."""
+        dump = self._dump
+        self._dump = None
+        self._last_region = -1
+        self.count += 1
+        return dump
+
+
+def iter_dumps(stream, source=None, chunk_size=65536):
+    """Yield every dump read from a binary file object or socket file, one chunk at a time."""
+    parser = OTPStreamParser(source)
+    chunk = stream.read(chunk_size)
+    while chunk:
+        for dump in parser.feed(chunk):
+            yield dump
+        chunk = stream.read(chunk_size)
+    for dump in parser.close():
+        yield dump
+
+# The module level functions below work on the most recently read dump, kept in DUMP (and DATA for compatibility).
+DUMP = OTPDump()
 
 
 def control(name):
     """Handler for region 16."""
-    indices = {
-        'bits_0-5':   (26, 32),  # Unknown/Unused
-        'bit_6':      (25, 26),  # OTP_ARM_DISABLE_REDUNDANT_BITXXX
-        'bit_7':      (24, 25),  # OTP_ARM_DISABLE_BITXXX
-        'bit_8':      (23, 24),  # Unknown/Unused
-        'bit_9':      (22, 23),  # OTP_DECRYPTION_ENABLE_FOR_DEBUGXXX
-        'bit_10':     (21, 22),  # Unknown/Unused
-        'bit_11':     (20, 21),  # OTP_MACROVISION_REDUNDANT_START_BITXXX
-        'bit_12':     (19, 20),  # Unknown/Unused
-        'bit_13':     (18, 19),  # OTP_MACROVISION_START_BITXXX
-        'bit_14':     (17, 18),  # OTP_JTAG_DISABLE_REDUNDANT_BITXXX
-        'bit_15':     (16, 17),  # OTP_JTAG_DISABLE_BITXXX
-        'bits_16-23': (8, 16),   # OTP_VPU_CACHE_KEY_PARITY_START_BIT (Seen: 0x28)
-        'bits_24-31': (0, 8),    # OTP_JTAG_DEBUG_KEY_PARITY_START_BIT (Seen: 0x24 & 0x64)
-    }[name]
-    __control = get('control', 'binary')
-    return __control[indices[0]: indices[1]]
+    return DUMP.control(name)
 
 
 def bootmode(name):
     """Handler for region 17."""
-    indices = {
-        'bit_0':      (31, 32),  # Unknown (Gordon hinted the Pi wouldn't boot with this set)
-        'bit_1':      (30, 31),  # Sets the oscillator frequency to 19.2MHz
-        'bit_2':      (29, 30),  # Unknown (Gordon hinted the Pi wouldn't boot with this set)
-        'bit_3':      (28, 29),  # Enables pull ups on the SDIO pins
-        'bit_4':      (27, 28),  # Set on PI4B
-        'bit_5':      (26, 27),  # Set on Pi4B
-        'bit_6':      (25, 26),  # Unknown/Unused
-        'bit_7':      (24, 25),  # Set on PI4B
-        'bits_8-18':  (13, 24),  # Unknown/Unused
-        'bit_19':     (12, 13),  # Enables GPIO bootmode
-        'bit_20':     (11, 12),  # Sets the bank to check for GPIO bootmode
-        'bit_21':     (10, 11),  # Enables booting from SD card
-        'bit_22':     (9, 10),   # Sets the bank to boot from (That's what Gordon said, Unclear)
-        'bits_23-24': (7, 9),    # Unknown/Unused
-        'bit_25':     (6, 7),    # Unknown (Is set on the Compute Module 3)
-        'bits_26-27': (4, 6),    # Unknown/Unused
-        'bit_28':     (3, 4),    # Enables USB device booting
-        'bit_29':     (2, 3),    # Enables USB host booting (Ethernet and Mass Storage)
-        'bits_31-30': (0, 2)     # Unknown/Unused
-    }[name]
-    __bootmode = get('bootmode', 'binary')
-    return __bootmode[indices[0]: indices[1]]
+    return DUMP.bootmode(name)
 
 
 def boot_signing_parity(name):
     """Handler for region 27."""
-    indices = {
-        'bits_0-15':  (16, 32),  # Data seen here
-        'bits_16-31': (0, 16),
-    }[name]
-    __boot_signing_parity = get('boot_signing_parity', 'binary')
-    return __boot_signing_parity[indices[0]: indices[1]]
+    return DUMP.boot_signing_parity(name)
 
 
 def revision(name):
     """Handler for region 30."""
-    indices = {
-        'overvoltage':           (0, 1),    # Overvoltage Bit
-        'otp_program':           (1, 2),    # OTP Program Bit
-        'otp_read':              (2, 3),    # OTP Read Bit
-        'bits_26-28':            (3, 6),    # Unused
-        'warranty':              (6, 7),    # Warranty Bit
-        'bit_24':                (7, 8),    # Unused
-        'new_flag':              (8, 9),    # If set, this board uses the new versioning scheme
-        'memory_size':           (9, 12),   # Amount of RAM the board has
-        'manufacturer':          (12, 16),  # Manufacturer of the board
-        'processor':             (16, 20),  # Installed Processor
-        'board_type':            (20, 28),  # Model of the board
-        'board_revision':        (28, 32),  # Revision of the board
-        'legacy_board_revision': (27, 32)   # Region used to store the legacy revision
-    }[name]
-    __revision = get('revision_number', 'binary')
-    return __revision[indices[0]: indices[1]]
+    return DUMP.revision(name)
 
 
 def overclock(name):
     """Handler for region 32."""
-    indices = {
-        'overvolt_protection': (31, 32),  # Overvolt protection bit
-        'bits_1-31':           (0, 31)    # Unknown/Unused
-    }[name]
-    __overclock = get('overclock', 'binary')
-    return __overclock[indices[0]: indices[1]]
+    return DUMP.overclock(name)
 
 
 def advanced_boot(name):
     """Handler for region 66."""
-    indices = {
-        'bits_0-6':   (25, 32),  # GPIO for ETH_CLK output pin
-        'bit_7':      (24, 25),  # Enable ETH_CLK output pin
-        'bits_8-14':  (17, 24),  # GPIO for LAN_RUN output pin
-        'bit_15':     (16, 17),  # Enable LAN_RUN output pin
-        'bits_16-23': (8, 16),   # Unknown/Unused
-        'bit_24':     (7, 8),    # Extend USB HUB timeout parameter
-        'bit_25':     (6, 7),    # ETH_CLK Frequency (0 = 25MHz, 1 = 24MHz)
-        'bits_26-31': (0, 6)     # Unknown/Unused
-    }[name]
-    __advanced_boot = get('advanced_boot', 'binary')
-    return __advanced_boot[indices[0]: indices[1]]
+    return DUMP.advanced_boot(name)
+
+
+def check_bootmode():
+    """Check bootmode against the backup, Return a warning or None."""
+    return DUMP.check_bootmode()
+
+
+def check_serial():
+    """Check Serial against Inverse Serial, Return a warning or None."""
+    return DUMP.check_serial()
 
 
 def process_bootmode():
     """Process bootmode, Check against the backup."""
-    bootmode_primary = get('bootmode', 'binary')
-    bootmode_copy = get('bootmode_copy', 'binary')
-    if bootmode_primary != bootmode_copy:
-        print('Bootmode fields are not the same, this is a bad thing!')
+    warning = check_bootmode()
+    if warning:
+        print(warning)
 
 
 def process_serial():
     """Process Serial, Check against Inverse Serial."""
-    serial = get('serial_number', 'hex')
-    inverse_serial = get('serial_number_inverted', 'hex')
-    try:
-        if (int(serial, 16) ^ int(inverse_serial, 16)) != int('0xffffffff', 16):
-            print('Serial failed checksum!')
-    except TypeError:
-        sys.exit('Serial number format invalid!')
+    warning = check_serial()
+    if warning:
+        print(warning)
 
 
 def process_revision():
     """Process Revision, Handle depending on wether it's old or new style."""
-    flag = revision('new_flag')
-    if flag == '0':
-        generate_info_legacy(revision('legacy_board_revision'))
-    elif flag == '1':
-        generate_info(revision('memory_size'),
-                      revision('manufacturer'),
-                      revision('processor'),
-                      revision('board_type'),
-                      revision('board_revision'))
+    generate_info(*DUMP.board_bits())
 
 
 def format_mac():
     """Format MAC Address in a human readable fashion."""
-    mac_part_1 = get('mac_address_one', 'raw')
-    mac_part_2 = get('mac_address_two', 'raw')
-    if not mac_part_1 == '00000000':
-        mac = mac_part_1 + mac_part_2
-        return ':'.join(mac[i:i+2] for i in range(0, 12, 2))
-    return 'None'
-
-
-def process_hub_timeout(bit):
-    """Return the HUB timeout."""
-    if bit == '1':
-        return '5 Seconds'
-    return '2 Seconds'
-
-
-def process_eth_clk_frequency(bit):
-    """Return the ETH_CLK frequency."""
-    if bit == '1':
-        return '24MHz'
-    return '25MHz'
+    return DUMP.format_mac()
 
 
 def generate_info_legacy(bits):
     """Generate information for legacy board revision."""
-    if bits in list(LEGACY_REVISIONS.keys()):
-        input_dict = LEGACY_REVISIONS[bits]
-    else:
-        input_dict = LEGACY_REVISIONS['default']
-    generate_info(MEMORY_SIZES[input_dict['memory_size']],
-                  MANUFACTURERS[input_dict['manufacturer']],
-                  PROCESSORS[input_dict['processor']],
-                  BOARD_TYPES[input_dict['board_type']],
-                  BOARD_REVISIONS[input_dict['board_revision']])
+    generate_info(*legacy_board_bits(bits))
 
 
 def generate_info(memory_size_in, manufacturer_in, processor_in, board_type_in, board_revision_in):
@@ -472,18 +1119,7 @@ def get(loc, specifier='raw'):
     """Get data from specified OTP region.
     Specifier determines whether it is returned 'raw', in 'binary', in 'octal', or in 'hex'idecimal.
     """
-    region = REGIONS[loc]
-    if specifier == 'raw':
-        return DATA[region]
-    elif specifier == 'binary':
-        return format(int(DATA[region], 16), '032b')
-    elif specifier == 'hex':
-        return format(int(DATA[region], 16), '#010x')
-    elif specifier == 'octal':
-        # TODO: Ask jas for more details on what she wants the octal output to look like.
-        return format(int(DATA[region], 16), '#018o')
-    else:
-        raise ValueError('Invalid Flag.')
+    return DUMP.get(loc, specifier)
 
 
 def pretty_string(value, do_binary=True):
@@ -496,105 +1132,395 @@ def pretty_string(value, do_binary=True):
         sys.exit('Failed to make the string pretty!')
 
 
-def read_otp_file():
-    """Read OTP from specified file."""
-    if len(sys.argv) > 1:  # We're given an argument on the command line
-        if path.isfile(sys.argv[1]):
-            with open(sys.argv[1], 'r') as otp_file:
-                __read_otp_file_inner(otp_file)
+# The report printed by the script, as (label, key, kind, template).
+# Keys are REGIONS names, FIELDS keys or RevisionInfo names and double as the keys of the structured output.
+# The kind says how the value is obtained and printed, the template wraps the printed text.
+REPORT = (
+    ('Control Register',                'control',                           'register', '{}'),
+    ('JTAG_DEBUG_KEY_PARITY_START_BIT', 'control.bits_24-31',                'number',   '{}'),
+    ('VPU_CACHE_KEY_PARITY_START_BIT',  'control.bits_16-23',                'number',   '{}'),
+    ('JTAG_DISABLE_BIT',                'control.bit_15',                    'bit',      '{}'),
+    ('JTAG_DISABLE_REDUNDANT_BIT',      'control.bit_14',                    'bit',      '{}'),
+    ('MACROVISION_START_BIT',           'control.bit_13',                    'bit',      '{}'),
+    ('MACROVISION_REDUNDANT_START_BIT', 'control.bit_11',                    'bit',      '{}'),
+    ('DECRYPTION_ENABLE_FOR_DEBUG',     'control.bit_9',                     'bit',      '{}'),
+    ('ARM_DISABLE_BIT',                 'control.bit_7',                     'bit',      '{}'),
+    ('ARM_DISABLE_REDUNDANT_BIT',       'control.bit_6',                     'bit',      '{}'),
+    ('Bootmode',                        'bootmode',                          'register', '{}'),
+    ('Bootmode - Copy',                 'bootmode_copy',                     'register', '{}'),
+    ('OSC Frequency 19.2MHz',           'bootmode.bit_1',                    'bit',      '{}'),
+    ('SDIO Pullup Enabled',             'bootmode.bit_3',                    'bit',      '{}'),
+    ('Bootmode (Bit 4)',                'bootmode.bit_4',                    'bit',      '{}'),
+    ('Bootmode (Bit 5)',                'bootmode.bit_5',                    'bit',      '{}'),
+    ('Bootmode (Bit 7)',                'bootmode.bit_7',                    'bit',      '{}'),
+    ('GPIO Bootmode',                   'bootmode.bit_19',                   'bit',      '{}'),
+    ('GPIO Bootmode Bank',              'bootmode.bit_20',                   'bit',      '{}'),
+    ('SD Boot Enabled',                 'bootmode.bit_21',                   'bit',      '{}'),
+    ('Boot Bank',                       'bootmode.bit_22',                   'bit',      '{}'),
+    ('Bootmode (eMMC Enable)',          'bootmode.bit_25',                   'bit',      '{} (This is not confirmed but is set on the CM3)'),
+    ('USB Device Boot Enabled',         'bootmode.bit_28',                   'bit',      '{}'),
+    ('USB Host Boot Enabled',           'bootmode.bit_29',                   'bit',      '{}'),
+    ('Boot Signing Parity (15-0) ',     'boot_signing_parity.bits_0-15',     'number',   '{}'),
+    ('Boot Signing Parity (31-16)',     'boot_signing_parity.bits_16-31',    'number',   '{}'),
+    ('Serial Number',                   'serial_number',                     'hex',      '{}'),
+    ('Inverse Serial Number',           'serial_number_inverted',            'hex',      '{}'),
+    ('Revision Number',                 'revision_number',                   'hex',      '{}'),
+    ('New Revision Flag',               'revision_number.new_flag',          'bit',      '{}'),
+    ('RAM',                             'memory_size',                       'board',    '{} MB'),
+    ('Manufacturer',                    'manufacturer',                      'board',    '{}'),
+    ('CPU',                             'processor',                         'board',    '{}'),
+    ('Board Type',                      'board_type',                        'board',    'Raspberry Pi Model {}'),
+    ('Board Revision',                  'board_revision',                    'board',    '{}'),
+    ('Batch Number',                    'batch_number',                      'hex',      '{}'),
+    ('Overvolt Protection Bit',         'overclock.overvolt_protection',     'bit',      '{}'),
+    ('Customer Region One',             'customer_one',                      'hex',      '{}'),
+    ('Customer Region Two',             'customer_two',                      'hex',      '{}'),
+    ('Customer Region Three',           'customer_three',                    'hex',      '{}'),
+    ('Customer Region Four',            'customer_four',                     'hex',      '{}'),
+    ('Customer Region Five',            'customer_five',                     'hex',      '{}'),
+    ('Customer Region Six',             'customer_six',                      'hex',      '{}'),
+    ('Customer Region Seven',           'customer_seven',                    'hex',      '{}'),
+    ('Customer Region Eight',           'customer_eight',                    'hex',      '{}'),
+    ('MPEG2 License Key',               'codec_key_one',                     'hex',      '{}'),
+    ('VC-1 License Key',                'codec_key_two',                     'hex',      '{}'),
+    ('MAC Address',                     'mac_address',                       'mac',      '{}'),
+    ('Advanced Boot',                   'advanced_boot',                     'register', '{}'),
+    ('ETH_CLK Output Pin',              'advanced_boot.bits_0-6',            'pin',      '{}'),
+    ('ETH_CLK Output Enabled',          'advanced_boot.bit_7',               'bit',      '{}'),
+    ('LAN_RUN Output Pin',              'advanced_boot.bits_8-14',           'pin',      '{}'),
+    ('LAN_RUN Output Enabled',          'advanced_boot.bit_15',              'bit',      '{}'),
+    ('USB Hub Timeout',                 'advanced_boot.bit_24',              'decoded',  '{}'),
+    ('ETH_CLK Frequency',               'advanced_boot.bit_25',              'decoded',  '{}'),
+)
+
+# Keys of a structured record, in order.
+RECORD_KEYS = ('source',) + tuple(key for _, key, _, _ in REPORT) + ('warnings', 'error')
+
+LABEL_WIDTH = 31
+
+# Regions read by the report kinds that are not a single region or field.
+KIND_REGIONS = {
+    'board': ('revision_number',),
+    'mac': ('mac_address_one', 'mac_address_two'),
+}
+
+
+def report_rows(fields=None):
+    """Return the REPORT rows of a list of keys, or every row if fields is None.
+    Keys the report does not print may be any REGIONS name or FIELDS key, Raise KeyError for anything else.
+    """
+    if fields is None:
+        return REPORT
+    rows = dict((row[1], row) for row in REPORT)
+    selected = []
+    for key in fields:
+        if key in rows:
+            selected.append(rows[key])
+        elif key in REGIONS:
+            selected.append((key, key, 'hex', '{}'))
+        elif key in COMPILED_FIELDS:
+            selected.append((key, key, 'bit', '{}'))
+        else:
+            raise KeyError(key)
+    return tuple(selected)
+
+
+def report_regions(rows):
+    """Return the set of region numbers that rows read."""
+    regions = set()
+    for _, key, kind, _ in rows:
+        if kind in ('register', 'hex'):
+            regions.add(REGIONS[key])
+        elif kind in KIND_REGIONS:
+            regions.update(REGIONS[loc] for loc in KIND_REGIONS[kind])
+        else:
+            regions.add(COMPILED_FIELDS[key].region)
+    return regions
+
+
+def report_value(dump, key, kind):
+    """Return the value of a report row for structured output."""
+    if kind in ('register', 'hex'):
+        return dump.get(key, 'hex')
+    if kind == 'board':
+        return getattr(dump.revision_info(), key)
+    if kind == 'mac':
+        return dump.format_mac()
+    field = COMPILED_FIELDS[key]
+    if kind == 'decoded':
+        return field.decoder(dump.field_value(field))
+    return dump.field_value(field)
+
+
+def report_text(dump, key, kind):
+    """Return the text of a report row, as printed by the script."""
+    if kind == 'register':
+        return dump.get(key, 'hex') + ' ' + dump.get(key, 'binary')
+    if kind in ('number', 'pin'):
+        field = COMPILED_FIELDS[key]
+        return pretty_string(format(dump.field_value(field), field.binary_format), kind == 'number')
+    return str(report_value(dump, key, kind))
+
+
+def dump_record(dump, rows=REPORT):
+    """Return the structured record of a dump, keyed by RECORD_KEYS (or the keys of rows)."""
+    record = OrderedDict()
+    if dump.source is not None:
+        record['source'] = dump.source
+    for _, key, kind, _ in rows:
+        record[key] = report_value(dump, key, kind)
+    record['warnings'] = dump.warnings()
+    return record
+
+
+def error_message(exception):
+    """Return the message reported for a dump that could not be parsed or decoded.
+    A KeyError from decoding is the number of a region the dump is missing.
+    """
+    if isinstance(exception, KeyError):
+        return 'Invalid OTP Dump (region ' + str(exception) + ' missing)'
+    return str(exception) or exception.__class__.__name__
+
+
+def error_record(exception, source=None):
+    """Return the structured record of a dump that could not be parsed or decoded."""
+    record = OrderedDict() if source is None else OrderedDict([('source', source)])
+    record['error'] = error_message(exception)
+    return record
+
+
+def print_report(dump, stream=None, rows=REPORT):
+    """Print the report of a dump, or only the given rows of it."""
+    for label, key, kind, template in rows:
+        print(label.rjust(LABEL_WIDTH) + ' :', template.format(report_text(dump, key, kind)), file=stream)
+
+
+class TextWriter(object):
+    """Write records as the text report, for dumps handed over with write_dump()."""
+
+    def __init__(self, stream, rows=REPORT):
+        self.stream = stream
+        self.rows = rows
+        self.count = 0
+
+    def write_dump(self, dump):
+        """Write the report of a dump."""
+        if self.count:
+            print(file=self.stream)
+        if dump.source is not None:
+            print('==> ' + dump.source + ' <==', file=self.stream)
+        for warning in dump.warnings():
+            print(warning, file=self.stream)
+        print_report(dump, self.stream, self.rows)
+        self.count += 1
+
+    def write(self, record):
+        """Write a record that has no dump, which is an error record."""
+        print(record.get('source', '-') + ': ' + record.get('error', ''), file=self.stream)
+
+    def close(self):
+        """Flush the stream."""
+        self.stream.flush()
+
+
+class RecordWriter(object):
+    """Base of the structured writers, They turn dumps into records."""
+
+    def __init__(self, stream, rows=REPORT):
+        self.stream = stream
+        self.rows = rows
+
+    def write_dump(self, dump):
+        """Write the record of a dump."""
+        self.write(dump_record(dump, self.rows))
+
+    def close(self):
+        """Flush the stream."""
+        self.stream.flush()
+
+
+class JSONLinesWriter(RecordWriter):
+    """Write one JSON object per line."""
+
+    def __init__(self, stream, rows=REPORT):
+        import json
+        RecordWriter.__init__(self, stream, rows)
+        self.encode = json.dumps
+
+    def write(self, record):
+        """Write a single record."""
+        self.stream.write(self.encode(record) + '\n')
+
+
+class JSONWriter(JSONLinesWriter):
+    """Write a JSON array, one record at a time."""
+
+    def __init__(self, stream, rows=REPORT):
+        JSONLinesWriter.__init__(self, stream, rows)
+        self.count = 0
+
+    def write(self, record):
+        """Write a single record."""
+        self.stream.write(('[\n' if not self.count else ',\n') + self.encode(record))
+        self.count += 1
+
+    def close(self):
+        """Close the array."""
+        self.stream.write('[]\n' if not self.count else '\n]\n')
+        RecordWriter.close(self)
+
+
+class CSVWriter(RecordWriter):
+    """Write CSV with a header of RECORD_KEYS (or the keys of rows), warnings are joined with '; '."""
+
+    def __init__(self, stream, rows=REPORT):
+        import csv
+        RecordWriter.__init__(self, stream, rows)
+        keys = ('source',) + tuple(key for _, key, _, _ in rows) + ('warnings', 'error')
+        self.writer = csv.DictWriter(stream, keys, extrasaction='ignore', lineterminator='\n')
+        self.writer.writeheader()
+
+    def write(self, record):
+        """Write a single record."""
+        if 'warnings' in record:
+            record = dict(record, warnings='; '.join(record['warnings']))
+        self.writer.writerow(record)
+
+
+class MsgPackWriter(RecordWriter):
+    """Write a stream of MessagePack maps."""
+
+    def __init__(self, stream, rows=REPORT):
+        try:
+            import msgpack
+        except ImportError:
+            sys.exit('OTPParser requires msgpack for MessagePack output!')
+        RecordWriter.__init__(self, getattr(stream, 'buffer', stream), rows)
+        self.packer = msgpack.Packer()
+
+    def write(self, record):
+        """Write a single record."""
+        self.stream.write(self.packer.pack(record))
+
+
+WRITERS = {
+    'text': TextWriter,
+    'json': JSONWriter,
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'msgpack': MsgPackWriter,
+}
+
+
+def read_otp_file(filename=None, quiet=False, regions=None):
+    """Read OTP from specified file.
+    Without a filename the first command line argument is used, '-' or no argument means stdin.
+    If regions is a set of region numbers, only those regions are read.
+    """
+    if filename is None:
+        filename = sys.argv[1] if len(sys.argv) > 1 else '-'
+    try:
+        if filename != '-':  # We're given a file
+            if path.isfile(filename):
+                with open(filename, 'rb') as otp_file:
+                    __read_otp_file_inner(otp_file, regions)
+            else:
+                sys.exit('Unable to open file.')
+        else:  # Use stdin instead.
+            if not quiet:
+                print("Reading OTP values from stdin")
+            __read_otp_file_inner(getattr(sys.stdin, 'buffer', sys.stdin), regions)
+    except InvalidDumpError as exception:
+        sys.exit(str(exception))
+
+
+def load_otp_file(filename):
+    """Load a single OTP dump from filename, replacing any previously loaded one.
+    Raises InvalidDumpError instead of exiting.
+    """
+    return __use_dump(OTPDump.from_file(filename))
+
+
+def __read_otp_file_inner(myfile, regions=None):
+    """Inner part of OTP file reader, Reads the whole binary file at once."""
+    return __use_dump(OTPDump.from_bytes(myfile.read(), regions=regions))
+
+
+def __use_dump(dump):
+    """Make dump the one used by the module level functions."""
+    global DUMP
+    DUMP = dump
+    DATA.clear()
+    DATA.update(dump.regions())
+    return dump
+
+
+def argument_parser():
+    """Return the argparse parser of the command line."""
+    import argparse
+    parser = argparse.ArgumentParser(description='Parse the output of vcgencmd otp_dump.')
+    parser.add_argument('file', nargs='?', default='-', help="file holding the dump (default: stdin)")
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS), default='text', help='output format')
+    parser.add_argument('--fields', help='comma separated keys to decode and print, for example '
+                        'serial_number,revision_number,mac_address (default: everything)')
+    return parser
+
+
+def parse_arguments(argv):
+    """Parse the command line, Return (file, format, fields).
+    Plain command lines are handled here so a run does not pay for importing argparse,
+    anything else (help, mistakes) is left to argument_parser().
+    """
+    values = {'format': 'text', 'fields': None}
+    names = {'-f': 'format', '--format': 'format', '--fields': 'fields'}
+    filename = None
+    arguments = iter(argv)
+    for argument in arguments:
+        name, equals, value = argument.partition('=') if argument.startswith('--') else (argument, '', '')
+        if name in names:
+            values[names[name]] = value if equals else next(arguments, '')
+        elif filename is None and (argument == '-' or not argument.startswith('-')):
+            filename = argument
         else:
-            sys.exit('Unable to open file.')
-    else:  # Use stdin instead.
-        print("Reading OTP values from stdin")
-        __read_otp_file_inner(sys.stdin)
+            break
+    else:
+        if values['format'] in WRITERS and values['fields'] != '':
+            fields = values['fields']
+            return filename or '-', values['format'], None if fields is None else fields.split(',')
+    args = argument_parser().parse_args(argv)
+    return args.file, args.format, args.fields.split(',') if args.fields else None
 
 
-def __read_otp_file_inner(myfile):
-    """Inner part of OTP file reader."""
-    for line in myfile:
+def main(argv=None):
+    """Command line entry point."""
+    filename, output_format, fields = parse_arguments(sys.argv[1:] if argv is None else argv)
+    try:
+        rows = report_rows(fields)
+    except KeyError as exception:
+        sys.exit('Unknown field ' + str(exception) + '.')
+
+    read_otp_file(filename, output_format != 'text', None if fields is None else report_regions(rows))
+    if output_format == 'text':
+        for warning in DUMP.warnings():
+            print(warning)
+        if DUMP.has('revision_number'):
+            process_revision()
         try:
-            if "Command not registered" in line:
-                raise TypoError
-            try:
-                region = int(line.split(':', 1)[0])
-            except ValueError:
-                sys.exit("Invalid OTP Dump (invalid region number '" + line.split(':', 1)[0] + "')")
-            data = line.split(':', 1)[1][:8].rstrip('\r\n')
+            print_report(DUMP, rows=rows)
+        except KeyError as exception:
+            sys.exit(error_message(exception))
+    else:
+        writer = WRITERS[output_format](sys.stdout, rows)
+        try:
+            writer.write_dump(DUMP)
+        except KeyError as exception:  # Write an error record, so the output stays well formed
+            writer.write(error_record(exception, DUMP.source))
+            writer.close()
+            sys.exit(1)
+        writer.close()
 
-            try:
-                if is_hex(data):
-                    DATA[region] = data
-                else:
-                    raise ValueError("Reading region " + str(region) + ", string '" + data + "' is not hexadecimal.")
-            except ValueError as exception:
-                sys.exit('Invalid OTP Dump (' + str(exception) + ')')
-        except IndexError:
-            sys.exit('Invalid OTP Dump')
-        except TypoError:
-            sys.exit("Invalid OTP Dump. Please run 'vcgencmd otp_dump' to create file.")
-    if not DATA:
-        sys.exit("Invalid OTP Dump (empty file). Please run 'vcgencmd otp_dump' to create file.")
 
 # only doing prints and just-in-time parsing if running as main script (as opposed to being imported as a library)
 
 if __name__ == "__main__":
-    read_otp_file()
-    process_bootmode()
-    process_serial()
-    process_revision()
-
-    print('               Control Register :', get('control', 'hex'), get('control', 'binary'))
-    print('JTAG_DEBUG_KEY_PARITY_START_BIT :', pretty_string(control('bits_24-31')))
-    print(' VPU_CACHE_KEY_PARITY_START_BIT :', pretty_string(control('bits_16-23')))
-    print('               JTAG_DISABLE_BIT :', control('bit_15'))
-    print('     JTAG_DISABLE_REDUNDANT_BIT :', control('bit_14'))
-    print('          MACROVISION_START_BIT :', control('bit_13'))
-    print('MACROVISION_REDUNDANT_START_BIT :', control('bit_11'))
-    print('    DECRYPTION_ENABLE_FOR_DEBUG :', control('bit_9'))
-    print('                ARM_DISABLE_BIT :', control('bit_7'))
-    print('      ARM_DISABLE_REDUNDANT_BIT :', control('bit_6'))
-    print('                       Bootmode :', get('bootmode', 'hex'), get('bootmode', 'binary'))
-    print('                Bootmode - Copy :', get('bootmode_copy', 'hex'), get('bootmode_copy', 'binary'))
-    print('          OSC Frequency 19.2MHz :', bootmode('bit_1'))
-    print('            SDIO Pullup Enabled :', bootmode('bit_3'))
-    print('               Bootmode (Bit 4) :', bootmode('bit_4'))
-    print('               Bootmode (Bit 5) :', bootmode('bit_5'))
-    print('               Bootmode (Bit 7) :', bootmode('bit_7'))
-    print('                  GPIO Bootmode :', bootmode('bit_19'))
-    print('             GPIO Bootmode Bank :', bootmode('bit_20'))
-    print('                SD Boot Enabled :', bootmode('bit_21'))
-    print('                      Boot Bank :', bootmode('bit_22'))
-    print('         Bootmode (eMMC Enable) :', bootmode('bit_25'), '(This is not confirmed but is set on the CM3)')
-    print('        USB Device Boot Enabled :', bootmode('bit_28'))
-    print('          USB Host Boot Enabled :', bootmode('bit_29'))
-    print('    Boot Signing Parity (15-0)  :', pretty_string(boot_signing_parity('bits_0-15')))
-    print('    Boot Signing Parity (31-16) :', pretty_string(boot_signing_parity('bits_16-31')))
-    print('                  Serial Number :', get('serial_number', 'hex'))
-    print('          Inverse Serial Number :', get('serial_number_inverted', 'hex'))
-    print('                Revision Number :', get('revision_number', 'hex'))
-    print('              New Revision Flag :', revision('new_flag'))
-    print('                            RAM :', MEMORY_SIZES_AS_STRING[BOARD['memory']], "MB")
-    print('                   Manufacturer :', MANUFACTURERS_AS_STRING[BOARD['manufacturer']])
-    print('                            CPU :', PROCESSORS_AS_STRING[BOARD['processor']])
-    print('                     Board Type :', 'Raspberry Pi Model ' + BOARD_TYPES_AS_STRING.get(BOARD['type'], "{} (unknown)".format(bin(int(BOARD["type"], 2))) ) )
-    print('                 Board Revision :', BOARD_REVISIONS_AS_STRING[BOARD['revision']])
-    print('                   Batch Number :', get('batch_number', 'hex'))
-    print('        Overvolt Protection Bit :', overclock('overvolt_protection'))
-    print('            Customer Region One :', get('customer_one', 'hex'))
-    print('            Customer Region Two :', get('customer_two', 'hex'))
-    print('          Customer Region Three :', get('customer_three', 'hex'))
-    print('           Customer Region Four :', get('customer_four', 'hex'))
-    print('           Customer Region Five :', get('customer_five', 'hex'))
-    print('            Customer Region Six :', get('customer_six', 'hex'))
-    print('          Customer Region Seven :', get('customer_seven', 'hex'))
-    print('          Customer Region Eight :', get('customer_eight', 'hex'))
-    print('              MPEG2 License Key :', get('codec_key_one', 'hex'))
-    print('               VC-1 License Key :', get('codec_key_two', 'hex'))
-    print('                    MAC Address :', format_mac())
-    print('                  Advanced Boot :', get('advanced_boot', 'hex'), get('advanced_boot', 'binary'))
-    print('             ETH_CLK Output Pin :', pretty_string(advanced_boot('bits_0-6'), False))
-    print('         ETH_CLK Output Enabled :', advanced_boot('bit_7'))
-    print('             LAN_RUN Output Pin :', pretty_string(advanced_boot('bits_8-14'), False))
-    print('         LAN_RUN Output Enabled :', advanced_boot('bit_15'))
-    print('                USB Hub Timeout :', process_hub_timeout(advanced_boot('bit_24')))
-    print('              ETH_CLK Frequency :', process_eth_clk_frequency(advanced_boot('bit_25')))
+    main()
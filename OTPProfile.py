@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Pipeline Profiler
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPFleet.py <paths>... --profile profile.json [--profile-format json|prometheus]
+      ./OTPProfile.py profile.json... [-f json|prometheus]
+ Profiling is off unless asked for. When on, every dump is timed through the STAGES of the
+ pipeline: unpack (decompressing and extracting bundle members, in the batch runner's feeder
+ thread), read (file bytes, or handing over the unpacked bytes of a bundle member), tokenize
+ (splitting the lines), validate (the bulk region number and hex checks), decode (field,
+ revision and rule decoding into a record), format (the writer encoding the record) and write
+ (the output stream). Dumps, dumps per second and errors by exception type are counted too.
+ Stage times are summed over the worker processes, so they can add up to more than the run.
+ unpack runs in a thread of the batch runner's process, its time includes waiting for that
+ process's main thread, which formats and writes the records.
+ Profiles of several runs can be merged and printed as JSON or in the Prometheus text format.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+STAGES = ('unpack', 'read', 'tokenize', 'validate', 'decode', 'format', 'write')
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class Profiler(object):
+    """Calls and seconds per stage, dump and error counters of a run.
+    Worker processes fill their own Profiler and the batch runner merges them.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.errors = Counter()
+        self.dumps = 0
+        self.elapsed = 0.0
+        self.started = timer()
+
+    def add(self, stage, seconds, calls=1):
+        """Count calls to a stage taking seconds in all."""
+        self.calls[stage] += calls
+        self.seconds[stage] += seconds
+
+    def lap(self, stage, started):
+        """Count one call to a stage that began at started, Return the time now."""
+        now = timer()
+        self.calls[stage] += 1
+        self.seconds[stage] += now - started
+        return now
+
+    def iterate(self, items, stage):
+        """Yield the items of an iterable, timing the work of getting each one as a call to stage."""
+        items = iter(items)
+        while True:
+            started = timer()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            self.add(stage, timer() - started)
+            yield item
+
+    def write_record(self, writer, record):
+        """Write a record with an OTPParser writer, timing the format stage.
+        The writer's stream should come from stream(), its writes are the write stage and not counted as format.
+        """
+        written = self.seconds['write']
+        started = timer()
+        writer.write(record)
+        self.add('format', timer() - started - (self.seconds['write'] - written))
+
+    def error(self, exception):
+        """Count an error by the class name of its exception."""
+        self.errors[exception.__class__.__name__] += 1
+
+    def merge(self, other):
+        """Add the counters of another Profiler, the elapsed time is not added."""
+        self.calls.update(other.calls)
+        self.seconds.update(other.seconds)
+        self.errors.update(other.errors)
+        self.dumps += other.dumps
+
+    def stop(self):
+        """Set the elapsed time of the run."""
+        self.elapsed = timer() - self.started
+
+    def stream(self, stream):
+        """Return a wrapper of a file object that times its writes as the write stage."""
+        return TimedStream(stream, self)
+
+    def to_dict(self):
+        """Return the profile as a JSON-able dict."""
+        stages = {}
+        for stage in STAGES + tuple(sorted(set(self.calls) - set(STAGES))):
+            calls = self.calls[stage]
+            stages[stage] = {
+                'calls': calls,
+                'seconds': round(self.seconds[stage], 6),
+                'mean_us': round(self.seconds[stage] / calls * 1e6, 3) if calls else 0.0,
+            }
+        return {
+            'dumps': self.dumps,
+            'errors': dict(self.errors),
+            'elapsed': round(self.elapsed, 6),
+            'dumps_per_second': round(self.dumps / self.elapsed, 3) if self.elapsed else 0.0,
+            'stages': stages,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a Profiler from to_dict() output."""
+        profiler = cls()
+        profiler.dumps = data['dumps']
+        profiler.errors.update(data['errors'])
+        profiler.elapsed = data['elapsed']
+        for stage, values in data['stages'].items():
+            profiler.add(stage, values['seconds'], values['calls'])
+        return profiler
+
+    def to_prometheus(self, prefix='otp_'):
+        """Return the profile in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, text, samples):
+            lines.append('# HELP ' + prefix + name + ' ' + text)
+            lines.append('# TYPE ' + prefix + name + ' ' + kind)
+            for labels, value in samples:
+                lines.append(prefix + name + labels + ' ' + repr(float(value) if kind == 'gauge' else value))
+
+        stages = STAGES + tuple(sorted(set(self.calls) - set(STAGES)))
+        metric('stage_calls_total', 'counter', 'Calls to each stage of the parse pipeline.',
+               [('{stage="' + stage + '"}', self.calls[stage]) for stage in stages])
+        metric('stage_seconds_total', 'counter', 'Seconds spent in each stage, summed over the workers.',
+               [('{stage="' + stage + '"}', round(self.seconds[stage], 6)) for stage in stages])
+        metric('dumps_total', 'counter', 'Dumps parsed.', [('', self.dumps)])
+        metric('errors_total', 'counter', 'Dumps that failed, by exception type.',
+               [('{type="' + name + '"}', count) for name, count in sorted(self.errors.items())])
+        metric('elapsed_seconds', 'gauge', 'Wall clock time of the run.', [('', round(self.elapsed, 6))])
+        metric('dumps_per_second', 'gauge', 'Dumps parsed per second of the run.',
+               [('', round(self.dumps / self.elapsed, 3) if self.elapsed else 0.0)])
+        return '\n'.join(lines) + '\n'
+
+
+class TimedStream(object):
+    """File object wrapper adding the time of every write() to the write stage of a Profiler."""
+
+    def __init__(self, stream, profiler):
+        self.stream = stream
+        self.profiler = profiler
+
+    def write(self, data):
+        """Write data to the wrapped stream."""
+        started = timer()
+        result = self.stream.write(data)
+        self.profiler.add('write', timer() - started)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def save(profiler, stream, output_format='json'):
+    """Write a profile to a stream as JSON or in the Prometheus text format."""
+    if output_format == 'prometheus':
+        stream.write(profiler.to_prometheus())
+    else:
+        json.dump(profiler.to_dict(), stream, indent=1, sort_keys=True)
+        stream.write('\n')
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Merge and convert OTP pipeline profiles.')
+    parser.add_argument('profiles', nargs='+', help='JSON profiles written by OTPFleet.py --profile')
+    parser.add_argument('-f', '--format', choices=('json', 'prometheus'), default='json', help='output format')
+    args = parser.parse_args(argv)
+
+    total = Profiler()
+    for name in args.profiles:
+        with open(name, 'r') as profile_file:
+            profile = Profiler.from_dict(json.load(profile_file))
+        total.merge(profile)
+        total.elapsed += profile.elapsed
+    save(total, sys.stdout, args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
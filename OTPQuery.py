@@ -0,0 +1,414 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Fleet Query
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPQuery.py <query> <directory|glob|file|archive|->... [-f format] [--fields keys] [--count]
+ For example
+   ./OTPQuery.py 'board_type == CM4 and manufacturer == "Sony UK" and bootmode.bit_29 and control.bit_15' dumps/
+ Names are REGIONS names (serial_number == 0x9b2c5d7e), FIELDS keys (bootmode.bit_29, a bare name means != 0)
+ or decoded board attributes (memory_size >= 4096, board_type == 4B), compared with == != < <= > >=
+ and combined with and, or, not and parentheses.
+ Archives are filtered with NumPy when it is installed, only matching boards are decoded and written.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import operator
+import re
+import sys
+
+import OTPParser
+import OTPArchive
+import OTPFleet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TOKEN = re.compile(r'\s*(?:(==|!=|<=|>=|<|>|=|\(|\))|"([^"]*)"|\'([^\']*)\'|([^\s()=!<>"\']+))')
+
+OPERATORS = {
+    '==': operator.eq,
+    '=':  operator.eq,
+    '!=': operator.ne,
+    '<':  operator.lt,
+    '<=': operator.le,
+    '>':  operator.gt,
+    '>=': operator.ge,
+}
+
+# Decoded board attributes, as named by RevisionInfo, that queries can compare against names.
+ATTRIBUTES = ('memory_size', 'manufacturer', 'processor', 'board_type', 'board_revision')
+
+
+class QueryError(Exception):
+    """Raised when a query can not be parsed."""
+    pass
+
+
+def attribute_names(attribute):
+    """Return ({new style field value: name}, {legacy field value: name}) of a board attribute."""
+    new_flag = OTPParser.COMPILED_FIELDS['revision_number.new_flag']
+    field = OTPParser.COMPILED_FIELDS['revision_number.' + attribute]
+    legacy = OTPParser.COMPILED_FIELDS['revision_number.legacy_board_revision']
+    tables = []
+    for word_field, flag in ((field, 1), (legacy, 0)):
+        names = {}
+        for value in range(word_field.mask + 1):
+            try:
+                info = OTPParser.decode_revision(value << word_field.shift | flag << new_flag.shift)
+            except KeyError:
+                continue  # Not a valid code, matches nothing
+            names[value] = getattr(info, attribute)
+        tables.append(names)
+    return tuple(tables)
+
+
+def compare_names(name, symbol, value):
+    """Compare a board attribute name with a query value, numerically if the value is a number."""
+    try:
+        number = float(value)
+    except ValueError:
+        if symbol not in ('==', '=', '!='):
+            raise QueryError("'" + value + "' can only be compared with == or !=")
+        return OPERATORS[symbol](name.lower(), value.lower())
+    try:
+        return OPERATORS[symbol](float(name), number)
+    except ValueError:
+        return symbol == '!='  # Names like 'unknown' or '256/512' are no number
+
+
+def tokenize(text):
+    """Split a query into tokens, Return a list of (kind, text) with kind 'op', 'string' or 'word'."""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match:
+            raise QueryError('Unexpected character at ' + str(position) + ": '" + text[position:] + "'")
+        symbol, double, single, word = match.groups()
+        if symbol is not None:
+            tokens.append(('op', symbol))
+        elif word is not None:
+            tokens.append(('word', word))
+        else:
+            tokens.append(('string', double if double is not None else single))
+        position = match.end()
+    return tokens
+
+
+class Parser(object):
+    """Recursive descent parser of a query, Building a tree of tuples.
+    ('or', [nodes]), ('and', [nodes]), ('not', node), ('field', region, shift, mask, op, value)
+    and ('attribute', name, new style table, legacy table), where the tables are tuples of booleans
+    indexed by the value of the attribute's field and of legacy_board_revision.
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.regions = set()
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self):
+        token = self.peek()
+        if token[0] is None:
+            raise QueryError('Unexpected end of query')
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        token = self.peek()
+        if token[0] == 'word' and token[1].lower() == word:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise QueryError("Unexpected '" + self.peek()[1] + "'")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.keyword('or'):
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.keyword('and'):
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_not(self):
+        if self.keyword('not'):
+            return ('not', self.parse_not())
+        if self.peek() == ('op', '('):
+            self.take()
+            node = self.parse_or()
+            if self.take() != ('op', ')'):
+                raise QueryError("Missing ')'")
+            return node
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        kind, name = self.take()
+        if kind != 'word':
+            raise QueryError("Expected a name, found '" + name + "'")
+        symbol, value = '!=', '0'
+        if self.peek()[0] == 'op' and self.peek()[1] in OPERATORS:
+            symbol = self.take()[1]
+            value = self.take()[1]
+        if name in ATTRIBUTES:
+            return self.attribute(name, symbol, value)
+        if name in OTPParser.COMPILED_FIELDS:
+            field = OTPParser.COMPILED_FIELDS[name]
+            region, shift, mask = field.region, field.shift, field.mask
+        elif name in OTPParser.REGIONS:
+            region, shift, mask = OTPParser.REGIONS[name], 0, 0xffffffff
+        else:
+            raise QueryError("Unknown name '" + name + "'")
+        try:
+            number = int(value, 0) if not value.isdigit() else int(value)
+        except ValueError:
+            raise QueryError("'" + name + "' is compared with a number, not '" + value + "'")
+        self.regions.add(region)
+        return ('field', region, shift, mask, symbol, number)
+
+    def attribute(self, name, symbol, value):
+        self.regions.add(OTPParser.REGIONS['revision_number'])
+        tables = []
+        all_names = attribute_names(name)
+        fields = (OTPParser.COMPILED_FIELDS['revision_number.' + name],
+                  OTPParser.COMPILED_FIELDS['revision_number.legacy_board_revision'])
+        for names, field in zip(all_names, fields):
+            tables.append(tuple(code in names and compare_names(names[code], symbol, value)
+                                for code in range(field.mask + 1)))
+        if not any(tables[0]) and not any(tables[1]):
+            known = sorted(known for known in set(all_names[0].values()) | set(all_names[1].values())
+                           if not known.endswith('(unknown)'))
+            raise QueryError('No board has ' + name + ' ' + symbol + " '" + value + "' (" + ', '.join(known) + ')')
+        return ('attribute', name, tables[0], tables[1])
+
+
+class Query(object):
+    """A query compiled once, into a predicate on the raw words of a dump and a NumPy evaluator.
+    Only the regions the query names are read, nothing else of a dump is decoded.
+    """
+
+    def __init__(self, text):
+        parser = Parser(text)
+        self.text = text
+        self.tree = parser.parse()
+        self.regions = parser.regions
+        self.required = sum(1 << region for region in self.regions)
+        self.constants = []
+        source = self._source(self.tree)
+        if self.required:
+            source = '(p & ' + str(self.required) + ' == ' + str(self.required) + ') and ' + source
+        namespace = {'T': self.constants}
+        self.predicate = eval('lambda w, p: ' + source, namespace)
+
+    def _constant(self, value):
+        self.constants.append(value)
+        return 'T[' + str(len(self.constants) - 1) + ']'
+
+    def _source(self, node):
+        """Turn a tree node into Python source on the words w and present mask p."""
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return '(' + (' ' + kind + ' ').join(self._source(child) for child in node[1]) + ')'
+        if kind == 'not':
+            return '(not ' + self._source(node[1]) + ')'
+        if kind == 'field':
+            _, region, shift, mask, symbol, value = node
+            symbol = '==' if symbol == '=' else symbol
+            if symbol in ('==', '!=') and 0 <= value <= mask:
+                return '(w[%d] & %d %s %d)' % (region, mask << shift, symbol, value << shift)
+            return '(w[%d] >> %d & %d %s %d)' % (region, shift, mask, symbol, value)
+        _, attribute, new_table, legacy_table = node
+        new_flag = OTPParser.COMPILED_FIELDS['revision_number.new_flag']
+        field = OTPParser.COMPILED_FIELDS['revision_number.' + attribute]
+        legacy = OTPParser.COMPILED_FIELDS['revision_number.legacy_board_revision']
+        region = OTPParser.REGIONS['revision_number']
+        return '(%s[w[%d] >> %d & %d] if w[%d] >> %d & 1 else %s[w[%d] >> %d & %d])' % (
+            self._constant(new_table), region, field.shift, field.mask, region, new_flag.shift,
+            self._constant(legacy_table), region, legacy.shift, legacy.mask)
+
+    def matches(self, dump):
+        """Return whether an OTPDump matches."""
+        return bool(self.predicate(dump.words, dump.present))
+
+    def filter(self, dumps):
+        """Yield the dumps that match."""
+        predicate = self.predicate
+        for dump in dumps:
+            if predicate(dump.words, dump.present):
+                yield dump
+
+    def mask(self, words, present=None):
+        """Vectorized predicate over an (N x 67) word matrix, Return a boolean array.
+        present holds a mask per row with bit (region - FIRST_REGION) set for every dumped region.
+        Every 'and' only looks at the rows still matching, every 'or' only at the rows not matched yet.
+        """
+        if numpy is None:
+            sys.exit('OTPQuery requires numpy for vectorized queries!')
+        words = numpy.asarray(words)
+        rows = None
+        if present is not None and self.required:
+            required = numpy.uint64(self.required >> OTPParser.FIRST_REGION)
+            rows = numpy.flatnonzero(numpy.asarray(present, dtype=numpy.uint64) & required == required)
+        result = numpy.zeros(len(words), dtype=bool)
+        if rows is None:
+            result[:] = self._evaluate(self.tree, words, None)
+        elif len(rows):
+            result[rows] = self._evaluate(self.tree, words, rows)
+        return result
+
+    def _evaluate(self, node, words, rows):
+        """Evaluate a tree node with NumPy on the given rows (or every row if None)."""
+        count = len(words) if rows is None else len(rows)
+        kind = node[0]
+        if kind in ('and', 'or'):
+            result = numpy.full(count, kind == 'and', dtype=bool)
+            candidates = numpy.arange(count)
+            for child in node[1]:
+                hit = self._evaluate(child, words, candidates if rows is None else rows[candidates])
+                if kind == 'and':
+                    result[candidates[~hit]] = False
+                    candidates = candidates[hit]
+                else:
+                    result[candidates[hit]] = True
+                    candidates = candidates[~hit]
+                if not len(candidates):
+                    break
+            return result
+        if kind == 'not':
+            return ~self._evaluate(node[1], words, rows)
+        if kind == 'field':
+            _, region, shift, mask, symbol, value = node
+            column = words[:, region] if rows is None else words[rows, region]
+            values = (column >> numpy.uint32(shift)) & numpy.uint32(mask)
+            return OPERATORS[symbol](values.astype(numpy.int64), value)
+        _, attribute, new_table, legacy_table = node
+        column = words[:, OTPParser.REGIONS['revision_number']]
+        if rows is not None:
+            column = column[rows]
+        new_flag = OTPParser.COMPILED_FIELDS['revision_number.new_flag']
+        field = OTPParser.COMPILED_FIELDS['revision_number.' + attribute]
+        legacy = OTPParser.COMPILED_FIELDS['revision_number.legacy_board_revision']
+        new_lookup = numpy.array(new_table, dtype=bool)
+        legacy_lookup = numpy.array(legacy_table, dtype=bool)
+        return numpy.where((column >> numpy.uint32(new_flag.shift)) & numpy.uint32(1) == 1,
+                           new_lookup[(column >> numpy.uint32(field.shift)) & numpy.uint32(field.mask)],
+                           legacy_lookup[(column >> numpy.uint32(legacy.shift)) & numpy.uint32(legacy.mask)])
+
+
+def archive_matches(query, name, chunk_size=65536):
+    """Yield the matching dumps of an archive, Filtering chunks of records with NumPy when it is available."""
+    with OTPArchive.OTPArchive(name) as archive:
+        if numpy is None:
+            for dump in query.filter(archive):
+                yield dump
+            return
+        records = archive.records()
+        chunk = None
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start: start + chunk_size]
+            for index in numpy.flatnonzero(query.mask(chunk['words'], chunk['present'])):
+                yield archive[start + int(index)]
+        del records, chunk
+
+
+def iter_matches(query, names, errors=None):
+    """Yield the dumps matching query from text dumps, archives or '-' for stdin.
+    Bad files are skipped, with (name, message) appended to errors if given.
+    """
+    for name in names:
+        try:
+            if name == '-':
+                dumps = OTPParser.iter_dumps(getattr(sys.stdin, 'buffer', sys.stdin), 'stdin')
+            elif OTPArchive.is_archive(name):
+                dumps = None
+                for dump in archive_matches(query, name):
+                    yield dump
+            else:
+                with open(name, 'rb') as dump_file:
+                    dumps = OTPParser.parse_buffer(dump_file.read(), name)
+            if dumps is not None:
+                for dump in query.filter(dumps):
+                    yield dump
+        except (OTPParser.InvalidDumpError, OTPArchive.InvalidArchiveError, IOError, OSError) as exception:
+            if errors is None:
+                raise
+            errors.append((name, str(exception)))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='List the boards matching a query.')
+    parser.add_argument('query', help="for example 'board_type == CM4 and bootmode.bit_29'")
+    parser.add_argument('paths', nargs='*', default=['-'],
+                        help="dump files, archives, directories, glob patterns or '-' for stdin (default)")
+    parser.add_argument('-f', '--format', choices=sorted(OTPParser.WRITERS), default='jsonl', help='output format')
+    parser.add_argument('--fields', help='comma separated keys to write (default: everything)')
+    parser.add_argument('--count', action='store_true', help='only print the number of matching boards')
+    args = parser.parse_args(argv)
+
+    try:
+        query = Query(args.query)
+        rows = OTPParser.report_rows(args.fields.split(',') if args.fields else None)
+    except QueryError as exception:
+        parser.error(str(exception))
+    except KeyError as exception:
+        parser.error('unknown field ' + str(exception))
+
+    names = []
+    for name in args.paths:
+        names.extend([name] if name == '-' else OTPFleet.expand_paths([name]))
+    errors = []
+    matches = 0
+    writer = None if args.count else OTPParser.WRITERS[args.format](sys.stdout, rows)
+    for dump in iter_matches(query, names, errors):
+        matches += 1
+        if writer is not None:
+            writer.write_dump(dump)
+    if writer is not None:
+        writer.close()
+    else:
+        print(matches)
+    for name, message in errors:
+        sys.stderr.write(name + ': ' + message + '\n')
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
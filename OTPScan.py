@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Integrity Scanner
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPScan.py <directory|glob|file|archive|->... [-o output]
+ Every dump is checked against the redundancy rules of OTPParser.RULES, and serial numbers and
+ MAC addresses seen more than once across the fleet are reported. Findings are written as one
+ JSON object per line, with the rule, source, message and the values involved.
+ Archives are checked with NumPy when it is installed.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import sys
+
+import OTPParser
+import OTPArchive
+import OTPFleet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Serial numbers of boards that were never programmed, which are not duplicates of each other.
+BLANK_SERIALS = (0x00000000, 0xffffffff)
+
+
+def mac_number(words, present):
+    """Return the MAC address of a dump's words as a 48-bit integer, or None if it has none."""
+    mac_one = OTPParser.REGIONS['mac_address_one']
+    mac_two = OTPParser.REGIONS['mac_address_two']
+    if not present >> mac_one & 1 or not present >> mac_two & 1 or not words[mac_one]:
+        return None
+    return words[mac_one] << 16 | words[mac_two] >> 16
+
+
+class FleetScanner(object):
+    """Runs every rule on each dump and remembers serials and MAC addresses to find duplicates.
+    The first source of every serial and MAC address is kept in a dict, so a duplicate is found
+    with a single hash lookup whatever the fleet size.
+    """
+
+    def __init__(self):
+        self.serials = {}
+        self.macs = {}
+        self.dumps = 0
+        self.count = 0  # Findings so far
+
+    def scan(self, dump):
+        """Check one OTPDump, Return its list of findings."""
+        findings = dump.findings()
+        for finding in findings:
+            finding['source'] = dump.source
+        findings.extend(self.duplicates(dump.words, dump.present, dump.source))
+        self.dumps += 1
+        self.count += len(findings)
+        return findings
+
+    def duplicates(self, words, present, source):
+        """Remember the serial and MAC address of a dump, Return findings for the ones seen before."""
+        findings = []
+        serial_region = OTPParser.REGIONS['serial_number']
+        if present >> serial_region & 1 and words[serial_region] not in BLANK_SERIALS:
+            serial = words[serial_region]
+            if serial in self.serials:
+                findings.append(self._duplicate('duplicate_serial', 'Serial number ' + format(serial, '#010x'),
+                                                serial, source, self.serials[serial]))
+            else:
+                self.serials[serial] = source
+        mac = mac_number(words, present)
+        if mac is not None:
+            if mac in self.macs:
+                findings.append(self._duplicate('duplicate_mac', 'MAC address ' + format(mac, '012x'),
+                                                mac, source, self.macs[mac]))
+            else:
+                self.macs[mac] = source
+        return findings
+
+    @staticmethod
+    def _duplicate(rule, what, value, source, first):
+        """Build the finding of a value that was already seen in first."""
+        return {
+            'rule': rule,
+            'message': what + ' was already seen in ' + str(first),
+            'values': [value],
+            'source': source,
+            'first': first,
+        }
+
+    def scan_archive(self, archive, chunk_size=65536):
+        """Check every record of an OTPArchive, Yield the findings in record order.
+        With NumPy the rules are run on whole chunks of records and only the records failing one are decoded.
+        """
+        if numpy is None:
+            for dump in archive:
+                for finding in self.scan(dump):
+                    yield finding
+            return
+        records = archive.records()
+        chunk = words = None
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start: start + chunk_size]
+            words = chunk['words']
+            present = chunk['present'].astype(numpy.uint64)  # Bit (region - FIRST_REGION), 67 bits don't fit
+            failed = numpy.zeros(len(chunk), dtype=bool)
+            for rule in OTPParser.COMPILED_RULES:
+                failed |= self._rule_mask(rule, words, present)
+            for index in range(len(chunk)):
+                if failed[index]:
+                    findings = self.scan(archive[start + index])
+                else:
+                    source = chunk['source'][index].rstrip(b'\0').decode('utf-8', 'ignore') or None
+                    findings = self.duplicates(words[index].tolist(), int(present[index]) << OTPParser.FIRST_REGION,
+                                               source)
+                    self.dumps += 1
+                    self.count += len(findings)
+                for finding in findings:
+                    yield finding
+        del records, chunk, words
+
+    @staticmethod
+    def _rule_mask(rule, words, present):
+        """Vectorized Rule.failed over rows of words, present being the archive masks, Return a boolean array."""
+        (region, shift, mask), (other_region, other_shift, other_mask) = rule.operands
+        value = (words[:, region] >> numpy.uint32(shift)) & numpy.uint32(mask)
+        other = (words[:, other_region] >> numpy.uint32(other_shift)) & numpy.uint32(other_mask)
+        if rule.check == 'inverse':
+            failed = value ^ other != mask
+        else:
+            failed = value != other
+        required = numpy.uint64(rule.required >> OTPParser.FIRST_REGION)
+        return failed & (present & required == required)
+
+
+def iter_dumps(names, errors):
+    """Yield (dump or None, archive or None) for text dumps, archives or '-' for stdin.
+    Bad files are skipped with (name, message) appended to errors.
+    """
+    for name in names:
+        try:
+            if name == '-':
+                for dump in OTPParser.iter_dumps(getattr(sys.stdin, 'buffer', sys.stdin), 'stdin'):
+                    yield dump, None
+            elif OTPArchive.is_archive(name):
+                with OTPArchive.OTPArchive(name) as archive:
+                    yield None, archive
+            else:
+                with open(name, 'rb') as dump_file:
+                    data = dump_file.read()
+                for dump in OTPParser.parse_buffer(data, name):
+                    yield dump, None
+        except (OTPParser.InvalidDumpError, OTPArchive.InvalidArchiveError, IOError, OSError) as exception:
+            errors.append((name, str(exception)))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Check OTP dumps for integrity problems and duplicates.')
+    parser.add_argument('paths', nargs='*', default=['-'],
+                        help="dump files, archives, directories, glob patterns or '-' for stdin (default)")
+    parser.add_argument('-o', '--output', help='write findings here instead of stdout')
+    args = parser.parse_args(argv)
+
+    names = []
+    for name in args.paths:
+        names.extend([name] if name == '-' else OTPFleet.expand_paths([name]))
+    stream = open(args.output, 'w') if args.output else sys.stdout
+    scanner = FleetScanner()
+    errors = []
+    try:
+        for dump, archive in iter_dumps(names, errors):
+            findings = scanner.scan(dump) if archive is None else scanner.scan_archive(archive)
+            for finding in findings:
+                stream.write(json.dumps(finding, sort_keys=True) + '\n')
+        for name, message in errors:
+            stream.write(json.dumps({'rule': 'unreadable', 'source': name, 'message': message}, sort_keys=True) + '\n')
+    finally:
+        if args.output:
+            stream.close()
+    sys.stderr.write('Scanned ' + str(scanner.dumps) + ' dumps, ' + str(scanner.count) + ' findings, ' +
+                     str(len(errors)) + ' unreadable.\n')
+    return 1 if scanner.count or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP Decode Service
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPService.py [--host 127.0.0.1] [--port 8765] [--unix path] [--batch-size N] [--batch-delay seconds]
+                      [--cache [FILE]] [--cache-size N]
+ Keeps the decode tables and the revision cache warm and decodes dumps sent over HTTP, on
+ localhost or on a Unix socket:
+   curl --data-binary @dump.txt http://127.0.0.1:8765/decode
+   curl --data-binary @dump.txt --unix-socket /run/otp.sock 'http://localhost/decode?fields=serial_number,mac_address'
+   curl http://127.0.0.1:8765/stats
+ POST /decode takes one or more concatenated dumps and returns a JSON list of records, as
+ OTPParser.py -f json prints them. Requests arriving together are queued and decoded by one task in turn, and
+ GET /stats returns the request latency percentiles, throughput and batch sizes.
+ With --cache, dumps decoded before are answered from an OTPCache file, /stats adds its hit rate.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import signal
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import OTPCache
+import OTPParser
+
+if sys.version_info < (3, 7):
+    sys.exit('OTPService requires Python 3.7 and newer.')
+
+LATENCY_SAMPLES = 10000  # Latest request latencies kept for the percentiles
+MAX_BODY = 16 * 1024 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+
+
+def decode_body(body, rows, source=None, cache=None):
+    """Decode every dump of a request body, Return (HTTP status, JSON-able result).
+    With an OTPCache.DecodeCache, dumps decoded before are not decoded again.
+    """
+    try:
+        dumps = OTPParser.parse_buffer(body, source)
+    except OTPParser.InvalidDumpError as exception:
+        return 422, {'error': OTPParser.error_message(exception)}
+    if not dumps:
+        return 422, {'error': "Invalid OTP Dump (empty file). Please run 'vcgencmd otp_dump' to create file."}
+    try:
+        if cache is None:
+            return 200, [OTPParser.dump_record(dump, rows) for dump in dumps]
+        return 200, [cache.record(dump, rows) for dump in dumps]
+    except KeyError as exception:
+        return 422, {'error': OTPParser.error_message(exception)}
+
+
+def decode_batch(requests, cache=None):
+    """Decode a batch of (body, rows, source) requests one after the other, Return their (status, result).
+    Batching saves the task switches and queue handoffs of each request, the decoding is not vectorized.
+    A request failing in an unexpected way, a broken cache file for example, is answered with 500
+    so the batch loop keeps serving the others.
+    """
+    results = []
+    for body, rows, source in requests:
+        try:
+            results.append(decode_body(body, rows, source, cache))
+        except Exception as exception:
+            results.append((500, {'error': 'Internal error (' + exception.__class__.__name__ + ': ' +
+                                  str(exception) + ')'}))
+    return results
+
+
+class Stats(object):
+    """Request counters and a window of the latest latencies."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.dumps = 0
+        self.batches = 0
+        self.batched = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def add_batch(self, size):
+        """Count one decoded batch of size requests."""
+        self.batches += 1
+        self.batched += size
+
+    def add_request(self, status, result, seconds):
+        """Count one answered request."""
+        self.requests += 1
+        if status != 200:
+            self.errors += 1
+        elif isinstance(result, list):
+            self.dumps += len(result)
+        self.latencies.append(seconds)
+
+    def to_dict(self):
+        """Return the statistics as a JSON-able dict, latencies in milliseconds."""
+        uptime = time.time() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000, 3)
+
+        hits, misses, maxsize, currsize = OTPParser.revision_cache_info()
+        return {
+            'uptime': round(uptime, 3),
+            'requests': self.requests,
+            'errors': self.errors,
+            'dumps': self.dumps,
+            'requests_per_second': round(self.requests / uptime, 3) if uptime else 0.0,
+            'dumps_per_second': round(self.dumps / uptime, 3) if uptime else 0.0,
+            'batches': self.batches,
+            'mean_batch_size': round(self.batched / self.batches, 3) if self.batches else 0.0,
+            'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                           'max': percentile(1.0), 'samples': len(latencies)},
+            'revision_cache': {'hits': hits, 'misses': misses, 'maxsize': maxsize, 'currsize': currsize},
+        }
+
+
+class DecodeService(object):
+    """Queues decode requests and answers them in batches of up to batch_size.
+    A batch takes every request queued so far, waiting batch_delay seconds for more if it is not full.
+    """
+
+    def __init__(self, batch_size=64, batch_delay=0.0, cache=None):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.cache = cache
+        self.queue = asyncio.Queue()
+        self.stats = Stats()
+
+    async def decode(self, body, rows, source=None):
+        """Decode a request body in the next batch, Return (status, result)."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((body, rows, source, future))
+        return await future
+
+    async def run(self):
+        """Decode batches from the queue, forever."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            results = decode_batch([(body, rows, source) for body, rows, source, _ in batch], self.cache)
+            self.stats.add_batch(len(batch))
+            for (_, _, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def handle(self, reader, writer):
+        """Serve the HTTP/1.1 requests of one connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', '0'))
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'Bad request'}, False)
+                    break
+                if length < 0:
+                    await self.respond(writer, 400, {'error': 'Bad Content-Length'}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {'error': 'Request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = (headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1' else
+                              headers.get('connection', '').lower() == 'keep-alive')
+                started = time.perf_counter()
+                status, result = await self.route(method, target, body)
+                await self.respond(writer, status, result, keep_alive)
+                if urlsplit(target).path == '/decode':
+                    self.stats.add_request(status, result, time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, target, body):
+        """Answer one request, Return (status, result)."""
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == '/decode':
+            if method != 'POST':
+                return 405, {'error': 'POST a dump to /decode'}
+            try:
+                rows = OTPParser.report_rows(query['fields'][0].split(',') if 'fields' in query else None)
+            except KeyError as exception:
+                return 400, {'error': 'Unknown field ' + str(exception)}
+            return await self.decode(body, rows, query['source'][0] if 'source' in query else None)
+        if url.path == '/stats' and method == 'GET':
+            stats = self.stats.to_dict()
+            if self.cache is not None:
+                stats['decode_cache'] = self.cache.stats()
+            return 200, stats
+        if url.path == '/health' and method == 'GET':
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'Not found'}
+
+    @staticmethod
+    async def respond(writer, status, result, keep_alive):
+        """Write a JSON response."""
+        payload = json.dumps(result).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                      'Connection: %s\r\n\r\n' % (status, REASONS[status], len(payload),
+                                                  'keep-alive' if keep_alive else 'close')).encode('latin-1') +
+                     payload)
+        await writer.drain()
+
+
+async def serve(host, port, unix, batch_size, batch_delay, cache=None):
+    """Run the service until cancelled."""
+    service = DecodeService(batch_size, batch_delay, cache)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    servers = []
+    if unix:
+        if os.path.exists(unix):
+            os.remove(unix)
+        servers.append(await asyncio.start_unix_server(service.handle, unix))
+        sys.stderr.write('Listening on ' + unix + '\n')
+    if port:
+        servers.append(await asyncio.start_server(service.handle, host, port))
+        sys.stderr.write('Listening on http://' + host + ':' + str(port) + '\n')
+    try:
+        await service.run()
+    finally:
+        for server in servers:
+            server.close()
+        if unix and os.path.exists(unix):
+            os.remove(unix)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Serve OTP dump decoding over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port, 0 to only listen on --unix (default: 8765)')
+    parser.add_argument('--unix', help='also listen on this Unix socket')
+    parser.add_argument('--batch-size', type=int, default=64, help='most requests decoded in one batch')
+    parser.add_argument('--batch-delay', type=float, default=0.0,
+                        help='seconds to wait for more requests before decoding a batch (default: 0)')
+    parser.add_argument('--cache', nargs='?', const=OTPCache.default_path(), metavar='FILE',
+                        help='reuse the records of dumps decoded before, from this file (default: %(const)s)')
+    parser.add_argument('--cache-size', type=int, default=OTPCache.DEFAULT_SIZE, help='most records kept in the cache')
+    args = parser.parse_args(argv)
+    if not args.port and not args.unix:
+        parser.error('nothing to listen on')
+    cache = OTPCache.DecodeCache(args.cache, args.cache_size) if args.cache else None
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.batch_size, args.batch_delay, cache))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
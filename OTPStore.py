@@ -0,0 +1,493 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi OTP SQLite Store
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./OTPStore.py ingest <database> <directory|glob|file|archive|->... [-j jobs]   Bulk load dumps
+      ./OTPStore.py record <database> <directory|glob|file|archive|->...            Add snapshots to the history
+      ./OTPStore.py changes <database> [--since T] [--serial S]                      List changes, bit by bit
+ Dumps are written to the 'dumps' table of an SQLite database: the raw words as a little-endian
+ blob of 67 x uint32 and the present mask of regions 8 and up (the archive layout), and the serial, revision, batch and
+ MAC address as integers next to the decoded revision names, for dashboards to query directly.
+ Rows are inserted with executemany in large transactions, with the database in WAL mode.
+
+ The history tables keep, per serial number, the first snapshot of a board as its base and its
+ latest words, plus one 'deltas' row (timestamp, region, old value, new value) for every word
+ that changed since the snapshot before. A board dumped on every boot only grows the database
+ when its OTP does. Snapshots of a board must be recorded in timestamp order.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import struct
+import sys
+import time
+
+import OTPParser
+import OTPArchive
+import OTPFleet
+import OTPScan
+
+WORDS = struct.Struct('<' + str(OTPParser.NUM_REGIONS) + 'I')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dumps (
+    id              INTEGER PRIMARY KEY,
+    source          TEXT,
+    timestamp       REAL,
+    present         INTEGER NOT NULL,
+    serial_number   INTEGER,
+    revision_number INTEGER,
+    batch_number    INTEGER,
+    mac_address     INTEGER,
+    memory_size     TEXT,
+    manufacturer    TEXT,
+    processor       TEXT,
+    board_type      TEXT,
+    board_revision  TEXT,
+    words           BLOB NOT NULL
+)
+'''
+
+# Created once a load has finished, building an index in one go is much faster than updating it per row.
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS dumps_serial_number ON dumps (serial_number)',
+    'CREATE INDEX IF NOT EXISTS dumps_mac_address ON dumps (mac_address)',
+    'CREATE INDEX IF NOT EXISTS dumps_revision_number ON dumps (revision_number)',
+)
+
+COLUMNS = ('source', 'timestamp', 'present', 'serial_number', 'revision_number', 'batch_number', 'mac_address',
+           'memory_size', 'manufacturer', 'processor', 'board_type', 'board_revision', 'words')
+INSERT = 'INSERT INTO dumps (' + ', '.join(COLUMNS) + ') VALUES (' + ', '.join('?' * len(COLUMNS)) + ')'
+
+REGION_SERIAL = OTPParser.REGIONS['serial_number']
+REGION_REVISION = OTPParser.REGIONS['revision_number']
+REGION_BATCH = OTPParser.REGIONS['batch_number']
+
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS boards (
+    serial_number INTEGER PRIMARY KEY,
+    first_seen    REAL NOT NULL,
+    last_seen     REAL NOT NULL,
+    snapshots     INTEGER NOT NULL,
+    base_present  INTEGER NOT NULL,
+    base_words    BLOB NOT NULL,
+    present       INTEGER NOT NULL,
+    words         BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deltas (
+    serial_number INTEGER NOT NULL,
+    timestamp     REAL NOT NULL,
+    region        INTEGER NOT NULL,
+    old_value     INTEGER,
+    new_value     INTEGER
+);
+CREATE INDEX IF NOT EXISTS deltas_serial_number ON deltas (serial_number, timestamp);
+CREATE INDEX IF NOT EXISTS deltas_timestamp ON deltas (timestamp);
+'''
+
+REGION_NAMES = dict((region, name) for name, region in OTPParser.REGIONS.items())
+
+
+def connect(filename):
+    """Open a store, creating its table if needed, Return the sqlite3 connection."""
+    connection = sqlite3.connect(filename, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('PRAGMA temp_store=MEMORY')
+    connection.execute('PRAGMA cache_size=-65536')  # 64 MiB
+    connection.execute(SCHEMA)
+    return connection
+
+
+def word_row(source, timestamp, present, words):
+    """Build the dumps row of a dump given as its present mask and a sequence of 67 words."""
+    row = [source, timestamp, present >> OTPParser.FIRST_REGION]
+    for region in (REGION_SERIAL, REGION_REVISION, REGION_BATCH):
+        row.append(words[region] if present >> region & 1 else None)
+    row.append(OTPScan.mac_number(words, present))
+    if present >> REGION_REVISION & 1:
+        info = OTPParser.decode_revision(words[REGION_REVISION])
+        row.extend((info.memory_size, info.manufacturer, info.processor, info.board_type, info.board_revision))
+    else:
+        row.extend((None,) * 5)
+    return row
+
+
+def dump_row(dump, timestamp=None):
+    """Build the dumps row of an OTPDump."""
+    row = word_row(dump.source, timestamp, dump.present, dump.words)
+    row.append(WORDS.pack(*dump.words))
+    return row
+
+
+class StoreWriter(object):
+    """Buffer rows and write them with executemany, committing every transaction_size rows.
+    The single INSERT statement is prepared once by sqlite3 and reused for every batch.
+    """
+
+    def __init__(self, filename, batch_size=10000, transaction_size=250000):
+        self.connection = connect(filename)
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+        self.rows = []
+        self.count = 0
+        self.uncommitted = 0
+        self.started = time.time()
+
+    def write(self, dump, timestamp=None):
+        """Add one OTPDump."""
+        self.write_row(dump_row(dump, timestamp))
+
+    def write_row(self, row):
+        """Add one row built by dump_row()."""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the buffered rows, Committing when the transaction is big enough."""
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN')
+        self.connection.executemany(INSERT, rows)
+        self.count += len(rows)
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.transaction_size:
+            self.commit()
+
+    def commit(self):
+        """Commit the open transaction."""
+        if self.connection.in_transaction:
+            self.connection.execute('COMMIT')
+            self.uncommitted = 0
+
+    def rate(self):
+        """Return the rows written per second so far."""
+        return self.count / max(time.time() - self.started, 1e-9)
+
+    def close(self):
+        """Write what is left, build the indexes and close the database."""
+        self.flush()
+        self.commit()
+        for statement in INDEXES:
+            self.connection.execute(statement)
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def explain_change(region, old, new):
+    """Explain a changed word with the bitfields of its region, Return a list of {field, old, new}.
+    Fields with a decoder get their decoded values, a region without bitfields is reported as a whole.
+    old or new is None when the region was not dumped.
+    """
+    fields = sorted(OTPParser.HANDLER_FIELDS.get(REGION_NAMES[region], {}).values(), key=lambda field: field.shift)
+    if not fields:
+        return [{'field': REGION_NAMES[region], 'old': old, 'new': new}]
+    explained = []
+    for field in fields:
+        old_value = None if old is None else old >> field.shift & field.mask
+        new_value = None if new is None else new >> field.shift & field.mask
+        if old_value != new_value:
+            if field.decoder is not None:
+                old_value = None if old_value is None else field.decoder(old_value)
+                new_value = None if new_value is None else field.decoder(new_value)
+            explained.append({'field': field.key, 'old': old_value, 'new': new_value})
+    return explained
+
+
+class HistoryStore(object):
+    """Per serial history of the dumps of a board, as a base snapshot and word level deltas."""
+
+    def __init__(self, filename):
+        self.connection = connect(filename)
+        self.connection.executescript(HISTORY_SCHEMA)
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, dump, timestamp):
+        """Add one snapshot, Return its changes as a list of (region, old, new)."""
+        return self.record_many([(dump, timestamp)])[0]
+
+    def record_many(self, snapshots, errors=None):
+        """Add (dump, timestamp) snapshots in a single transaction, Return the list of changes of each.
+        Snapshots without a serial number or older than the latest one of their board raise ValueError,
+        unless errors is given, then they are skipped with (source, message) appended to it.
+        """
+        changes = []
+        self.connection.execute('BEGIN')
+        try:
+            for dump, timestamp in snapshots:
+                try:
+                    changes.append(self._record(dump, timestamp))
+                except ValueError as exception:
+                    if errors is None:
+                        raise
+                    errors.append((str(dump.source), str(exception)))
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return changes
+
+    def _record(self, dump, timestamp):
+        """Add one snapshot inside the open transaction."""
+        if not dump.present >> REGION_SERIAL & 1:
+            raise ValueError('No serial number, the history is kept per board')
+        if timestamp is None:
+            raise ValueError('No timestamp, the history is kept in time order')
+        serial = dump.words[REGION_SERIAL]
+        present = dump.present >> OTPParser.FIRST_REGION
+        words = WORDS.pack(*dump.words)
+        board = self.connection.execute('SELECT last_seen, present, words FROM boards WHERE serial_number = ?',
+                                        (serial,)).fetchone()
+        if board is None:
+            self.connection.execute('INSERT INTO boards VALUES (?, ?, ?, 1, ?, ?, ?, ?)',
+                                    (serial, timestamp, timestamp, present, words, present, words))
+            return []
+        last_seen, last_present, last_words = board
+        if timestamp < last_seen:
+            raise ValueError('Snapshot taken before the latest one of board ' + format(serial, '08x'))
+        if present == last_present and words == last_words:
+            self.connection.execute('UPDATE boards SET last_seen = ?, snapshots = snapshots + 1 WHERE serial_number = ?',
+                                    (timestamp, serial))
+            return []
+        last_present <<= OTPParser.FIRST_REGION
+        last_words = WORDS.unpack(last_words)
+        changes = []
+        for region in range(OTPParser.FIRST_REGION, OTPParser.NUM_REGIONS):
+            old = last_words[region] if last_present >> region & 1 else None
+            new = dump.words[region] if dump.present >> region & 1 else None
+            if old != new:
+                changes.append((region, old, new))
+        self.connection.executemany('INSERT INTO deltas VALUES (?, ?, ?, ?, ?)',
+                                    [(serial, timestamp) + change for change in changes])
+        self.connection.execute('UPDATE boards SET last_seen = ?, snapshots = snapshots + 1, present = ?, words = ? '
+                                'WHERE serial_number = ?', (timestamp, present, words, serial))
+        return changes
+
+    def changes(self, since=None, serial=None):
+        """Return the changes after timestamp since (all if None), of one board or every board,
+        as a list of (serial, timestamp, region, old, new) in serial and time order.
+        """
+        query = 'SELECT serial_number, timestamp, region, old_value, new_value FROM deltas'
+        conditions = []
+        parameters = []
+        if serial is not None:
+            conditions.append('serial_number = ?')
+            parameters.append(serial)
+        if since is not None:
+            conditions.append('timestamp > ?')
+            parameters.append(since)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return self.connection.execute(query + ' ORDER BY serial_number, timestamp, region', parameters).fetchall()
+
+    def snapshot(self, serial, at=None):
+        """Rebuild the dump of a board as it was at timestamp at (the latest if None),
+        Return an OTPDump, or None if the board was not seen by then.
+        """
+        board = self.connection.execute('SELECT first_seen, base_present, base_words, present, words FROM boards '
+                                        'WHERE serial_number = ?', (serial,)).fetchone()
+        if board is None or at is not None and at < board[0]:
+            return None
+        dump = OTPParser.OTPDump('serial ' + format(serial, '08x'))
+        if at is None:
+            present, words = board[3], board[4]
+        else:
+            present, words = board[1], board[2]
+        dump.words[:] = OTPParser.array(OTPParser.WORD_TYPECODE, WORDS.unpack(words))
+        dump.present = present << OTPParser.FIRST_REGION
+        if at is not None:
+            for region, new in self.connection.execute('SELECT region, new_value FROM deltas WHERE serial_number = ? '
+                                                       'AND timestamp <= ? ORDER BY timestamp', (serial, at)):
+                if new is None:
+                    dump.present &= ~(1 << region)
+                    dump.words[region] = 0
+                else:
+                    dump.present |= 1 << region
+                    dump.words[region] = new
+        return dump
+
+
+def iter_snapshots(names, errors):
+    """Yield (dump, timestamp) for text dumps (timestamped with their modification time), archives and '-'.
+    Archive records without a timestamp get the modification time of the archive.
+    Bad files are skipped with (name, message) appended to errors.
+    """
+    for name in names:
+        try:
+            if name != '-' and OTPArchive.is_archive(name):
+                modified = os.path.getmtime(name)  # For records packed with --no-timestamp
+                with OTPArchive.OTPArchive(name) as archive:
+                    for index in range(len(archive)):
+                        dump, timestamp = OTPArchive.unpack_record(archive.map, archive.offset(index))
+                        yield dump, modified if timestamp is None else timestamp
+            else:
+                for snapshot in OTPArchive.iter_text_dumps(name):
+                    yield snapshot
+        except (OTPParser.InvalidDumpError, OTPArchive.InvalidArchiveError, IOError, OSError) as exception:
+            errors.append((name, str(exception)))
+
+
+def parse_rows(filename):
+    """Worker: parse every dump of a text file, Return (rows, error or None)."""
+    try:
+        with open(filename, 'rb') as dump_file:
+            dumps = OTPParser.parse_buffer(dump_file.read(), filename)
+    except (OTPParser.InvalidDumpError, IOError, OSError) as exception:
+        return [], str(exception)
+    if not dumps:
+        return [], "Invalid OTP Dump (empty file). Please run 'vcgencmd otp_dump' to create file."
+    return [dump_row(dump) for dump in dumps], None
+
+
+def archive_rows(archive):
+    """Yield the rows of every record of an OTPArchive, the words blob is sliced straight from the file."""
+    words_offset = OTPArchive.RECORD.size - WORDS.size
+    for index in range(len(archive)):
+        offset = archive.offset(index)
+        fields = OTPArchive.RECORD.unpack_from(archive.map, offset)
+        row = word_row(fields[2].rstrip(b'\0').decode('utf-8', 'ignore') or None, fields[0] or None,
+                       fields[1] << OTPParser.FIRST_REGION, fields[3:])
+        blob = archive.map[offset + words_offset: offset + OTPArchive.RECORD.size]
+        row.append(blob)
+        yield row
+
+
+def ingest(writer, names, jobs=None, errors=None):
+    """Write the dumps of text files (parsed by a pool of jobs workers), archives and '-' for stdin.
+    Bad files are skipped, with (name, message) appended to errors if given.
+    """
+    errors = [] if errors is None else errors
+    texts = []
+    for name in names:
+        if name == '-':
+            try:
+                for dump in OTPParser.iter_dumps(getattr(sys.stdin, 'buffer', sys.stdin), 'stdin'):
+                    writer.write(dump, time.time())
+            except OTPParser.InvalidDumpError as exception:
+                errors.append((name, str(exception)))
+        elif OTPArchive.is_archive(name):
+            with OTPArchive.OTPArchive(name) as archive:
+                for row in archive_rows(archive):
+                    writer.write_row(row)
+        else:
+            texts.append(name)
+    if texts:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for name, (rows, error) in zip(texts, pool.imap(parse_rows, texts, 64)):
+                if error:
+                    errors.append((name, error))
+                for row in rows:
+                    writer.write_row(row)
+        finally:
+            pool.close()
+            pool.join()
+    return errors
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Store OTP dumps in an SQLite database.')
+    commands = parser.add_subparsers(dest='command')
+    ingest_command = commands.add_parser('ingest', help='add dumps to a database')
+    ingest_command.add_argument('database')
+    ingest_command.add_argument('paths', nargs='+',
+                                help="dump files, archives, directories, glob patterns or '-' for stdin")
+    ingest_command.add_argument('-j', '--jobs', type=int, default=None,
+                                help='worker processes parsing text dumps (default: one per core)')
+    ingest_command.add_argument('--batch-size', type=int, default=10000, help='rows per executemany')
+    record_command = commands.add_parser('record', help='add snapshots to the per board history')
+    record_command.add_argument('database')
+    record_command.add_argument('paths', nargs='+',
+                                help="dump files, archives, directories, glob patterns or '-' for stdin")
+    changes_command = commands.add_parser('changes', help='list the changes of the history, bit by bit')
+    changes_command.add_argument('database')
+    changes_command.add_argument('--since', type=float, help='only changes after this time, in seconds since the epoch')
+    changes_command.add_argument('--serial', help='serial number, in hex')
+    args = parser.parse_args(argv)
+
+    names = []
+    for name in getattr(args, 'paths', ()):
+        names.extend([name] if name == '-' else OTPFleet.expand_paths([name]))
+
+    if args.command == 'ingest':
+        writer = StoreWriter(args.database, args.batch_size)
+        try:
+            errors = ingest(writer, names, args.jobs)
+        finally:
+            writer.close()
+        for name, message in errors:
+            sys.stderr.write(name + ': ' + message + '\n')
+        sys.stderr.write('Stored %d dumps, %.0f rows/s, %d failed.\n' % (writer.count, writer.rate(), len(errors)))
+        return 1 if errors else 0
+
+    if args.command == 'record':
+        errors = []
+        with HistoryStore(args.database) as history:
+            changes = history.record_many(iter_snapshots(names, errors), errors)
+        for name, message in errors:
+            sys.stderr.write(name + ': ' + message + '\n')
+        changed = sum(1 for change in changes if change)
+        sys.stderr.write('Recorded %d snapshots, %d with changes, %d failed.\n' % (len(changes), changed, len(errors)))
+        return 1 if errors else 0
+
+    if args.command == 'changes':
+        serial = int(args.serial, 16) if args.serial else None
+        with HistoryStore(args.database) as history:
+            for serial, timestamp, region, old, new in history.changes(args.since, serial):
+                print(json.dumps({
+                    'serial_number': format(serial, '08x'),
+                    'timestamp': timestamp,
+                    'region': REGION_NAMES[region],
+                    'old': None if old is None else format(old, '08x'),
+                    'new': None if new is None else format(new, '08x'),
+                    'fields': explain_change(region, old, new),
+                }, sort_keys=True))
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Raspberry Pi Peripheral Register Decoder
+
+ Copyright 2019-2022 Jasmine Iwanek & Dylan Morrison & Arya Voronova
+
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify, merge,
+ publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
+ to whom the Software is furnished to do so, subject to the following conditions:
+
+ The above copyright notice and this permission notice shall be included in all copies or
+ substantial portions of the Software.
+
+ THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+ PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+ FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+ DEALINGS IN THE SOFTWARE.
+
+ Usage
+ call ./RegisterMap.py <dumpfile|-> [-f text|json] [--peripheral-base ADDRESS] [--headers DIR]
+ A register dump is one 'address:value' line per register, in hex, for example '7e20f000:00000003'.
+ Every register is decoded with the register map of test-harness/include/bcm2708_chip: the
+ HW_REGISTER_RW/RO defines give the addresses, and the generated _MASK, _WIDTH, _RESET and
+ <field>_BITS defines the bitfields. Addresses are VideoCore bus addresses (0x7e......), use
+ --peripheral-base for dumps taken from the ARM side, for example 0x3f000000 on a Pi 3.
+
+ Parsing the 113 headers takes a while, so the compiled map is cached with the SHA-1 of the
+ headers in $XDG_CACHE_HOME/rpi-registers (~/.cache/rpi-registers by default).
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+HEADER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test-harness', 'include', 'bcm2708_chip')
+BUS_BASE = 0x7e000000
+CACHE_VERSION = 1
+
+DEFINE = re.compile(r'^\s*#define\s+(\w+)\s+(.*?)\s*(?://.*)?$', re.MULTILINE)
+REGISTER = re.compile(r'^HW_REGISTER_(RW|RO)\s*\((.*)\)$')
+BLOCK_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+BITS = re.compile(r'^(\d+):(\d+)$')
+EXPRESSION_TOKEN = re.compile(r'\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|([A-Za-z_]\w*)|(<<|>>|[-+*|&()]))')
+
+
+class InvalidRegisterDumpError(Exception):
+    """Raised when a register dump line can't be parsed."""
+    pass
+
+
+def evaluate(expression, symbols):
+    """Evaluate a constant C expression of numbers, known defines, + - * | & << >> and brackets,
+    Return its value, or None if it uses anything else.
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = EXPRESSION_TOKEN.match(expression, position)
+        if not match:
+            return None
+        number, name, operator = match.groups()
+        if number:
+            tokens.append(str(int(number, 0)))
+        elif name:
+            if name not in symbols:
+                return None
+            tokens.append(str(symbols[name]))
+        else:
+            tokens.append(operator)
+        position = match.end()
+    try:
+        return int(eval(' '.join(tokens), {'__builtins__': None}, {}))
+    except (SyntaxError, TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_header(text, symbols):
+    """Parse the register defines of a header, adding its numeric defines to the symbols dict,
+    Return a list of registers as (name, address, access, mask, width, reset, fields),
+    fields being a tuple of (name, shift, mask) from the least significant bit up.
+    """
+    registers = []
+    current = None
+    for name, value in DEFINE.findall(BLOCK_COMMENT.sub(' ', text)):
+        register = REGISTER.match(value)
+        if register:
+            address = evaluate(register.group(2), symbols)
+            if address is None:
+                current = None
+                continue
+            current = [name, address, register.group(1), 0xffffffff, 32, None, []]
+            registers.append(current)
+            continue
+        bits = BITS.match(value)
+        if bits and current is not None and name.startswith(current[0] + '_') and name.endswith('_BITS'):
+            msb, lsb = int(bits.group(1)), int(bits.group(2))
+            msb, lsb = max(msb, lsb), min(msb, lsb)  # A few headers have them the wrong way round
+            current[6].append((name[len(current[0]) + 1: -len('_BITS')], lsb, (1 << (msb - lsb + 1)) - 1))
+            continue
+        number = evaluate(value, symbols)
+        if number is None:
+            continue
+        symbols[name] = number
+        if current is not None:
+            if name == current[0] + '_MASK':
+                current[3] = number
+            elif name == current[0] + '_WIDTH':
+                current[4] = number
+            elif name == current[0] + '_RESET':
+                current[5] = number
+    for register in registers:
+        register[6] = tuple(sorted(register[6], key=lambda field: field[1]))
+    return [tuple(register) for register in registers]
+
+
+def parse_headers(headers):
+    """Parse a list of (file name, text) headers, Return a list of (file name,) + register tuples.
+    Headers use the base addresses of each other, so the defines of all of them are collected first.
+    """
+    symbols = {}
+    for _, text in headers:
+        parse_header(text, symbols)
+    registers = []
+    for name, text in headers:
+        registers.extend((name,) + register for register in parse_header(text, symbols))
+    return registers
+
+
+def cache_directory():
+    """Return the directory of the compiled register map cache."""
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                        'rpi-registers')
+
+
+def load_registers(directory=HEADER_DIR, cache=True):
+    """Return the RegisterMap of every header of directory.
+    The parsed map is cached on disk with the SHA-1 of the headers, and parsed again when one changes.
+    """
+    headers = []
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.h'):
+            with open(os.path.join(directory, name), 'rb') as header:
+                data = header.read()
+            digest.update(name.encode('utf-8') + b'\0' + hashlib.sha1(data).digest())
+            headers.append((name, data))
+    key = digest.hexdigest()
+    cache_file = os.path.join(cache_directory(), 'v%d-py%d%d.marshal' % ((CACHE_VERSION,) + tuple(sys.version_info[:2])))
+    if cache:
+        try:
+            with open(cache_file, 'rb') as cache_stream:
+                cached_key, registers = marshal.loads(cache_stream.read())
+            if cached_key == key:
+                return RegisterMap(registers)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            pass
+    registers = parse_headers([(name, data.decode('latin-1')) for name, data in headers])
+    if cache:
+        try:
+            if not os.path.isdir(cache_directory()):
+                os.makedirs(cache_directory())
+            temporary = cache_file + '.' + str(os.getpid())
+            with open(temporary, 'wb') as cache_stream:
+                marshal.dump((key, registers), cache_stream)
+            os.rename(temporary, cache_file)
+        except (IOError, OSError):
+            pass  # Read-only home, parse again next time
+    return RegisterMap(registers)
+
+
+class Register(object):
+    """A register of the map, with its bitfields compiled to (name, shift, mask)."""
+    __slots__ = ('header', 'name', 'address', 'access', 'mask', 'width', 'reset', 'fields')
+
+    def __init__(self, header, name, address, access, mask, width, reset, fields):
+        self.header = header
+        self.name = name
+        self.address = address
+        self.access = access
+        self.mask = mask
+        self.width = width
+        self.reset = reset
+        self.fields = fields
+
+    def decode(self, value):
+        """Split a value into its bitfields, Return a list of (name, value)."""
+        return [(name, value >> shift & mask) for name, shift, mask in self.fields]
+
+
+class RegisterMap(object):
+    """Registers by address and by name.
+    Where headers give several names to one address, the first one (in file order) decodes it.
+    """
+
+    def __init__(self, registers):
+        self.by_address = {}
+        self.by_name = {}
+        for register in registers:
+            register = Register(*register)
+            self.by_address.setdefault(register.address, register)
+            self.by_name.setdefault(register.name, register)
+
+    def __len__(self):
+        return len(self.by_address)
+
+    def get(self, address):
+        """Return the Register at a bus address, or None."""
+        return self.by_address.get(address)
+
+    def decode(self, address, value):
+        """Decode one register value, Return (Register or None, [(field, value)])."""
+        register = self.by_address.get(address)
+        if register is None:
+            return None, []
+        return register, register.decode(value)
+
+
+def parse_dump(lines, peripheral_base=BUS_BASE):
+    """Yield (bus address, value) for the 'address:value' lines of a register dump.
+    Addresses are moved from peripheral_base to the bus address space of the headers.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        address, separator, value = line.partition(':')
+        try:
+            if not separator:
+                raise ValueError(line)
+            yield int(address, 16) - peripheral_base + BUS_BASE, int(value, 16)
+        except ValueError:
+            raise InvalidRegisterDumpError('Invalid register dump line ' + str(number) + ": '" + line + "'")
+
+
+def main(argv=None):
+    """Command line entry point."""
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Decode a peripheral register dump with the bcm2708_chip headers.')
+    parser.add_argument('dumpfile', nargs='?', default='-', help="'address:value' lines, or '-' for stdin (default)")
+    parser.add_argument('-f', '--format', choices=('text', 'json'), default='text', help='output format')
+    parser.add_argument('--peripheral-base', type=lambda text: int(text, 16), default=BUS_BASE,
+                        help='peripheral base address of the dump, in hex (default: 7e000000)')
+    parser.add_argument('--headers', default=HEADER_DIR, help='directory of the register headers')
+    parser.add_argument('--no-cache', action='store_true', help="don't use or update the compiled map cache")
+    args = parser.parse_args(argv)
+
+    registers = load_registers(args.headers, not args.no_cache)
+    stream = sys.stdin if args.dumpfile == '-' else open(args.dumpfile)
+    try:
+        for address, value in parse_dump(stream, args.peripheral_base):
+            register, fields = registers.decode(address, value)
+            if args.format == 'json':
+                print(json.dumps({
+                    'address': format(address, '#010x'),
+                    'value': format(value, '#010x'),
+                    'register': register and register.name,
+                    'fields': dict(fields),
+                }, sort_keys=True))
+            elif register is None:
+                print(format(address, '#010x') + ' (unknown)'.ljust(42) + ' = ' + format(value, '#010x'))
+            else:
+                print(format(address, '#010x') + ' ' + register.name.ljust(41) + ' = ' + format(value, '#010x'))
+                for name, field in fields:
+                    print('    ' + name.ljust(48) + ': ' + hex(field))
+    except InvalidRegisterDumpError as exception:
+        sys.exit(str(exception))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())